@@ -19,6 +19,7 @@ from alabamaEncode.core.extras.autothumbnail.auto_thumbnailer import (
 )
 from alabamaEncode.core.extras.autothumbnail.opt import autothumbnailOptions
 from alabamaEncode.core.job import AlabamaEncodingJob
+from alabamaEncode.core.util.bin_utils import BinaryRegistry
 from alabamaEncode.parallel_execution.celery_app import app
 from alabamaEncode.parallel_execution.worker import worker
 
@@ -105,6 +106,9 @@ def main():
             quit()
         case "worker":
             worker(args.workers)
+        case "doctor":
+            print(BinaryRegistry.doctor())
+            quit()
         case "autothumbnailer":
             if not os.path.exists(args.input):
                 print(f"File {args.input} does not exist")
@@ -7,6 +7,7 @@ from alabamaEncode.encoder.encoder_factory import (
     get_encoder_from_string,
 )
 from alabamaEncode.encoder.impl.Svtenc import EncoderSvt
+from alabamaEncode.parallel_execution.resources import parse_memory_size
 
 
 def read_args(ctx):
@@ -33,6 +34,10 @@ def read_args(ctx):
 
     subparsers.add_parser("clear", help="clear celery queue")
 
+    subparsers.add_parser(
+        "doctor", help="Show the binaries we found, their versions and capabilities"
+    )
+
     auto_thumbnailer = subparsers.add_parser(
         "autothumbnailer", help="Pick and extract perfect thumbnail frames"
     )
@@ -95,6 +100,34 @@ def read_args(ctx):
         dest="use_celery",
     )
 
+    encode.add_argument(
+        "--celery_staging",
+        help="Serve celery workers a segment of the source for each chunk instead of them reading the input from "
+        "shared storage, copy: keyframe aligned stream copy, lossless: ffv1 intermediate",
+        type=str,
+        choices=["copy", "lossless"],
+        default=ctx.celery_staging,
+        dest="celery_staging",
+    )
+
+    encode.add_argument(
+        "--celery_port",
+        help="Port celery workers reach this machine on, to upload encoded chunks and fetch --celery_staging "
+        "segments, 0 for any free port",
+        type=int,
+        default=ctx.celery_port,
+        dest="celery_port",
+    )
+
+    encode.add_argument(
+        "--dont_speculate",
+        help="With --celery, don't start a copy of a chunk that runs well past its predicted time on a faster "
+        "idle worker at the end of the encode",
+        action="store_false",
+        default=ctx.celery_speculation,
+        dest="celery_speculation",
+    )
+
     encode.add_argument(
         "--autocrop",
         help="Automatically crop the video",
@@ -152,6 +185,69 @@ def read_args(ctx):
         dest="multiprocess_workers",
     )
 
+    encode.add_argument(
+        "--executor",
+        help="Run chunk jobs in threads or in a process pool, process avoids the GIL on big core counts",
+        type=str,
+        default=ctx.executor,
+        choices=["thread", "process"],
+        dest="executor",
+    )
+
+    encode.add_argument(
+        "--max-memory",
+        help="Memory budget for all chunk jobs together, e.g. 48G or 1500M. "
+        "A job only starts if its expected footprint fits, -1 for 80%% of ram",
+        type=parse_memory_size,
+        default=ctx.max_memory,
+        dest="max_memory",
+    )
+
+    encode.add_argument(
+        "--dont_rebalance_tail_threads",
+        help="Keep every chunk at the same thread count, by default the last chunks get more threads "
+        "as the queue drains so cores don't idle at the end",
+        action="store_false",
+        default=ctx.rebalance_tail_threads,
+        dest="rebalance_tail_threads",
+    )
+
+    encode.add_argument(
+        "--two_stage",
+        help="Run each chunk's analysis (target vmaf probes, grain, luma boost) and final encode as separate "
+        "jobs, analysis of later chunks overlaps the final encodes of earlier ones",
+        action="store_true",
+        default=ctx.two_stage,
+        dest="two_stage",
+    )
+
+    encode.add_argument(
+        "--analysis_workers",
+        help="Concurrent analysis jobs with --two_stage, -1 for a quarter of the cores",
+        type=int,
+        default=ctx.analysis_workers,
+        dest="analysis_workers",
+    )
+
+    encode.add_argument(
+        "--kv_backend",
+        help="Storage of the temp folder's key-value store, auto uses sqlite unless the temp folder is on a "
+        "network filesystem (nfs, smb), where sqlite's WAL mode isn't safe and json is used instead",
+        type=str,
+        default=ctx.kv_backend,
+        choices=["auto", "sqlite", "json"],
+        dest="kv_backend",
+    )
+
+    encode.add_argument(
+        "--kv_flush_interval",
+        help="Seconds to hold key-value store writes in memory before flushing them in one batch, "
+        "a crash loses up to that many seconds of writes, 0 (default) writes through",
+        type=float,
+        default=ctx.kv_flush_interval,
+        dest="kv_flush_interval",
+    )
+
     encode.add_argument(
         "--ssim-db-target",
         type=float,
@@ -231,7 +327,7 @@ def read_args(ctx):
 
     encode.add_argument(
         "--chunk_order",
-        help="Encode chunks in a specific order",
+        help="Encode chunks in a specific order, lpt starts the chunks estimated to take longest first",
         type=str,
         default=ctx.chunk_order,
         choices=[
@@ -241,6 +337,7 @@ def read_args(ctx):
             "length_asc",
             "reverse",
             "even",
+            "lpt",
         ],
         dest="chunk_order",
     )
@@ -662,6 +759,7 @@ def read_args(ctx):
             args.command == "autothumbnailer"
             or args.command == "worker"
             or args.command == "clear"
+            or args.command == "doctor"
     ):
         return ctx, args
 
@@ -678,9 +776,19 @@ def read_args(ctx):
     ctx.vbr_perchunk_optimisation = args.vbr_perchunk_optimisation
     ctx.crf_based_vmaf_targeting = args.crf_based_vmaf_targeting
     ctx.use_celery = args.use_celery
+    ctx.celery_staging = args.celery_staging
+    ctx.celery_port = args.celery_port
+    ctx.celery_speculation = args.celery_speculation
     ctx.prototype_encoder.override_flags = args.encoder_flag_override
     ctx.prototype_encoder.speed = args.encoder_speed_override
     ctx.multiprocess_workers = args.multiprocess_workers
+    ctx.executor = args.executor
+    ctx.max_memory = args.max_memory
+    ctx.rebalance_tail_threads = args.rebalance_tail_threads
+    ctx.two_stage = args.two_stage
+    ctx.analysis_workers = args.analysis_workers
+    ctx.kv_backend = args.kv_backend
+    ctx.kv_flush_interval = args.kv_flush_interval
     ctx.bitrate_adjust_mode = args.bitrate_adjust_mode
     ctx.bitrate_undershoot = args.bitrate_undershoot
     ctx.bitrate_overshoot = args.bitrate_overshoot
@@ -1,6 +1,8 @@
 import hashlib
 import os
 
+from alabamaEncode.core.media_info import MediaInfo
+
 
 def parse_paths(ctx):
     """
@@ -21,6 +23,9 @@ def parse_paths(ctx):
 
     ctx.temp_folder += "/"
 
+    # persist ffprobe results so resumes don't re-probe the source
+    MediaInfo.set_cache_folder(ctx.temp_folder)
+
     ctx.input_file = os.path.join(ctx.temp_folder, "temp.mkv")
 
     if not os.path.exists(ctx.raw_input_file):
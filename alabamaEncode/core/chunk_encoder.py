@@ -4,6 +4,8 @@ import os
 from tqdm import tqdm
 
 from alabamaEncode.core.context import AlabamaContext
+from alabamaEncode.core.util.cli_executor import process_owner
+from alabamaEncode.core.util.cpu_topology import CoreSet
 from alabamaEncode.core.util.timer import Timer
 from alabamaEncode.encoder.impl.Svtenc import EncoderSvt
 from alabamaEncode.encoder.stats import EncodeStats
@@ -24,7 +26,14 @@ class ChunkEncoder(BaseCommandObject):
         self.ctx = ctx
         self.chunk = chunk
         self.encoded_a_frame_callback: callable = None
-        self.pin_to_core = -1
+        self.core_set: CoreSet | None = None
+        # overrides the encoder's threads, the scheduler hands the last chunks more of them
+        self.threads: int | None = None
+        # "analysis" or "final" while the two stage scheduler has the chunk, None when one job does both
+        self.stage: str | None = None
+        # left by run_analysis for the final encode
+        self.analyzed_encoder = None
+        self.timing = Timer()
         self.run_on_celery = False
 
     def supports_encoded_a_frame_callback(self):
@@ -33,47 +42,77 @@ class ChunkEncoder(BaseCommandObject):
         )
 
     def run(self) -> [int, EncodeStats]:
-        timeing = Timer()
-
-        timeing.start("chunk")
+        # everything this chunk starts is accounted to it, see ResourceMonitor
+        with process_owner(self.chunk.chunk_index):
+            if self.analyzed_encoder is None and not self._analyze():
+                return
+            return self._final_encode()
+
+    def run_analysis(self) -> bool:
+        """
+        Only the analyze chain, for the two stage scheduler, run() does the final encode afterwards
+        :return: False if the analysis failed
+        """
+        with process_owner(self.chunk.chunk_index):
+            return self._analyze()
+
+    def _failed(self, e: Exception):
+        tqdm.write(f"{self.chunk.log_prefix()}encoding failed: {e}")
+        if os.path.exists(self.chunk.chunk_path):
+            os.remove(self.chunk.chunk_path)
+
+    def _analyze(self) -> bool:
+        self.timing = Timer()
         try:
-            timeing.start("analyze_step")
+            self.timing.start("analyze_step")
 
             enc = self.ctx.get_encoder()
-            enc.pin_to_core = self.pin_to_core
+            enc.core_set = self.core_set
+            if self.threads is not None:
+                enc.threads = self.threads
             enc.chunk = self.chunk
             for step in self.ctx.chunk_analyze_chain:
-                timeing.start(f"analyze_step_{step.__class__.__name__}")
+                self.timing.start(f"analyze_step_{step.__class__.__name__}")
                 # crf_before = enc.crf
                 enc = step.run(self.ctx, self.chunk, enc)
                 # print(
                 #     f"analyze_step_{step.__class__.__name__} crf before: {crf_before}; after: {enc.crf}"
                 # )
-                timeing.stop(f"analyze_step_{step.__class__.__name__}")
+                self.timing.stop(f"analyze_step_{step.__class__.__name__}")
 
             self.ctx.get_kv().set("final_chunk_crf", enc.chunk.chunk_index, enc.crf)
 
-            rate_search_time = timeing.stop("analyze_step")
-
-            enc.running_on_celery = self.run_on_celery
-
-            if self.ctx.dry_run:
-                print(f"dry run chunk: {self.chunk.chunk_index}")
-                print(self.ctx.chunk_encode_class.dry_run(enc, self.chunk))
-                return
+            self.timing.stop("analyze_step")
+        except Exception as e:
+            self._failed(e)
+            return False
+
+        self.analyzed_encoder = enc
+        return True
+
+    def _final_encode(self) -> [int, EncodeStats]:
+        enc, self.analyzed_encoder = self.analyzed_encoder, None
+        # with two stages the final encode gets its own cores and maybe more threads than the analysis had
+        enc.core_set = self.core_set
+        if self.threads is not None:
+            enc.threads = self.threads
+
+        if self.ctx.dry_run:
+            print(f"dry run chunk: {self.chunk.chunk_index}")
+            print(self.ctx.chunk_encode_class.dry_run(enc, self.chunk))
+            return
 
-            timeing.start("final_step")
+        try:
+            self.timing.start("final_step")
             chunk_stats = self.ctx.chunk_encode_class.run(
                 enc,
                 chunk=self.chunk,
                 ctx=self.ctx,
                 encoded_a_frame=self.encoded_a_frame_callback,
             )
-            timeing.stop("final_step")
+            self.timing.stop("final_step")
         except Exception as e:
-            tqdm.write(f"{self.chunk.log_prefix()}encoding failed: {e}")
-            if os.path.exists(self.chunk.chunk_path):
-                os.remove(self.chunk.chunk_path)
+            self._failed(e)
             return
 
         valid = self.chunk.verify_integrity(
@@ -81,17 +120,20 @@ class ChunkEncoder(BaseCommandObject):
         )
         self.ctx.get_kv().set("chunk_integrity", self.chunk.chunk_index, not valid)
 
-        timeing.stop("chunk")
-        timing_stats = timeing.finish()
+        timing_stats = self.timing.finish()
+        # the time the chunk spent working, not waiting between the stages
+        timing_stats["chunk"] = (
+            timing_stats["analyze_step"] + timing_stats["final_step"]
+        )
 
         if chunk_stats is None:
-            return self.pin_to_core, None
+            return self.core_set, None
 
         chunk_stats.total_fps = round(
             self.chunk.get_frame_count() / (timing_stats["chunk"]), 2
         )
         chunk_stats.chunk_index = self.chunk.chunk_index
-        chunk_stats.rate_search_time = rate_search_time
+        chunk_stats.rate_search_time = timing_stats["analyze_step"]
 
         with open(f"{self.ctx.temp_folder}/chunks.log", "a") as f:
             f.write(json.dumps(chunk_stats.__dict__()) + "\n")
@@ -100,4 +142,4 @@ class ChunkEncoder(BaseCommandObject):
             "chunk_timing", self.chunk.chunk_index, timing_stats, individual_mode=True
         )
 
-        return self.pin_to_core, chunk_stats.__dict__()
+        return self.core_set, chunk_stats.__dict__()
@@ -34,8 +34,18 @@ class AlabamaContext:
     def dict(self):
         return {
             "use_celery": self.use_celery,
+            "celery_staging": self.celery_staging,
+            "celery_port": self.celery_port,
+            "celery_speculation": self.celery_speculation,
             "multiprocess_workers": self.multiprocess_workers,
+            "executor": self.executor,
+            "max_memory": self.max_memory,
+            "kv_backend": self.kv_backend,
+            "kv_flush_interval": self.kv_flush_interval,
             "throughput_scaling": self.throughput_scaling,
+            "rebalance_tail_threads": self.rebalance_tail_threads,
+            "two_stage": self.two_stage,
+            "analysis_workers": self.analysis_workers,
             "log_level": self.log_level,
             "print_analysis_logs": self.print_analysis_logs,
             "dry_run": self.dry_run,
@@ -109,13 +119,33 @@ class AlabamaContext:
         return self.dict().__iter__()
 
     use_celery: bool = False
+    # "copy" or "lossless" to serve celery workers segments of the source instead of them reading it, "" for off
+    celery_staging = ""
+    # port celery workers reach the coordinator on, for segments and uploading chunks, 0 for any free one
+    celery_port: int = 0
+    # copy a chunk that runs well past its predicted time to a faster idle worker once the queue is empty
+    celery_speculation = True
     offload_server = ""
     multiprocess_workers: int = -1
+    # "thread" or "process", what the local chunk jobs run in
+    executor = "thread"
+    # bytes all local chunk jobs together may use, -1 for 80% of ram
+    max_memory: int = -1
     throughput_scaling = False
+    # give the last chunks more encoder threads as the queue drains
+    rebalance_tail_threads = True
+    # run the analyze chain and the final encode of a chunk as separate jobs with their own limits
+    two_stage = False
+    # concurrent analysis jobs in two stage mode, -1 for a quarter of the cores
+    analysis_workers: int = -1
     log_level: int = 0
     print_analysis_logs = False
     dry_run: bool = False
     kv: [AlabamaKv | None] = None
+    # "sqlite", "json", or "auto" for sqlite unless the temp folder is on a network filesystem
+    kv_backend = "auto"
+    # seconds the kv holds writes in memory, 0 writes through
+    kv_flush_interval: float = 0
     multi_res_pipeline = False
 
     temp_folder: str = ""
@@ -280,7 +310,11 @@ class AlabamaContext:
 
     def get_kv(self) -> AlabamaKv:
         if self.kv is None:
-            self.kv = AlabamaKv(self.temp_folder)
+            self.kv = AlabamaKv(
+                self.temp_folder,
+                backend=self.kv_backend,
+                flush_interval=self.kv_flush_interval,
+            )
         return self.kv
 
     def get_title(self):
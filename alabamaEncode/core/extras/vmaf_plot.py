@@ -10,7 +10,9 @@ from alabamaEncode.scene.sequence import ChunkSequence
 def plot_vmaf(ctx: AlabamaContext, sequence: ChunkSequence, show_bpp=False):
     print("Plotting vmaf...")
     vmaf_scores = ctx.get_kv().get_all("vmaf_frame_scores")
-    crfs = ctx.get_kv().get_all("final_chunk_crf")
+    # plot in chunk order, buckets don't guarantee any
+    vmaf_scores = dict(sorted(vmaf_scores.items(), key=lambda x: int(x[0])))
+    crfs = ctx.get_kv().get_many("final_chunk_crf", vmaf_scores.keys())
 
     bpp = {}
     pixels_in_frame = sequence.chunks[0].width * sequence.chunks[0].height
@@ -53,10 +55,7 @@ def plot_vmaf(ctx: AlabamaContext, sequence: ChunkSequence, show_bpp=False):
     plt.axhline(ctx.vmaf, color="g", linestyle="--", label="Target VMAF")
 
     crf_values = []
-    for chunk_scores in vmaf_scores.values():
-        chunk_num = list(vmaf_scores.keys())[
-            list(vmaf_scores.values()).index(chunk_scores)
-        ]
+    for chunk_num, chunk_scores in vmaf_scores.items():
         crf_values.extend([crfs[chunk_num]] * len(chunk_scores))
 
     ax1 = plt.gca()
@@ -9,6 +9,8 @@ import requests
 import websockets
 from tqdm import tqdm
 
+from alabamaEncode.parallel_execution.progress import get_encode_progress
+
 
 class WebsiteUpdate:
 
@@ -23,6 +25,11 @@ class WebsiteUpdate:
         self.update_max_freq_sec = 1
         self.ws_server = None
 
+    def get_proc_done(self) -> float:
+        # while chunks are encoding the scheduler's progress sampler is fresher than the last pushed value
+        progress = get_encode_progress()
+        return progress.percent if progress is not None else self.proc_done
+
     async def update_website(self):
         api_url = os.environ.get("status_update_api_url", "")
         token = os.environ.get("status_update_api_token", "")
@@ -45,7 +52,7 @@ class WebsiteUpdate:
                 "action": "update",
                 "data": {
                     "img": self.ctx.poster_url,
-                    "status": round(self.proc_done, 1),  # rounded
+                    "status": round(self.get_proc_done(), 1),  # rounded
                     "title": self.ctx.get_title(),
                     "phase": self.current_step_name,
                 },
@@ -133,12 +140,17 @@ class WebsiteUpdate:
                 "type": "status",
                 "data": {
                     "img": self.ctx.poster_url,
-                    "status": round(self.proc_done, 1),  # rounded
+                    "status": round(self.get_proc_done(), 1),  # rounded
                     "title": self.ctx.get_title(),
                     "phase": self.current_step_name,
                 },
             }
 
+            progress = get_encode_progress()
+            if progress is not None:
+                status_data["data"]["fps"] = round(progress.fps, 2)
+                status_data["data"]["eta"] = round(progress.eta)
+
             await self.ws_server.publish(json.dumps(worker_data), type="worker")
             await self.ws_server.publish(json.dumps(status_data), type="status")
             await asyncio.sleep(0.5)
@@ -4,8 +4,15 @@ import re
 import time
 from typing import Any
 
+from alabamaEncode.core.media_info import MediaInfo
 from alabamaEncode.core.util.bin_utils import get_binary, verify_ffmpeg_library
 from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.ivf import (
+    is_ivf,
+    count_ivf_frames,
+    IvfReader,
+    IvfFormatError,
+)
 from alabamaEncode.core.util.path import PathAlabama
 
 
@@ -26,20 +33,27 @@ class Ffmpeg:
     @staticmethod
     def get_frame_count(path: PathAlabama) -> int:
         """
-        Returns the frame count of the video
+        Returns the frame count of the video, counted by demuxing the whole file once and then cached
         :param path: path to the video
         :return: int
         """
-        path.check_video()
-        return (
-            run_cli(
-                f"ffprobe -v error -select_streams v:0 -count_packets -show_entries stream=nb_read_packets "
-                f"-of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
+        if is_ivf(path.get()):
+            path.check_video()
+            return count_ivf_frames(path.get())
+
+        info = MediaInfo.probe(path)
+        if info.frame_count == -1:
+            info.frame_count = (
+                run_cli(
+                    f"ffprobe -v error -select_streams v:0 -count_packets -show_entries stream=nb_read_packets "
+                    f"-of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
+                )
+                .verify()
+                .strip_mp4_warning()
+                .get_as_int()
             )
-            .verify()
-            .strip_mp4_warning()
-            .get_as_int()
-        )
+            info.save()
+        return info.frame_count
 
     @staticmethod
     def get_frame_count_fast(path: PathAlabama):
@@ -49,16 +63,7 @@ class Ffmpeg:
 
     @staticmethod
     def get_tracks(path: PathAlabama):
-        path.check_video()
-        out = (
-            run_cli(
-                f'{get_binary("ffprobe")} -v error -show_entries stream -of json {path.get_safe()}'
-            )
-            .verify()
-            .strip_mp4_warning()
-            .get_output()
-        )
-        return json.loads(out)["streams"]
+        return MediaInfo.probe(path).streams
 
     @staticmethod
     def get_video_length(path: PathAlabama, sexagesimal=False) -> float | str:
@@ -68,71 +73,44 @@ class Ffmpeg:
         :param path: Path to the video
         :return: float
         """
-        path.check_video()
-        cli_command = (
-            f"ffprobe -v error -show_entries format=duration {'-sexagesimal' if sexagesimal else ''}"
-            f" -of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
-        )
-        try:
-            out = (
-                run_cli(cli_command)
-                .verify(
-                    bad_output_hints=["N/A", "Invalid data found"],
-                    fail_message=f"ffprobe failed, {cli_command}",
-                )
-                .strip_mp4_warning()
-                .get_output()
-            )
-        except RuntimeError:
+        if is_ivf(path.get()):
+            path.check_video()
+            with IvfReader(path.get()) as ivf:
+                length = ivf.get_duration()
+        else:
+            length = MediaInfo.probe(path).get_duration()
+        if length is None:
             frame_count = Ffmpeg.get_frame_count(path)
             fps = Ffmpeg.get_video_frame_rate(path)
-            return frame_count / fps
+            length = frame_count / fps
 
-        return out if sexagesimal else float(out)
+        if sexagesimal:
+            # same format as ffprobe's -sexagesimal, eg. 0:42:07.125000
+            minutes, seconds = divmod(length, 60)
+            hours, minutes = divmod(int(minutes), 60)
+            return f"{hours}:{minutes:02d}:{seconds:09.6f}"
+        return length
 
     @staticmethod
     def get_total_bitrate(path: PathAlabama) -> float:
         path.check_video()
-        return (os.path.getsize(path.get()) * 8) / Ffmpeg.get_video_length(path)
+        length = Ffmpeg.get_video_length(path)
+        if length <= 0 and is_ivf(path.get()):
+            # an ivf without frames, same as any other broken chunk
+            raise IvfFormatError(f"{path.get()} has no frames")
+        return (os.path.getsize(path.get()) * 8) / length
 
     @staticmethod
     def get_height(path: PathAlabama) -> int:
-        path.check_video()
-        return (
-            run_cli(
-                f"ffprobe -v error -select_streams v:0 -show_entries stream=height "
-                f"-of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
-            )
-            .verify()
-            .strip_mp4_warning()
-            .get_as_int()
-        )
+        return MediaInfo.probe(path).get_height()
 
     @staticmethod
     def get_width(path: PathAlabama) -> int:
-        path.check_video()
-        return (
-            run_cli(
-                f"ffprobe -v error -select_streams v:0 -show_entries stream=width "
-                f"-of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
-            )
-            .verify()
-            .strip_mp4_warning()
-            .get_as_int()
-        )
+        return MediaInfo.probe(path).get_width()
 
     @staticmethod
     def get_pix_fmt(path: PathAlabama) -> str:
-        path.check_video()
-        return (
-            run_cli(
-                f"ffprobe -v error -select_streams v:0 -show_entries stream=pix_fmt "
-                f"-of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
-            )
-            .verify()
-            .strip_mp4_warning()
-            .get_output()
-        )
+        return MediaInfo.probe(path).get_pix_fmt()
 
     @staticmethod
     def get_bit_depth(path: PathAlabama) -> int:
@@ -149,17 +127,7 @@ class Ffmpeg:
     @staticmethod
     def is_hdr(path: PathAlabama) -> bool:
         """Check if a video is HDR"""
-        path.check_video()
-        out = (
-            run_cli(
-                (
-                    f"ffprobe -v quiet -show_entries stream=color_transfer "
-                    f"-of csv=p=0 -select_streams v:0 {path.get_safe()}"
-                )
-            )
-            .get_output()
-            .strip()
-        )
+        out = MediaInfo.probe(path).get_color_transfer()
 
         if "bt709" in out or "unknown" in out:
             return False
@@ -167,35 +135,11 @@ class Ffmpeg:
 
     @staticmethod
     def get_video_frame_rate(file: PathAlabama) -> float:
-        file.check_video()
-        result = (
-            run_cli(
-                (
-                    f"ffprobe -v error -select_streams v -of default=noprint_wrappers=1:nokey=1"
-                    f" -show_entries stream=r_frame_rate {file.get_safe()}"
-                )
-            )
-            .verify(bad_output_hints=[""])
-            .strip_mp4_warning()
-            .get_output()
-            .split("/")
-        )
-        return float(result[0]) / float(result[1])
+        return MediaInfo.probe(file).get_frame_rate()
 
     @staticmethod
     def get_fps_fraction(file: PathAlabama) -> str:
-        file.check_video()
-        return (
-            run_cli(
-                (
-                    f"ffprobe -v error -select_streams v -of default=noprint_wrappers=1:nokey=1"
-                    f" -show_entries stream=r_frame_rate {file.get_safe()}"
-                )
-            )
-            .verify(bad_output_hints=[""])
-            .strip_mp4_warning()
-            .get_output()
-        )
+        return MediaInfo.probe(file).get_fps_fraction()
 
     @staticmethod
     def get_source_bitrates(
@@ -262,16 +206,7 @@ class Ffmpeg:
 
     @staticmethod
     def get_codec(path: PathAlabama) -> str:
-        path.check_video()
-        return (
-            run_cli(
-                f"ffprobe -v error -select_streams v:0 -show_entries stream=codec_name "
-                f"-of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
-            )
-            .verify()
-            .strip_mp4_warning()
-            .get_output()
-        )
+        return MediaInfo.probe(path).get_codec()
 
     @staticmethod
     def get_vmaf_motion(chunk) -> float:
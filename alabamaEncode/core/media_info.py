@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import threading
+from typing import List
+
+from alabamaEncode.core.util.bin_utils import get_binary
+from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.kv import write_json_atomic
+from alabamaEncode.core.util.path import PathAlabama
+
+
+class MediaInfo:
+    """
+    Everything ffprobe knows about a file from a single `-show_streams -show_format` call.
+    Probes are memoised in-process and, when a cache folder is set, persisted to disk.
+    Both caches are keyed by path+size+mtime, so a file that changes gets probed again.
+
+    MediaInfo.set_cache_folder(ctx.temp_folder)
+    info = MediaInfo.probe(PathAlabama("video.mkv"))
+    info.get_width(), info.get_frame_rate()
+    """
+
+    _memory_cache: dict[str, "MediaInfo"] = {}
+    _memory_cache_limit = 4096
+    _lock = threading.Lock()
+    _cache_folder: str | None = None
+
+    def __init__(self, streams: List[dict], format_info: dict, key: str = ""):
+        self.streams = streams
+        self.format = format_info
+        self.key = key
+        self.frame_count = -1  # filled lazily, needs a full demux
+
+    @staticmethod
+    def set_cache_folder(folder: str | None):
+        """
+        Persist probes into `folder`/media_info, None disables the on-disk cache
+        """
+        MediaInfo._cache_folder = folder
+
+    @staticmethod
+    def get_key(path: PathAlabama) -> str:
+        real_path = os.path.realpath(path.get())
+        stat = os.stat(real_path)
+        return f"{real_path}|{stat.st_size}|{stat.st_mtime_ns}"
+
+    @staticmethod
+    def probe(path: PathAlabama) -> "MediaInfo":
+        path.check_video()
+        key = MediaInfo.get_key(path)
+
+        with MediaInfo._lock:
+            cached = MediaInfo._memory_cache.get(key)
+        if cached is not None:
+            return cached
+
+        info = MediaInfo._load(key)
+        if info is None:
+            # run_cli merges stderr in, so nothing but the json, even -v error lets decoder errors through
+            out = (
+                run_cli(
+                    f"{get_binary('ffprobe')} -v quiet -show_streams -show_format -of json {path.get_safe()}"
+                )
+                .verify(fail_message=f"ffprobe failed on {path.get()}")
+                .get_output()
+            )
+            try:
+                parsed = json.loads(out)
+            except json.decoder.JSONDecodeError as e:
+                raise RuntimeError(
+                    f"ffprobe output for {path.get()} is not json ({e}): {out[:200]}"
+                ) from e
+            info = MediaInfo(
+                streams=parsed.get("streams", []),
+                format_info=parsed.get("format", {}),
+                key=key,
+            )
+            info.save()
+
+        with MediaInfo._lock:
+            if len(MediaInfo._memory_cache) >= MediaInfo._memory_cache_limit:
+                MediaInfo._memory_cache.clear()
+            MediaInfo._memory_cache[key] = info
+        return info
+
+    @staticmethod
+    def _get_cache_file(key: str) -> str | None:
+        if MediaInfo._cache_folder is None:
+            return None
+        return os.path.join(
+            MediaInfo._cache_folder,
+            "media_info",
+            hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json",
+        )
+
+    @staticmethod
+    def _load(key: str) -> "MediaInfo | None":
+        cache_file = MediaInfo._get_cache_file(key)
+        if cache_file is None or not os.path.exists(cache_file):
+            return None
+        try:
+            with open(cache_file) as f:
+                d = json.load(f)
+        except (json.decoder.JSONDecodeError, OSError):
+            return None
+        if d.get("key") != key:
+            return None
+        info = MediaInfo(streams=d["streams"], format_info=d["format"], key=key)
+        info.frame_count = d.get("frame_count", -1)
+        return info
+
+    def save(self):
+        """
+        Write the probe to the on-disk cache, if one is set
+        """
+        cache_file = MediaInfo._get_cache_file(self.key)
+        if cache_file is None:
+            return
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        write_json_atomic(cache_file, self.dict())
+
+    def dict(self) -> dict:
+        return {
+            "key": self.key,
+            "streams": self.streams,
+            "format": self.format,
+            "frame_count": self.frame_count,
+        }
+
+    def get_video_stream(self) -> dict:
+        """
+        :return: the first video stream, cover art and other attached pictures are skipped
+        """
+        for stream in self.streams:
+            if stream.get("codec_type") != "video":
+                continue
+            if stream.get("disposition", {}).get("attached_pic", 0) == 1:
+                continue
+            return stream
+        raise RuntimeError(f"No video stream found in {self.key.split('|')[0]}")
+
+    def get_width(self) -> int:
+        return int(self.get_video_stream()["width"])
+
+    def get_height(self) -> int:
+        return int(self.get_video_stream()["height"])
+
+    def get_pix_fmt(self) -> str:
+        return self.get_video_stream().get("pix_fmt", "")
+
+    def get_codec(self) -> str:
+        return self.get_video_stream().get("codec_name", "")
+
+    def get_color_transfer(self) -> str:
+        return self.get_video_stream().get("color_transfer", "")
+
+    def get_fps_fraction(self) -> str:
+        fraction = self.get_video_stream().get("r_frame_rate", "")
+        if fraction in ("", "0/0"):
+            raise RuntimeError(f"Could not get frame rate of {self.key.split('|')[0]}")
+        return fraction
+
+    def get_frame_rate(self) -> float:
+        num, den = self.get_fps_fraction().split("/")
+        return float(num) / float(den)
+
+    def get_duration(self) -> float | None:
+        """
+        :return: container duration in seconds, None if the container does not know it
+        """
+        duration = self.format.get("duration", "N/A")
+        if duration in ("N/A", ""):
+            return None
+        return float(duration)
+
+    def get_bitrate(self) -> int | None:
+        bitrate = self.format.get("bit_rate", "N/A")
+        if bitrate in ("N/A", ""):
+            return None
+        return int(bitrate)
@@ -3,16 +3,26 @@ Provides a central place to get the path to the binaries, and checks if they exi
 Also includes checks if the binaries are what we need (e.g., ffmpeg has been compiled with certain flags)
 """
 
+import json
 import os
+import threading
 from shutil import which
 
-__all__ = ["get_binary", "register_bin", "verify_ffmpeg_library", "check_bin"]
+__all__ = [
+    "get_binary",
+    "register_bin",
+    "verify_ffmpeg_library",
+    "check_bin",
+    "BinaryRegistry",
+]
 
-from typing import List
+from typing import List, Callable
 
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
+from alabamaEncode.core.util.kv import write_json_atomic
 
 bins = []
+_resolved_bins: dict[tuple[str, str | None], str] = {}
 
 
 def check_bin(path) -> bool:
@@ -36,21 +46,16 @@ class FFmpegNotCompiledWithLibrary(Exception):
         return f"ffmpeg is not compiled with {self.lib_name}"
 
 
-ffmpeg_build_conf = ""
-
-
 def check_ffmpeg_libraries(lib_name: str) -> bool:
     """
     Checks if the ffmpeg libraries are compiled with the given library
     :param lib_name: name of the library
     :return: True if the library is compiled, False otherwise
     """
-    global ffmpeg_build_conf
-    if ffmpeg_build_conf == "":
-        ffmpeg_build_conf = (
-            run_cli(f"{get_binary('ffmpeg')} -v error -buildconf").verify().get_output()
-        )
-    return ffmpeg_build_conf.find(lib_name) != -1
+    return (
+        BinaryRegistry.run_probe("ffmpeg", ["-v", "error", "-buildconf"]).find(lib_name)
+        != -1
+    )
 
 
 def verify_ffmpeg_library(lib_name: [str | List[str]]) -> None:
@@ -92,10 +97,18 @@ class BinaryNotFound(Exception):
 
 def register_bin(name, cli):
     bins.append((name, cli))
+    _resolved_bins.clear()
+    BinaryRegistry._paths.clear()
 
 
 def get_binary(name):
-    _bin = os.getenv(f"{name.upper()}_CLI_PATH", name)
+    env_override = os.getenv(f"{name.upper()}_CLI_PATH")
+    # resolving walks PATH, so do it once per name, a missing binary is not cached so it can be installed mid-run
+    cached = _resolved_bins.get((name, env_override))
+    if cached is not None:
+        return cached
+
+    _bin = env_override if env_override is not None else name
     if _bin == name:
         for _name, _cli in bins:
             if _name == name:
@@ -104,6 +117,208 @@ def get_binary(name):
     if _bin is None:
         _bin = os.path.expanduser(f"~/.alabamaEncoder/bin/{name}")
     if check_bin(_bin):
+        _resolved_bins[(name, env_override)] = _bin
         return _bin
     else:
         raise BinaryNotFound(name)
+
+
+class BinaryRegistry:
+    """
+    Caches what we learn by running our binaries (versions, build configs, filter lists), so each question is asked
+    once per binary, not once per chunk. Entries are keyed by the resolved binary path and its mtime,
+    so rebuilding or swapping a binary invalidates them, and persisted in ~/.alabamaEncoder/bin_registry.json.
+    The path and mtime are looked up once per process, register_bin starts over.
+
+    BinaryRegistry.get_version("SvtAv1EncApp")
+    BinaryRegistry.has_capability("ffmpeg", "xpsnr")
+    """
+
+    registry_file = os.path.expanduser("~/.alabamaEncoder/bin_registry.json")
+
+    # what to run to get a version string, the default is --version
+    version_args = {
+        "ffmpeg": ["-version"],
+        "ffprobe": ["-version"],
+    }
+
+    # capability name -> check, per binary
+    capabilities: dict[str, dict[str, Callable[[], bool]]] = {
+        "SvtAv1EncApp": {
+            "psy": lambda: "PSY"
+            in BinaryRegistry.run_probe("SvtAv1EncApp", ["--version"]),
+        },
+        "ffmpeg": {
+            "libvmaf": lambda: check_ffmpeg_libraries("libvmaf"),
+            "libzimg": lambda: check_ffmpeg_libraries("libzimg"),
+            "libsvtav1": lambda: check_ffmpeg_libraries("libsvtav1"),
+            "libplacebo": lambda: check_ffmpeg_libraries("libplacebo"),
+            "xpsnr": lambda: BinaryRegistry.has_filter("xpsnr"),
+        },
+    }
+
+    # binaries `doctor` reports on, on top of anything registered with register_bin
+    known_binaries = [
+        "ffmpeg",
+        "ffprobe",
+        "SvtAv1EncApp",
+        "aomenc",
+        "x264",
+        "x265",
+        "rav1e",
+        "vpxenc",
+        "vmaf",
+        "ssimulacra2_rs",
+        "mkvmerge",
+    ]
+
+    _entries: dict[str, dict] | None = None
+    # (name, env override) -> (absolute path, mtime)
+    _paths: dict[tuple[str, str | None], tuple[str, int]] = {}
+    _lock = threading.RLock()
+
+    @staticmethod
+    def _load():
+        if BinaryRegistry._entries is not None:
+            return
+        BinaryRegistry._entries = {}
+        try:
+            with open(BinaryRegistry.registry_file) as f:
+                BinaryRegistry._entries = json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            pass
+
+    @staticmethod
+    def _save():
+        os.makedirs(os.path.dirname(BinaryRegistry.registry_file), exist_ok=True)
+        write_json_atomic(BinaryRegistry.registry_file, BinaryRegistry._entries)
+
+    @staticmethod
+    def _try_save():
+        try:
+            BinaryRegistry._save()
+        except OSError:
+            pass  # a read-only home just means we probe again next run
+
+    @staticmethod
+    def _resolve(name: str) -> tuple[str, int]:
+        """
+        :return: absolute path and mtime of the binary
+        """
+        key = (name, os.getenv(f"{name.upper()}_CLI_PATH"))
+        resolved = BinaryRegistry._paths.get(key)
+        if resolved is None:
+            _bin = get_binary(name)
+            path = os.path.realpath(which(_bin) or _bin)
+            resolved = (path, os.stat(path).st_mtime_ns)
+            BinaryRegistry._paths[key] = resolved
+        return resolved
+
+    @staticmethod
+    def get_path(name: str) -> str:
+        """
+        :return: absolute path to the binary
+        """
+        return BinaryRegistry._resolve(name)[0]
+
+    @staticmethod
+    def _get_entry(name: str) -> dict:
+        """
+        :return: the registry entry for the binary, reset if the binary changed since it was written
+        """
+        path, mtime = BinaryRegistry._resolve(name)
+        BinaryRegistry._load()
+        entry = BinaryRegistry._entries.get(path)
+        if entry is None or entry.get("mtime_ns") != mtime:
+            entry = {"name": name, "mtime_ns": mtime, "probes": {}, "capabilities": {}}
+            BinaryRegistry._entries[path] = entry
+        return entry
+
+    @staticmethod
+    def run_probe(name: str, args: List[str]) -> str:
+        """
+        Run the binary with `args` once and remember the output
+        :return: the combined stdout/stderr of the probe
+        """
+        with BinaryRegistry._lock:
+            entry = BinaryRegistry._get_entry(name)
+            probe_key = " ".join(args)
+            if probe_key in entry["probes"]:
+                return entry["probes"][probe_key]
+
+            path = BinaryRegistry.get_path(name)
+            output = (
+                run_cli(CliPipeline([path, *args]))
+                .verify(fail_message=f"Could not probe {name}")
+                .get_output()
+            )
+            entry["probes"][probe_key] = output
+            BinaryRegistry._try_save()
+            return output
+
+    @staticmethod
+    def get_version(name: str) -> str:
+        """
+        :return: the first non-empty line of the binary's version output
+        """
+        output = BinaryRegistry.run_probe(
+            name, BinaryRegistry.version_args.get(name, ["--version"])
+        )
+        for line in output.splitlines():
+            if line.strip() != "":
+                return line.strip()
+        return ""
+
+    @staticmethod
+    def has_filter(filter_name: str) -> bool:
+        """
+        :return: True if ffmpeg has the given libavfilter filter
+        """
+        filters = BinaryRegistry.run_probe("ffmpeg", ["-hide_banner", "-filters"])
+        for line in filters.splitlines():
+            # " TS. xpsnr             VV->V      Calculate the extended perceptually weighted PSNR..."
+            parts = line.split()
+            if len(parts) >= 2 and parts[1] == filter_name:
+                return True
+        return False
+
+    @staticmethod
+    def has_capability(name: str, capability: str) -> bool:
+        """
+        :return: the check's answer, worked out once per binary and kept in its entry
+        """
+        with BinaryRegistry._lock:
+            # entries written before capabilities were kept don't have them yet
+            known = BinaryRegistry._get_entry(name).setdefault("capabilities", {})
+            if capability not in known:
+                known[capability] = BinaryRegistry.capabilities[name][capability]()
+                BinaryRegistry._try_save()
+            return known[capability]
+
+    @staticmethod
+    def doctor() -> str:
+        """
+        :return: a human-readable report of every binary we know about, its version and capabilities
+        """
+        names = BinaryRegistry.known_binaries + [
+            name for name, _ in bins if name not in BinaryRegistry.known_binaries
+        ]
+        lines = []
+        for name in names:
+            try:
+                path = BinaryRegistry.get_path(name)
+            except BinaryNotFound:
+                lines.append(f"{name}: not found")
+                continue
+            try:
+                version = BinaryRegistry.get_version(name)
+            except RuntimeError:
+                version = "unknown version"
+            lines.append(f"{name}: {version} ({path})")
+            for capability in BinaryRegistry.capabilities.get(name, {}):
+                try:
+                    has = BinaryRegistry.has_capability(name, capability)
+                except RuntimeError:
+                    has = False
+                lines.append(f"    {capability}: {'yes' if has else 'no'}")
+        return "\n".join(lines)
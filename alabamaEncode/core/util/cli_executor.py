@@ -1,19 +1,112 @@
+import asyncio
+import codecs
+import contextvars
 import os
 import re
+import selectors
+import shlex
+import signal
 import subprocess
+import sys
+import threading
 import time
-from queue import Queue
-from threading import Thread
-from typing import List, Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Callable, Optional, Dict, Set
 
-__all__ = ["run_cli", "run_cli_parallel", "CliResult"]
+__all__ = [
+    "run_cli",
+    "run_cli_parallel",
+    "CliResult",
+    "CliPipeline",
+    "process_owner",
+    "get_owned_pids",
+    "add_owned_pid",
+    "release_owner",
+]
+
+# who the commands started right now belong to, e.g. a chunk index, see process_owner
+_current_owner: contextvars.ContextVar = contextvars.ContextVar(
+    "process_owner", default=None
+)
+_owned_pids: Dict[object, Set[int]] = {}
+_owned_pids_lock = threading.Lock()
+
+
+@contextmanager
+def process_owner(owner):
+    """
+    Attribute every process run_cli/run_cli_parallel start inside the block to `owner`,
+    so resource accounting can find the process tree of a job, see get_owned_pids
+    """
+    token = _current_owner.set(owner)
+    try:
+        yield
+    finally:
+        _current_owner.reset(token)
+
+
+def add_owned_pid(owner, pid: int):
+    with _owned_pids_lock:
+        _owned_pids.setdefault(owner, set()).add(pid)
+
+
+def get_owned_pids(owner) -> List[int]:
+    """
+    :return: pids started under `owner`, including ones that already exited
+    """
+    with _owned_pids_lock:
+        return list(_owned_pids.get(owner, []))
+
+
+def release_owner(owner):
+    with _owned_pids_lock:
+        _owned_pids.pop(owner, None)
+
+
+def _track(processes):
+    owner = _current_owner.get()
+    if owner is not None:
+        for p in processes:
+            add_owned_pid(owner, p.pid)
+
+
+class CliPipeline:
+    """
+    A shell-free command, a list of argv stages where the stdout of each stage is piped into the next one.
+    run_cli wires the stages together with os pipes, no /bin/sh in between, so arguments never need quoting.
+    str() gives an equivalent shell command, for dry runs and logs.
+
+    CliPipeline(["ffmpeg", "-i", "in.mkv", "-f", "yuv4mpegpipe", "-"], ["SvtAv1EncApp", "-i", "stdin", ...])
+    """
+
+    def __init__(self, *stages: List):
+        self.stages: List[List[str]] = [[str(arg) for arg in stage] for stage in stages]
+        if len(self.stages) == 0:
+            raise ValueError("A pipeline needs at least one stage")
+
+    def pipe(self, stage: List) -> "CliPipeline":
+        """
+        :return: a new pipeline with `stage` appended at the end
+        """
+        return CliPipeline(*self.stages, stage)
+
+    def __str__(self):
+        return " | ".join(shlex.join(stage) for stage in self.stages)
+
+    def __repr__(self):
+        return f"CliPipeline({self.stages})"
 
 
 class CliResult:
-    def __init__(self, return_code, output, time_taken=-1.0):
+    def __init__(self, return_code, output, time_taken=-1.0, stage_return_codes=None):
         self.return_code = return_code
         self.output = output
         self.time_taken = time_taken
+        # for pipelines, the exit code of every stage in order, return_code is the last one like in a shell
+        self.stage_return_codes = (
+            stage_return_codes if stage_return_codes is not None else [return_code]
+        )
 
     def __repr__(self):
         return f"ExecuteResult(return_code={self.return_code}, output={self.output})"
@@ -24,6 +117,12 @@ class CliResult:
     def success(self) -> bool:
         return self.return_code == 0
 
+    def failed_stages(self) -> List[int]:
+        """
+        :return: indexes of the pipeline stages that exited with a non-zero code
+        """
+        return [i for i, code in enumerate(self.stage_return_codes) if code != 0]
+
     def get_output(self) -> str:
         return self.output
 
@@ -79,89 +178,338 @@ def run_cli(
     cmd,
     timeout_value=-1,
     on_output: Optional[Callable[[str], None]] = None,
+    on_line: Optional[Callable[[str], None]] = None,
+    max_output_size: int = -1,
 ) -> CliResult:
+    """
+    Run a command and capture its combined stdout/stderr
+    :param cmd: shell command string or a CliPipeline to run
+    :param timeout_value: seconds before the process gets killed, -1 to wait forever
+    :param on_output: called with every decoded chunk of output as it arrives
+    :param on_line: called with every complete line of output, lines are split on both \\n and \\r
+    so carriage-return progress meters are reported too
+    :param max_output_size: keep only the last N characters of output in the result, -1 to keep everything
+    :return: CliResult
+    """
     start = time.perf_counter()
-    p = subprocess.Popen(
-        cmd,
-        shell=True,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-    )
+    read_fd, write_fd = os.pipe()
+    try:
+        processes = _spawn(cmd, write_fd)
+    except OSError as e:
+        # same as what a shell reports for a missing binary
+        os.close(read_fd)
+        return CliResult(127, str(e), time.perf_counter() - start)
+    finally:
+        # the children hold their own copies, we need ours closed to ever see EOF
+        os.close(write_fd)
+    _track(processes)
 
-    output = ""
-    while p.poll() is None:  # While the process is still running...
-        chunk = p.stdout.read(1).decode(errors="ignore")  # Read output chunk by chunk
-        output += chunk  # Add chunk to total output
-        if on_output is not None:  # If on_output is provided...
-            on_output(chunk)  # ...apply it to each chunk
+    output = _OutputCapture(max_output_size)
+    splitter = _LineSplitter(on_line) if on_line is not None else None
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
 
-    if timeout_value > 0:
-        try:
-            p.wait(timeout=timeout_value)
-        except subprocess.TimeoutExpired:
-            p.kill()
-    else:
-        p.wait()
+    def consume(text: str):
+        if text == "":
+            return
+        output.append(text)
+        if on_output is not None:
+            on_output(text)
+        if splitter is not None:
+            splitter.feed(text)
+
+    deadline = start + timeout_value if timeout_value > 0 else None
+    with selectors.DefaultSelector() as selector:
+        selector.register(read_fd, selectors.EVENT_READ)
+        while True:
+            wait_for = None
+            if deadline is not None:
+                wait_for = deadline - time.perf_counter()
+                if wait_for <= 0:
+                    for p in processes:
+                        p.kill()
+                    break
+            if not selector.select(timeout=wait_for):
+                continue
+            data = os.read(read_fd, _READ_SIZE)
+            if not data:  # EOF, every process closed its end of the pipe
+                break
+            consume(decoder.decode(data))
 
-    output += p.stdout.read().decode(errors="ignore")
+    consume(decoder.decode(b"", final=True))
+    if splitter is not None:
+        splitter.flush()
+    os.close(read_fd)
+    return_codes = [p.wait() for p in processes]
 
     end = time.perf_counter()
-    return CliResult(p.returncode, output, end - start)
-
-
-def _run_command(
-    cmd: str, result_queue: Queue, stream_to_stdout: bool, error_flag: List[bool]
-):
-    process = subprocess.Popen(
-        cmd,
-        shell=True,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-    )
-    # output = ""
-    # for line in iter(lambda: process.stdout.read(1), b""):
-    #     # if stream_to_stdout:
-    #     # sys.stdout.write(line.decode("utf-8", errors="ignore"))
-    #     # print(line.decode("utf-8", errors="ignore"), end="")
-    #     output += str(line)
+    return CliResult(return_codes[-1], output.get(), end - start, return_codes)
 
-    output = process.stdout.read().decode(errors="ignore")
 
-    process.wait()
-    result_queue.put(CliResult(process.returncode, output))
+def _spawn(cmd, output_fd: int) -> List[subprocess.Popen]:
+    """
+    Start `cmd`, with its stderr and final stdout going to `output_fd`
+    :param cmd: a shell string or a CliPipeline
+    :return: the started processes, in pipeline order
+    """
+    if not isinstance(cmd, CliPipeline):
+        return [
+            subprocess.Popen(
+                cmd,
+                shell=True,
+                stdin=subprocess.PIPE,
+                stdout=output_fd,
+                stderr=output_fd,
+            )
+        ]
 
-    if process.returncode != 0:
-        error_flag[0] = True
+    processes = []
+    previous_stdout = subprocess.DEVNULL
+    try:
+        for i, stage in enumerate(cmd.stages):
+            last = i == len(cmd.stages) - 1
+            p = subprocess.Popen(
+                stage,
+                stdin=previous_stdout,
+                stdout=output_fd if last else subprocess.PIPE,
+                stderr=output_fd,
+            )
+            if previous_stdout is not subprocess.DEVNULL:
+                # only the next stage should hold the read end, so a dead reader gives the writer SIGPIPE
+                previous_stdout.close()
+            previous_stdout = p.stdout
+            processes.append(p)
+    except OSError:
+        if previous_stdout is not subprocess.DEVNULL:
+            previous_stdout.close()
+        for p in processes:
+            p.kill()
+            p.wait()
+        raise
+    return processes
+
+
+_READ_SIZE = 64 * 1024
+
+
+class _OutputCapture:
+    """
+    Accumulates output text, optionally keeping only the last `max_size` characters
+    """
+
+    def __init__(self, max_size: int = -1):
+        self.max_size = max_size
+        self.parts: List[str] = []
+        self.size = 0
+
+    def append(self, text: str):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.max_size > 0 and self.size > self.max_size * 2:
+            # compact once we are way over the limit so appends stay amortised O(1)
+            tail = "".join(self.parts)[-self.max_size :]
+            self.parts = [tail]
+            self.size = len(tail)
+
+    def get(self) -> str:
+        out = "".join(self.parts)
+        if self.max_size > 0:
+            out = out[-self.max_size :]
+        return out
+
+
+class _LineSplitter:
+    """
+    Incrementally splits a text stream into lines, calls `on_line` for each complete one
+    """
+
+    _line_break = re.compile(r"[\r\n]")
+
+    def __init__(self, on_line: Callable[[str], None]):
+        self.on_line = on_line
+        self.pending = ""
+
+    def feed(self, text: str):
+        lines = self._line_break.split(self.pending + text)
+        self.pending = lines.pop()
+        for line in lines:
+            if line != "":
+                self.on_line(line)
+
+    def flush(self):
+        if self.pending != "":
+            self.on_line(self.pending)
+        self.pending = ""
 
 
 def run_cli_parallel(
-    cmds: List[str], timeout_value=-1, stream_to_stdout=False
+    cmds: List, timeout_value=-1, stream_to_stdout=False, max_output_size=-1
 ) -> List[CliResult]:
-    results = []
-    result_queue = Queue()
-    error_flag = [False]
-
-    threads = []
-    for cmd in cmds:
-        thread = Thread(
-            target=_run_command, args=(cmd, result_queue, stream_to_stdout, error_flag)
+    """
+    Run commands at the same time as one group, e.g. two ffmpeg feeders and a vmaf reading their fifos.
+    If any command exits non-zero or the timeout hits, the whole group is killed, so nobody is left blocked on a
+    fifo that will never be opened. Killed commands report a negative (signal) return code.
+    :param cmds: shell command strings or CliPipelines
+    :param timeout_value: seconds before the group gets killed, -1 to wait forever
+    :param stream_to_stdout: echo output to stdout as it arrives
+    :param max_output_size: keep only the last N characters of each command's output, -1 to keep everything
+    :return: a CliResult per command, in the same order as `cmds`
+    """
+    group = _ProcessGroup(
+        cmds,
+        timeout_value=timeout_value,
+        stream_to_stdout=stream_to_stdout,
+        max_output_size=max_output_size,
+    )
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(group.run())
+
+    # called from inside an event loop, asyncio.run can't nest so give the group its own thread,
+    # carrying our context over so the processes keep their owner
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(
+            contextvars.copy_context().run, asyncio.run, group.run()
+        ).result()
+
+
+class _ProcessGroup:
+    """
+    Asyncio runner behind run_cli_parallel, every process gets its own session so killing it also kills whatever
+    the shell spawned
+    """
+
+    def __init__(self, cmds: List, timeout_value, stream_to_stdout, max_output_size):
+        self.cmds = cmds
+        self.timeout_value = timeout_value
+        self.stream_to_stdout = stream_to_stdout
+        self.max_output_size = max_output_size
+        self.processes: List[asyncio.subprocess.Process] = []
+        self.killed = False
+
+    async def run(self) -> List[CliResult]:
+        tasks = [asyncio.create_task(self._run_one(cmd)) for cmd in self.cmds]
+        deadline = (
+            time.perf_counter() + self.timeout_value if self.timeout_value > 0 else None
         )
-        threads.append(thread)
-        thread.start()
 
-    for thread in threads:
-        thread.join(timeout=timeout_value)
+        pending = set(tasks)
+        while pending:
+            wait_for = None
+            if deadline is not None:
+                wait_for = max(0.0, deadline - time.perf_counter())
+            done, pending = await asyncio.wait(
+                pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED
+            )
+            if len(done) == 0:  # timed out
+                self.kill()
+                break
+            if any(not t.result().success() for t in done):
+                self.kill()
+                break
 
-    # If any process finished with a non-zero code, terminate the remaining processes
-    if any(error_flag):
-        raise RuntimeError("One or more processes  finished with a non-zero exit code.")
+        # after a kill everything finishes promptly, pipes close as the processes die
+        return list(await asyncio.gather(*tasks))
 
-    # Retrieve results from the queue
-    while len(results) < len(cmds):
-        out = result_queue.get()
-        if out is not None:
-            results.append(out)
+    def kill(self):
+        self.killed = True
+        for p in self.processes:
+            if p.returncode is None:
+                try:
+                    os.killpg(p.pid, signal.SIGKILL)
+                except (ProcessLookupError, PermissionError):
+                    pass
 
-    return results
+    async def _run_one(self, cmd) -> CliResult:
+        start = time.perf_counter()
+        read_fd, write_fd = os.pipe()
+        try:
+            processes = await _spawn_async(cmd, write_fd)
+        except OSError as e:
+            os.close(read_fd)
+            return CliResult(127, str(e), time.perf_counter() - start)
+        finally:
+            os.close(write_fd)
+
+        _track(processes)
+        self.processes += processes
+        if self.killed:  # the group died while we were starting
+            self.kill()
+
+        output = _OutputCapture(self.max_output_size)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        reader = asyncio.StreamReader()
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, "rb", 0)
+        )
+        try:
+            while True:
+                data = await reader.read(_READ_SIZE)
+                text = decoder.decode(data, final=not data)
+                output.append(text)
+                if self.stream_to_stdout and text != "":
+                    sys.stdout.write(text)
+                if not data:
+                    break
+        finally:
+            transport.close()
+
+        return_codes = [await p.wait() for p in processes]
+        return CliResult(
+            return_codes[-1],
+            output.get(),
+            time.perf_counter() - start,
+            return_codes,
+        )
+
+
+async def _spawn_async(cmd, output_fd: int) -> List[asyncio.subprocess.Process]:
+    """
+    asyncio version of _spawn, every process starts in a new session
+    """
+    if not isinstance(cmd, CliPipeline):
+        return [
+            await asyncio.create_subprocess_shell(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=output_fd,
+                stderr=output_fd,
+                start_new_session=True,
+            )
+        ]
+
+    processes = []
+    # fds we still have to close in the parent, the children keep their own copies
+    open_fds = []
+    try:
+        stdin = subprocess.DEVNULL
+        for i, stage in enumerate(cmd.stages):
+            if i == len(cmd.stages) - 1:
+                stage_read, stage_write = None, output_fd
+            else:
+                stage_read, stage_write = os.pipe()
+                open_fds += [stage_read, stage_write]
+            processes.append(
+                await asyncio.create_subprocess_exec(
+                    *stage,
+                    stdin=stdin,
+                    stdout=stage_write,
+                    stderr=output_fd,
+                    start_new_session=True,
+                )
+            )
+            # only the next stage should hold the read end, so a dead reader gives the writer SIGPIPE
+            for fd in [stdin, stage_write]:
+                if fd in open_fds:
+                    os.close(fd)
+                    open_fds.remove(fd)
+            stdin = stage_read
+    except OSError:
+        for fd in open_fds:
+            os.close(fd)
+        for p in processes:
+            p.kill()
+            await p.wait()
+        raise
+    return processes
@@ -0,0 +1,202 @@
+"""
+Cpu topology from /sys/devices/system/cpu and a core allocator that hands jobs cores that share caches.
+Used to pin the decoder and encoder stage of each chunk to their own cores with taskset.
+"""
+
+import glob
+import os
+import threading
+from typing import List, Dict, Tuple
+
+__all__ = [
+    "parse_cpu_list",
+    "format_cpu_list",
+    "CpuTopology",
+    "CoreSet",
+    "CoreAllocator",
+]
+
+
+def parse_cpu_list(cpu_list: str) -> List[int]:
+    """
+    "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11], the kernel's cpulist format
+    """
+    cpus = []
+    for part in cpu_list.strip().split(","):
+        if part == "":
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus += range(int(start), int(end) + 1)
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpu_list(cpus: List[int]) -> str:
+    """
+    [0, 1, 2, 3, 8] -> "0-3,8", what taskset -c takes
+    """
+    parts = []
+    cpus = sorted(cpus)
+    i = 0
+    while i < len(cpus):
+        j = i
+        while j + 1 < len(cpus) and cpus[j + 1] == cpus[j] + 1:
+            j += 1
+        parts.append(str(cpus[i]) if i == j else f"{cpus[i]}-{cpus[j]}")
+        i = j + 1
+    return ",".join(parts)
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+class CpuTopology:
+    """
+    The cpus we are allowed to run on, grouped by NUMA node and L3 cache (a CCX on Ryzen/Epyc, the whole
+    package on most Intel parts). `cpus` is ordered so neighbours share as much as possible:
+    node, then L3 group, then physical core, SMT siblings next to each other.
+    Missing sysfs entries (containers, non-linux) degrade to one flat group.
+    """
+
+    def __init__(self, sysfs: str = "/sys/devices/system"):
+        try:
+            allowed = sorted(os.sched_getaffinity(0))
+        except AttributeError:
+            allowed = list(range(os.cpu_count() or 1))
+
+        cpu_root = f"{sysfs}/cpu"
+        node_of: Dict[int, int] = {}
+        for node_dir in glob.glob(f"{sysfs}/node/node[0-9]*"):
+            cpulist = _read(f"{node_dir}/cpulist")
+            if cpulist:
+                for cpu in parse_cpu_list(cpulist):
+                    node_of[cpu] = int(os.path.basename(node_dir)[len("node") :])
+
+        self.node_of: Dict[int, int] = {}
+        self.l3_of: Dict[int, Tuple[int, ...]] = {}
+        self.core_of: Dict[int, Tuple[int, int]] = {}
+        for cpu in allowed:
+            topology = f"{cpu_root}/cpu{cpu}/topology"
+            package = int(_read(f"{topology}/physical_package_id") or 0)
+            core_id = int(_read(f"{topology}/core_id") or cpu)
+            self.core_of[cpu] = (package, core_id)
+            self.node_of[cpu] = node_of.get(cpu, 0)
+
+            l3 = None
+            for index in glob.glob(f"{cpu_root}/cpu{cpu}/cache/index[0-9]*"):
+                if _read(f"{index}/level") == "3":
+                    shared = _read(f"{index}/shared_cpu_list")
+                    if shared:
+                        l3 = tuple(c for c in parse_cpu_list(shared) if c in allowed)
+                    break
+            # without an L3 entry, the package is the next best guess at what shares a cache
+            self.l3_of[cpu] = l3 if l3 else (-1 - package,)
+
+        self.cpus: List[int] = sorted(
+            allowed,
+            key=lambda c: (self.node_of[c], min(self.l3_of[c]), self.core_of[c], c),
+        )
+
+    @property
+    def smt(self) -> bool:
+        """
+        :return: True if some physical core runs more than one of our cpus
+        """
+        return len(set(self.core_of.values())) < len(self.cpus)
+
+    def l3_groups(self) -> List[List[int]]:
+        groups: Dict[Tuple[int, ...], List[int]] = {}
+        for cpu in self.cpus:
+            groups.setdefault(self.l3_of[cpu], []).append(cpu)
+        return list(groups.values())
+
+    def numa_nodes(self) -> List[List[int]]:
+        nodes: Dict[int, List[int]] = {}
+        for cpu in self.cpus:
+            nodes.setdefault(self.node_of[cpu], []).append(cpu)
+        return list(nodes.values())
+
+    def __str__(self):
+        return (
+            f"CpuTopology({len(self.cpus)} cpus, {len(self.numa_nodes())} numa nodes, "
+            f"l3 groups: {' | '.join(format_cpu_list(g) for g in self.l3_groups())})"
+        )
+
+
+class CoreSet:
+    """
+    The cpus one job may use, the decoder (ffmpeg) and the encoder stage get their own
+    """
+
+    def __init__(self, encoder: List[int], decoder: List[int]):
+        self.encoder = encoder
+        self.decoder = decoder
+
+    @property
+    def cpus(self) -> List[int]:
+        return sorted(set(self.encoder) | set(self.decoder))
+
+    def __str__(self):
+        return f"CoreSet(encoder={format_cpu_list(self.encoder)}, decoder={format_cpu_list(self.decoder)})"
+
+
+class CoreAllocator:
+    """
+    Hands out contiguous core sets, sized to a job's thread count, and takes them back when the job is done.
+    A set comes from a single L3 group if one has room (the fullest one that fits, to keep big holes free for
+    big jobs), else from a single NUMA node, else from anywhere.
+    """
+
+    def __init__(self, topology: CpuTopology = None):
+        self.topology = topology if topology is not None else CpuTopology()
+        self.free = set(self.topology.cpus)
+        self.lock = threading.Lock()
+
+    def _take(self, count: int) -> List[int] | None:
+        for groups in [self.topology.l3_groups(), self.topology.numa_nodes()]:
+            fitting = [
+                [c for c in group if c in self.free]
+                for group in groups
+                if sum(1 for c in group if c in self.free) >= count
+            ]
+            if fitting:
+                return min(fitting, key=len)[:count]
+        if len(self.free) >= count:
+            return [c for c in self.topology.cpus if c in self.free][:count]
+        return None
+
+    def allocate(
+        self, encoder_threads: int, decoder_threads: int = None
+    ) -> CoreSet | None:
+        """
+        :param decoder_threads: cpus for the decoder on top of the encoder's, by default one if it's an SMT
+        sibling or the job is big enough that a core for ffmpeg is a small price, else it shares the encoder's
+        :return: a CoreSet, or None if not even the encoder threads fit, run the job unpinned then
+        """
+        encoder_threads = max(1, int(encoder_threads))
+        if decoder_threads is None:
+            decoder_threads = 1 if self.topology.smt or encoder_threads >= 4 else 0
+        with self.lock:
+            cpus = self._take(encoder_threads + decoder_threads)
+            if cpus is not None and decoder_threads > 0:
+                # SMT siblings are adjacent, so with one encoder thread the decoder lands on its sibling
+                core_set = CoreSet(cpus[:encoder_threads], cpus[encoder_threads:])
+            else:
+                cpus = self._take(encoder_threads)
+                if cpus is None:
+                    return None
+                # no decoder core of its own, it shares with the encoder
+                core_set = CoreSet(cpus, cpus)
+            self.free -= set(cpus)
+            return core_set
+
+    def release(self, core_set: CoreSet):
+        with self.lock:
+            self.free |= set(core_set.cpus)
@@ -0,0 +1,285 @@
+"""
+Pure python IVF container reader/writer, so we don't spawn ffprobe/ffmpeg just to look at or glue together our own
+chunks.
+https://wiki.multimedia.cx/index.php/Duck_IVF
+
+File header (32 bytes, little endian):
+0  "DKIF", 4 version u16, 6 header size u16, 8 fourcc, 12 width u16, 14 height u16,
+16 timebase denominator u32, 20 timebase numerator u32, 24 frame count u32, 28 unused
+Every frame is a 12 byte header (payload size u32, timestamp u64) followed by the payload.
+"""
+
+import mmap
+import os
+import struct
+from typing import List
+
+IVF_SIGNATURE = b"DKIF"
+IVF_FILE_HEADER_SIZE = 32
+IVF_FRAME_HEADER_SIZE = 12
+
+_file_header = struct.Struct("<4sHH4sHHIII4x")
+_frame_header = struct.Struct("<IQ")
+
+
+class IvfFormatError(Exception):
+    pass
+
+
+def is_ivf(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() == ".ivf"
+
+
+class IvfReader:
+    """
+    Memory-mapped ivf reader, frame headers are indexed once on open, payloads are only touched when asked for
+
+    with IvfReader("1.ivf") as ivf:
+        ivf.get_frame_count(), ivf.get_average_bitrate(), ivf.get_frame(0)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.frame_offsets: List[int] = []  # offset of each frame's payload
+        self.frame_sizes: List[int] = []
+        self.timestamps: List[int] = []
+
+        self._file = open(path, "rb")
+        try:
+            file_size = os.fstat(self._file.fileno()).st_size
+            if file_size < IVF_FILE_HEADER_SIZE:
+                raise IvfFormatError(f"{path} is too small to be an ivf file")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        (
+            signature,
+            self.version,
+            self.header_size,
+            self.fourcc,
+            self.width,
+            self.height,
+            self.timebase_den,
+            self.timebase_num,
+            self.header_frame_count,
+        ) = _file_header.unpack_from(self._map, 0)
+        if signature != IVF_SIGNATURE:
+            self.close()
+            raise IvfFormatError(f"{path} is not an ivf file")
+        self._index(file_size)
+
+    def _index(self, file_size: int):
+        offset = self.header_size
+        while offset < file_size:
+            if offset + IVF_FRAME_HEADER_SIZE > file_size:
+                self.close()
+                raise IvfFormatError(
+                    f"{self.path} is truncated at frame {len(self.frame_sizes)}"
+                )
+            frame_size, timestamp = _frame_header.unpack_from(self._map, offset)
+            offset += IVF_FRAME_HEADER_SIZE
+            if offset + frame_size > file_size:
+                self.close()
+                raise IvfFormatError(
+                    f"{self.path} is truncated at frame {len(self.frame_sizes)}"
+                )
+            self.frame_offsets.append(offset)
+            self.frame_sizes.append(frame_size)
+            self.timestamps.append(timestamp)
+            offset += frame_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if getattr(self, "_map", None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def get_frame_count(self) -> int:
+        return len(self.frame_sizes)
+
+    def get_frame(self, index: int) -> bytes:
+        offset = self.frame_offsets[index]
+        return self._map[offset : offset + self.frame_sizes[index]]
+
+    def get_frame_duration(self) -> int:
+        """
+        :return: duration of one frame in timebase units, guessed from the timestamps
+        """
+        if len(self.timestamps) < 2:
+            return 1
+        return max(
+            1, (self.timestamps[-1] - self.timestamps[0]) // (len(self.timestamps) - 1)
+        )
+
+    def get_duration(self) -> float:
+        """
+        :return: duration in seconds
+        """
+        if len(self.timestamps) == 0 or self.timebase_den == 0:
+            return 0.0
+        units = self.timestamps[-1] - self.timestamps[0] + self.get_frame_duration()
+        return units * self.timebase_num / self.timebase_den
+
+    def get_payload_size(self) -> int:
+        return sum(self.frame_sizes)
+
+    def get_average_bitrate(self) -> float:
+        """
+        :return: video bitrate in bits per second, container overhead excluded
+        """
+        duration = self.get_duration()
+        if duration == 0:
+            return 0.0
+        return self.get_payload_size() * 8 / duration
+
+    def get_peak_bitrate(self, window_seconds: float = 1.0) -> float:
+        """
+        :return: highest bitrate in bits per second over any sliding window of `window_seconds`
+        """
+        if len(self.frame_sizes) == 0 or self.timebase_den == 0:
+            return 0.0
+        window = window_seconds * self.timebase_den / self.timebase_num
+        peak, window_bytes, start = 0, 0, 0
+        for end in range(len(self.frame_sizes)):
+            window_bytes += self.frame_sizes[end]
+            while self.timestamps[end] - self.timestamps[start] >= window:
+                window_bytes -= self.frame_sizes[start]
+                start += 1
+            peak = max(peak, window_bytes)
+        # windows shorter than `window_seconds` (e.g. a short chunk) are still averaged over the full window
+        return peak * 8 / window_seconds
+
+
+class IvfWriter:
+    """
+    Writes an ivf file frame by frame, the header frame count is rewritten on close
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fourcc: bytes,
+        width: int,
+        height: int,
+        timebase_den: int,
+        timebase_num: int,
+    ):
+        self.path = path
+        self.fourcc = fourcc
+        self.width = width
+        self.height = height
+        self.timebase_den = timebase_den
+        self.timebase_num = timebase_num
+        self.frame_count = 0
+        self._file = open(path, "wb")
+        self._write_header()
+
+    def _write_header(self):
+        self._file.seek(0)
+        self._file.write(
+            _file_header.pack(
+                IVF_SIGNATURE,
+                0,
+                IVF_FILE_HEADER_SIZE,
+                self.fourcc,
+                self.width,
+                self.height,
+                self.timebase_den,
+                self.timebase_num,
+                self.frame_count,
+            )
+        )
+
+    def write_frame(self, payload, timestamp: int):
+        self._file.write(_frame_header.pack(len(payload), timestamp))
+        self._file.write(payload)
+        self.frame_count += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._write_header()
+        self._file.close()
+
+
+def count_ivf_frames(path: str) -> int:
+    """
+    Counts the frames of an ivf file by walking the frame headers, without touching the payloads
+    :param path: path to the ivf file
+    :return: number of frames
+    :raises IvfFormatError: if the file is not an ivf or is truncated
+    """
+    with IvfReader(path) as ivf:
+        return ivf.get_frame_count()
+
+
+def concat_ivf(inputs: List[str], output: str) -> int:
+    """
+    Concatenates ivf files by appending their frame payloads, timestamps are rebased so they continue where the
+    previous file ended
+    :param inputs: ivf files in order, all must share the codec, resolution and timebase
+    :param output: path of the ivf to write
+    :return: number of frames written
+    :raises IvfFormatError: if the inputs are not compatible
+    """
+    if len(inputs) == 0:
+        raise IvfFormatError("Nothing to concat")
+
+    writer = None
+    next_timestamp = 0
+    try:
+        for path in inputs:
+            with IvfReader(path) as ivf:
+                if writer is None:
+                    writer = IvfWriter(
+                        output,
+                        fourcc=ivf.fourcc,
+                        width=ivf.width,
+                        height=ivf.height,
+                        timebase_den=ivf.timebase_den,
+                        timebase_num=ivf.timebase_num,
+                    )
+                elif (ivf.fourcc, ivf.width, ivf.height) != (
+                    writer.fourcc,
+                    writer.width,
+                    writer.height,
+                ) or (ivf.timebase_den, ivf.timebase_num) != (
+                    writer.timebase_den,
+                    writer.timebase_num,
+                ):
+                    raise IvfFormatError(f"{path} does not match the previous chunks")
+
+                if ivf.get_frame_count() == 0:
+                    continue
+                first_timestamp = ivf.timestamps[0]
+                for i in range(ivf.get_frame_count()):
+                    writer.write_frame(
+                        ivf.get_frame(i),
+                        ivf.timestamps[i] - first_timestamp + next_timestamp,
+                    )
+                next_timestamp += (
+                    ivf.timestamps[-1] - first_timestamp + ivf.get_frame_duration()
+                )
+    except Exception:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(output):
+            os.remove(output)
+        raise
+
+    writer.close()
+    return writer.frame_count
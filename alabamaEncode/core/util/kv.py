@@ -1,11 +1,16 @@
+import atexit
+import fcntl
 import json
 import os
+import sqlite3
 import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
 
 
 class AlabamaKv(object):
     """
-    A key-value store to make persisting data dead simple, each "bucket" is file in a folder, all stored in json.
+    A key-value store to make persisting data dead simple, values are anything json serialisable.
     Prototype:
     __init__(folder path for buckets)
     set(bucket, key, value)
@@ -14,13 +19,47 @@ class AlabamaKv(object):
     exists(bucket, key) -> bool
     get_global(key) -> str  # shortcut for get("kv", key)
     set_global(key, value)  # shortcut for set("kv", key, value)
+    batch()  # context manager, writes inside it are committed together
+
+    Storage is pluggable, "sqlite" keeps everything in one WAL mode database in the folder,
+    "json" is the original one-file-per-bucket layout. Json buckets left in the folder are imported
+    into sqlite the first time the bucket is touched. "auto" (default) is sqlite, unless the folder is on a network
+    filesystem, WAL needs shared memory and locking that nfs/smb don't reliably give, so those get json.
+
+    With flush_interval > 0 writes go through a write-behind cache, set() only touches memory and a background
+    thread flushes everything every `flush_interval` seconds (and at exit, or on flush()).
+    Other processes see the writes after the flush.
+
+    close() when done with a kv that doesn't live as long as the process, e.g. one per celery task.
+
+    With record_writes=True the kv remembers every key set through it, written() hands them back,
+    e.g. for a celery worker to send its results home before its temp folder goes.
     """
 
-    def __init__(self, folder):
-        self.mutex = threading.Lock()
+    def __init__(
+        self, folder, backend="auto", flush_interval: float = 0, record_writes=False
+    ):
         self.folder = folder
+        # (bucket, key) -> individual_mode, None when not recording
+        self.writes: dict[tuple[str, str], bool] | None = {} if record_writes else None
         if not os.path.exists(self.folder):
             os.makedirs(self.folder)
+        network_fs = get_network_filesystem(folder)
+        if backend == "auto":
+            backend = "json" if network_fs is not None else "sqlite"
+        match backend:
+            case "sqlite":
+                if network_fs is not None:
+                    raise ValueError(
+                        f"{folder} is on {network_fs}, sqlite WAL is not safe there, use the json kv backend"
+                    )
+                self.backend = SqliteKvBackend(folder)
+            case "json":
+                self.backend = JsonKvBackend(folder)
+            case _:
+                raise ValueError(f"Unknown kv backend {backend}")
+        if flush_interval > 0:
+            self.backend = WriteBehindKvBackend(self.backend, flush_interval)
 
     def get_global(self, key):
         return self.get("kv", key)
@@ -29,52 +68,584 @@ class AlabamaKv(object):
         return self.set("kv", key, value)
 
     def set(self, bucket, key, value, individual_mode=False):
-        with self.mutex:
-            if individual_mode:
-                bucket_path = os.path.join(self.folder, bucket)
-                if not os.path.exists(bucket_path):
-                    os.makedirs(bucket_path)
-                key_path = os.path.join(bucket_path, f"{key}.json")
-                with open(key_path, "w") as f:
-                    json.dump(value, f)
-            else:
-                bucket_content = self._load(bucket)
-                bucket_content[key] = value
-                bucket_path = os.path.join(self.folder, bucket + ".json")
-                with open(bucket_path, "w") as f:
-                    json.dump(bucket_content, f)
+        """
+        :param individual_mode: json backend only, store the key in its own file instead of rewriting the bucket
+        """
+        self.backend.set(bucket, str(key), value, individual_mode=individual_mode)
+        if self.writes is not None:
+            self.writes[(bucket, str(key))] = individual_mode
 
     def get(self, bucket, key) -> [str | None]:
+        return self.backend.get(bucket, str(key))
+
+    def get_all(self, bucket):
+        return self.backend.get_all(bucket)
+
+    def exists(self, bucket, key):
+        return self.backend.exists(bucket, str(key))
+
+    def get_many(self, bucket, keys) -> dict:
+        """
+        :return: {key: value} for the keys that exist, keys are returned as strings
+        """
+        return self.backend.get_many(bucket, [str(k) for k in keys])
+
+    def set_many(self, bucket, values: dict):
+        """
+        Set every key of `values` at once, in one transaction on sqlite
+        """
+        self.backend.set_many(bucket, {str(k): v for k, v in values.items()})
+        if self.writes is not None:
+            self.writes.update({(bucket, str(k)): False for k in values})
+
+    def scan_prefix(self, bucket, prefix: str) -> dict:
+        """
+        :return: {key: value} for every key that starts with `prefix`
+        """
+        return self.backend.scan_prefix(bucket, prefix)
+
+    def written(self) -> list[tuple[str, str, object, bool]]:
+        """
+        :return: (bucket, key, value, individual_mode) of every key set through this kv, needs record_writes=True
+        """
+        if self.writes is None:
+            raise RuntimeError("written() needs a kv created with record_writes=True")
+        return [
+            (bucket, key, self.get(bucket, key), individual_mode)
+            for (bucket, key), individual_mode in self.writes.items()
+        ]
+
+    def snapshot(self) -> "KvSnapshot":
+        """
+        A read-only in-memory copy for hot loops, every bucket is read in full the first time it's touched and never
+        again, so later writes are not visible through it
+        """
+        return KvSnapshot(self)
+
+    def batch(self):
+        """
+        Group writes, e.g. with kv.batch(): for ...: kv.set(...)
+        On sqlite they become one transaction, so one fsync instead of one per key.
+        """
+        return self.backend.batch()
+
+    def flush(self):
+        """
+        Write out anything the write-behind cache is holding, no-op without one
+        """
+        self.backend.flush()
+
+    def close(self):
+        """
+        Flush, stop the write-behind thread and close the database connections, the kv is unusable afterwards
+        """
+        self.backend.close()
+
+
+class KvSnapshot(object):
+    """
+    Frozen view of an AlabamaKv, with the same read api, see AlabamaKv.snapshot
+    """
+
+    def __init__(self, kv: AlabamaKv):
+        self.kv = kv
+        self.buckets: dict[str, dict] = {}
+
+    def _bucket(self, bucket) -> dict:
+        if bucket not in self.buckets:
+            self.buckets[bucket] = self.kv.get_all(bucket)
+        return self.buckets[bucket]
+
+    def get_global(self, key):
+        return self.get("kv", key)
+
+    def get(self, bucket, key):
+        return self._bucket(bucket).get(str(key))
+
+    def get_all(self, bucket) -> dict:
+        return dict(self._bucket(bucket))
+
+    def exists(self, bucket, key) -> bool:
+        return str(key) in self._bucket(bucket)
+
+    def get_many(self, bucket, keys) -> dict:
+        b = self._bucket(bucket)
+        return {str(k): b[str(k)] for k in keys if str(k) in b}
+
+    def scan_prefix(self, bucket, prefix: str) -> dict:
+        return {k: v for k, v in self._bucket(bucket).items() if k.startswith(prefix)}
+
+
+class KvBackend(ABC):
+    """
+    Storage behind AlabamaKv, keys are always strings by the time they get here
+    """
+
+    @abstractmethod
+    def set(self, bucket: str, key: str, value, individual_mode=False):
+        pass
+
+    @abstractmethod
+    def get(self, bucket: str, key: str):
+        pass
+
+    @abstractmethod
+    def get_all(self, bucket: str) -> dict:
+        pass
+
+    @abstractmethod
+    def exists(self, bucket: str, key: str) -> bool:
+        pass
+
+    def get_many(self, bucket: str, keys: list[str]) -> dict:
+        b = self.get_all(bucket)
+        return {k: b[k] for k in keys if k in b}
+
+    def set_many(self, bucket: str, values: dict):
+        with self.batch():
+            for k, v in values.items():
+                self.set(bucket, k, v)
+
+    def scan_prefix(self, bucket: str, prefix: str) -> dict:
+        return {k: v for k, v in self.get_all(bucket).items() if k.startswith(prefix)}
+
+    @contextmanager
+    def batch(self):
+        yield
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonKvBackend(KvBackend):
+    """
+    Each "bucket" is file in a folder, all stored in json. Every write rewrites the whole bucket.
+    Files are replaced atomically, so a crash mid-write leaves the old bucket, and read-modify-write cycles hold an
+    flock on the folder, so writers in other processes don't lose each other's updates.
+    """
+
+    def __init__(self, folder):
+        self.mutex = threading.Lock()
+        self.folder = folder
+        self.lock_path = os.path.join(folder, ".kv.lock")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["mutex"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.mutex = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self.mutex, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def set(self, bucket, key, value, individual_mode=False):
+        if individual_mode:
+            bucket_path = os.path.join(self.folder, bucket)
+            os.makedirs(bucket_path, exist_ok=True)
+            write_json_atomic(os.path.join(bucket_path, f"{key}.json"), value)
+        else:
+            self.set_many(bucket, {key: value})
+
+    def set_many(self, bucket, values):
+        with self._locked():
+            bucket_content = load_json_bucket(self.folder, bucket)
+            bucket_content.update(values)
+            write_json_atomic(
+                os.path.join(self.folder, bucket + ".json"), bucket_content
+            )
+
+    def get(self, bucket, key):
         with self.mutex:
-            b = self._load(bucket)
-            if not isinstance(key, str):
-                key = str(key)
+            b = load_json_bucket(self.folder, bucket)
             if key not in b:
                 return None
             return b[key]
 
     def get_all(self, bucket):
         with self.mutex:
-            b = self._load(bucket)
-            return b
+            return load_json_bucket(self.folder, bucket)
 
     def exists(self, bucket, key):
         with self.mutex:
-            b = self._load(bucket)
-            return key in b
-
-    def _load(self, bucket_name: str) -> dict:
-        bucket_path = os.path.join(self.folder, bucket_name)
-        single_file_path = bucket_path + ".json"
-        if os.path.exists(single_file_path):
-            with open(single_file_path, "r") as f:
-                return json.load(f)
-        elif os.path.exists(bucket_path):
-            bucket_content = {}
-            for key_file in os.listdir(bucket_path):
-                key = os.path.splitext(key_file)[0]
-                with open(os.path.join(bucket_path, key_file)) as f:
-                    bucket_content[key] = json.load(f)
-            return bucket_content
-        else:
-            return {}
+            return key in load_json_bucket(self.folder, bucket)
+
+
+NETWORK_FILESYSTEMS = (
+    "nfs",
+    "nfs4",
+    "cifs",
+    "smb3",
+    "smbfs",
+    "9p",
+    "ceph",
+    "glusterfs",
+    "lustre",
+    "fuse.sshfs",
+    "fuse.glusterfs",
+    "fuse.cephfs",
+)
+
+
+def get_network_filesystem(folder: str) -> str | None:
+    """
+    :return: the filesystem type if `folder` lives on a network filesystem, None otherwise (or if it can't tell)
+    """
+    try:
+        with open("/proc/mounts") as f:
+            mounts = [line.split() for line in f]
+    except OSError:
+        return None
+    path = os.path.realpath(folder)
+    best_mount, best_type = "", None
+    for fields in mounts:
+        if len(fields) < 3:
+            continue
+        # spaces etc. in mount points are octal escaped
+        mount = fields[1].encode().decode("unicode_escape")
+        inside = path == mount or path.startswith(mount.rstrip("/") + "/")
+        # the deepest mount point wins, later mounts over the same point shadow earlier ones
+        if inside and len(mount) >= len(best_mount):
+            best_mount, best_type = mount, fields[2]
+    return best_type if best_type in NETWORK_FILESYSTEMS else None
+
+
+def write_json_atomic(path: str, value):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(value, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def load_json_bucket(folder: str, bucket_name: str) -> dict:
+    bucket_path = os.path.join(folder, bucket_name)
+    single_file_path = bucket_path + ".json"
+    if os.path.exists(single_file_path):
+        with open(single_file_path, "r") as f:
+            return json.load(f)
+    elif os.path.isdir(bucket_path):
+        bucket_content = {}
+        for key_file in os.listdir(bucket_path):
+            if not key_file.endswith(".json"):
+                continue
+            key = os.path.splitext(key_file)[0]
+            with open(os.path.join(bucket_path, key_file)) as f:
+                bucket_content[key] = json.load(f)
+        return bucket_content
+    else:
+        return {}
+
+
+class SqliteKvBackend(KvBackend):
+    """
+    All buckets in one sqlite database in WAL mode, readers never block each other or the writer,
+    and a write touches one row instead of the whole bucket. Each thread (and process) gets its own connection.
+    """
+
+    db_name = "kv.sqlite"
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, self.db_name)
+        self._local = threading.local()
+        self._imported_buckets = set()
+        # (pid, connection) of every thread, so close() can reach them all
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (bucket TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " PRIMARY KEY (bucket, key)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS imported_buckets (bucket TEXT PRIMARY KEY)"
+        )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        del state["_connections"]
+        del state["_connections_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        # connections aren't shared between threads, and must not survive a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            # only close() touches it from another thread
+            conn = sqlite3.connect(
+                self.path, timeout=60, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.batch_depth = 0
+            with self._connections_lock:
+                self._connections.append((os.getpid(), conn))
+        return conn
+
+    def close(self):
+        with self._connections_lock:
+            for pid, conn in self._connections:
+                # a forked child leaves its parent's connections alone
+                if pid == os.getpid():
+                    conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    @contextmanager
+    def batch(self):
+        conn = self._conn()
+        if self._local.batch_depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        self._local.batch_depth += 1
+        try:
+            yield
+        except BaseException:
+            self._local.batch_depth -= 1
+            if self._local.batch_depth == 0:
+                conn.execute("ROLLBACK")
+            raise
+        self._local.batch_depth -= 1
+        if self._local.batch_depth == 0:
+            conn.execute("COMMIT")
+
+    def _import_json_bucket(self, bucket: str):
+        """
+        Pull a bucket written by the json backend into the database, once
+        """
+        if bucket in self._imported_buckets:
+            return
+        conn = self._conn()
+        with self.batch():
+            done = conn.execute(
+                "SELECT 1 FROM imported_buckets WHERE bucket = ?", (bucket,)
+            ).fetchone()
+            if done is None:
+                legacy = load_json_bucket(self.folder, bucket)
+                # rows already in the database are newer than the json leftovers
+                conn.executemany(
+                    "INSERT OR IGNORE INTO kv (bucket, key, value) VALUES (?, ?, ?)",
+                    [(bucket, k, json.dumps(v)) for k, v in legacy.items()],
+                )
+                conn.execute(
+                    "INSERT INTO imported_buckets (bucket) VALUES (?)", (bucket,)
+                )
+        if (
+            self._local.batch_depth == 0
+        ):  # inside a batch it's not final until the outer commit
+            self._imported_buckets.add(bucket)
+
+    def set(self, bucket, key, value, individual_mode=False):
+        self._import_json_bucket(bucket)
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (bucket, key, value) VALUES (?, ?, ?)",
+            (bucket, key, json.dumps(value)),
+        )
+
+    def get(self, bucket, key):
+        self._import_json_bucket(bucket)
+        row = (
+            self._conn()
+            .execute("SELECT value FROM kv WHERE bucket = ? AND key = ?", (bucket, key))
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def get_all(self, bucket):
+        self._import_json_bucket(bucket)
+        rows = self._conn().execute(
+            "SELECT key, value FROM kv WHERE bucket = ?", (bucket,)
+        )
+        return {k: json.loads(v) for k, v in rows}
+
+    def exists(self, bucket, key):
+        self._import_json_bucket(bucket)
+        row = (
+            self._conn()
+            .execute("SELECT 1 FROM kv WHERE bucket = ? AND key = ?", (bucket, key))
+            .fetchone()
+        )
+        return row is not None
+
+    def get_many(self, bucket, keys):
+        self._import_json_bucket(bucket)
+        conn = self._conn()
+        found = {}
+        # stay well under sqlite's bound parameter limit
+        for i in range(0, len(keys), 500):
+            part = keys[i : i + 500]
+            rows = conn.execute(
+                f"SELECT key, value FROM kv WHERE bucket = ? AND key IN ({','.join('?' * len(part))})",
+                (bucket, *part),
+            )
+            found.update({k: json.loads(v) for k, v in rows})
+        return found
+
+    def set_many(self, bucket, values):
+        self._import_json_bucket(bucket)
+        with self.batch():
+            self._conn().executemany(
+                "INSERT OR REPLACE INTO kv (bucket, key, value) VALUES (?, ?, ?)",
+                [(bucket, k, json.dumps(v)) for k, v in values.items()],
+            )
+
+    def scan_prefix(self, bucket, prefix):
+        self._import_json_bucket(bucket)
+        # a range over the primary key instead of LIKE, so it's an index seek and '_' or '%' in keys don't matter
+        rows = self._conn().execute(
+            "SELECT key, value FROM kv WHERE bucket = ? AND key >= ? AND key < ?",
+            (bucket, prefix, prefix + "\U0010ffff"),
+        )
+        return {k: json.loads(v) for k, v in rows}
+
+
+class WriteBehindKvBackend(KvBackend):
+    """
+    Holds writes in memory and hands them to the wrapped backend in batches, from a background thread.
+    Reads see the pending writes. A crash loses at most the last `flush_interval` seconds of writes,
+    never a whole bucket, since the backends themselves write atomically.
+    """
+
+    def __init__(self, inner: KvBackend, flush_interval: float):
+        self.inner = inner
+        self.flush_interval = flush_interval
+        # bucket -> key -> json string, serialised at set() time so the caller can keep mutating its object
+        self.pending: dict[str, dict[str, str]] = {}
+        self.flushing: dict[str, dict[str, str]] = {}
+        self.individual_buckets = set()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._flush_loop, daemon=True, name="kv-write-behind"
+        )
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Failed to flush the kv cache, will retry: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        atexit.unregister(self.flush)
+        try:
+            self.flush()
+        finally:
+            self.inner.close()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if len(self.pending) == 0:
+                    return
+                self.flushing, self.pending = self.pending, {}
+            try:
+                with self.inner.batch():
+                    for bucket, values in self.flushing.items():
+                        values = {k: json.loads(v) for k, v in values.items()}
+                        if bucket in self.individual_buckets:
+                            for k, v in values.items():
+                                self.inner.set(bucket, k, v, individual_mode=True)
+                        else:
+                            self.inner.set_many(bucket, values)
+            except Exception:
+                # put them back, anything set since is newer
+                with self.lock:
+                    for bucket, values in self.flushing.items():
+                        self.pending[bucket] = {
+                            **values,
+                            **self.pending.get(bucket, {}),
+                        }
+                raise
+            finally:
+                with self.lock:
+                    self.flushing = {}
+
+    def _overlay(self, bucket) -> dict[str, str]:
+        # caller holds self.lock
+        return {**self.flushing.get(bucket, {}), **self.pending.get(bucket, {})}
+
+    def set(self, bucket, key, value, individual_mode=False):
+        self.set_many(bucket, {key: value})
+        if individual_mode:
+            self.individual_buckets.add(bucket)
+
+    def set_many(self, bucket, values):
+        encoded = {k: json.dumps(v) for k, v in values.items()}
+        with self.lock:
+            self.pending.setdefault(bucket, {}).update(encoded)
+
+    def get(self, bucket, key):
+        with self.lock:
+            overlay = self._overlay(bucket)
+        if key in overlay:
+            return json.loads(overlay[key])
+        return self.inner.get(bucket, key)
+
+    def get_all(self, bucket):
+        with self.lock:
+            overlay = self._overlay(bucket)
+        return {
+            **self.inner.get_all(bucket),
+            **{k: json.loads(v) for k, v in overlay.items()},
+        }
+
+    def exists(self, bucket, key):
+        with self.lock:
+            if key in self._overlay(bucket):
+                return True
+        return self.inner.exists(bucket, key)
+
+    def get_many(self, bucket, keys):
+        with self.lock:
+            overlay = self._overlay(bucket)
+        found = self.inner.get_many(bucket, [k for k in keys if k not in overlay])
+        found.update({k: json.loads(overlay[k]) for k in keys if k in overlay})
+        return found
+
+    def scan_prefix(self, bucket, prefix):
+        with self.lock:
+            overlay = self._overlay(bucket)
+        found = self.inner.scan_prefix(bucket, prefix)
+        found.update(
+            {k: json.loads(v) for k, v in overlay.items() if k.startswith(prefix)}
+        )
+        return found
+
+    def batch(self):
+        # writes are already batched by the flush
+        return nullcontext()
+
+    def __reduce__(self):
+        # the other process gets its own cache (and flush thread) over the same storage
+        self.flush()
+        return WriteBehindKvBackend, (self.inner, self.flush_interval)
@@ -1,12 +1,15 @@
 import copy
 import os
+import shlex
 import time
 from abc import abstractmethod, ABC
 from typing import List
 
 from tqdm import tqdm
 
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.bin_utils import check_bin
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
+from alabamaEncode.core.util.cpu_topology import CoreSet, format_cpu_list
 from alabamaEncode.core.ffmpeg import Ffmpeg
 from alabamaEncode.core.util.path import PathAlabama
 from alabamaEncode.encoder.codec import Codec
@@ -48,7 +51,8 @@ class Encoder(ABC):
     tile_cols = -1
     tile_rows = -1
     override_flags: str = ""
-    pin_to_core = -1
+    # CoreSet the decoder and encoder stages get pinned to with taskset, None leaves it to the scheduler
+    core_set: CoreSet = None
     niceness = 0
 
     bit_override = 10
@@ -103,7 +107,8 @@ class Encoder(ABC):
     svt_master_display = ""
     hdr = False
 
-    running_on_celery = False
+    # how much of the encoders output (in characters) we keep around for error reporting
+    max_captured_output = 256 * 1024
 
     def supports_float_crfs(self) -> bool:
         return False
@@ -158,21 +163,9 @@ class Encoder(ABC):
             if self.chunk.chunk_index is None:
                 raise Exception("FATAL: current_scene_index is None")
 
-            original_path = copy.deepcopy(self.output_path)
-            temp_celery_path = "/tmp/celery/"
-            celery_path = (
-                f"{temp_celery_path}{os.path.basename(self.output_path)}"
-                f"{self.get_chunk_file_extension()}"
-            )
-
-            if self.running_on_celery:
-                os.makedirs(temp_celery_path, exist_ok=True)
-                self.output_path = celery_path
-
             cli_output = []
             start = time.time()
             commands = self.get_encode_commands()
-            self.output_path = original_path
 
             times_called = 0
             latest_frame_update = 0
@@ -188,42 +181,31 @@ class Encoder(ABC):
                     parse_func = None
 
                     if has_frame_callback:
-                        # We can report progress to a callback
-                        output_buffer = ""
-
-                        def parse(string):
-                            nonlocal output_buffer
+                        # We can report progress to a callback, the output is fed to us line by line
+                        def parse(line):
                             nonlocal times_called
                             nonlocal latest_frame_update
-                            output_buffer += string
-                            prog = self.parse_output_for_output(output_buffer)
+                            prog = self.parse_output_for_output(line)
 
                             if len(prog) > 0:
                                 times_called += 1
-                                # tqdm.write("FRAME ENCODED")
-                                # tqdm.write(str(prog))
                                 latest_frame_update = prog[0]
                                 on_frame_encoded(prog[0], prog[1], prog[2])
 
-                                output_buffer = ""
-
                         parse_func = parse
 
                     cli_out = (
                         run_cli(
-                            command, timeout_value=timeout_value, on_output=parse_func
+                            command,
+                            timeout_value=timeout_value,
+                            on_line=parse_func,
+                            max_output_size=self.max_captured_output,
                         )
                         .verify()
                         .get_output()
                     )
                     cli_output.append(cli_out)
 
-                if self.running_on_celery:
-                    # os.rename(celery_path, original_path)
-                    # do a copy instead bc "invalid cross-device link"
-                    run_cli(f'cp "{celery_path}" "{original_path}"').verify()
-                    os.remove(celery_path)
-
                 if has_frame_callback:
                     latest_frame_update = int(latest_frame_update)
 
@@ -296,10 +278,11 @@ class Encoder(ABC):
         return stats
 
     @abstractmethod
-    def get_encode_commands(self) -> List[str]:
+    def get_encode_commands(self) -> List[str | CliPipeline]:
         """
         Abstract method overriden by encoders.
-        :return: A list of cli commands to encode, according to class fields
+        :return: A list of cli commands to encode, according to class fields,
+        either shell strings or shell-free CliPipelines
         """
         pass
 
@@ -312,6 +295,36 @@ class Encoder(ABC):
             bit_depth=self.bit_override,
         )
 
+    def get_ffmpeg_pipe_argv(self) -> List[str]:
+        """
+        return the argv of an ffmpeg process that pipes a y4m stream into stdout using the chunk object,
+        meant as the first stage of a CliPipeline
+        """
+        return self.get_taskset_argv("decoder") + self.chunk.create_chunk_ffmpeg_pipe_argv(
+            video_filters=self.video_filters,
+            bit_depth=self.bit_override,
+        )
+
+    def get_taskset_argv(self, stage: str) -> List[str]:
+        """
+        :param stage: "decoder" or "encoder"
+        :return: a taskset prefix that pins a process to the cores core_set gave `stage`, [] if not pinned
+        """
+        if self.core_set is None or not check_bin("taskset"):
+            return []
+        cpus = self.core_set.decoder if stage == "decoder" else self.core_set.encoder
+        return ["taskset", "-a", "-c", format_cpu_list(cpus)]
+
+    def pipe_into(self, encoder_command: str) -> CliPipeline:
+        """
+        :param encoder_command: encoder command line reading y4m from stdin, split like a shell would
+        :return: a CliPipeline of the chunk's ffmpeg y4m stream piped into `encoder_command`
+        """
+        return CliPipeline(
+            self.get_ffmpeg_pipe_argv(),
+            self.get_taskset_argv("encoder") + shlex.split(encoder_command),
+        )
+
     @abstractmethod
     def get_chunk_file_extension(self) -> str:
         return ".mkv"
@@ -326,7 +339,7 @@ class Encoder(ABC):
     def parse_output_for_output(self, buffer) -> [List[str] | None]:
         """
         Parse the output of the encoder and return the frame number, bitrate, and fps.
-        :param buffer: The output of the encoder so far
+        :param buffer: A single line of encoder output
         :return: a list of [frame, bitrate, fps], [] if no output is found, None if not implemented
         """
         return None
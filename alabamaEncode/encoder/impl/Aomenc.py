@@ -3,7 +3,7 @@ from copy import copy
 from typing import List
 
 from alabamaEncode.core.util.bin_utils import get_binary
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
 from alabamaEncode.encoder.codec import Codec
 from alabamaEncode.encoder.encoder import Encoder
 from alabamaEncode.encoder.rate_dist import EncoderRateDistribution
@@ -36,13 +36,9 @@ class EncoderAom(Encoder):
         self.photon_noise_path = ""
         self.use_webm = False
 
-    def get_encode_commands(self) -> List[str]:
+    def get_encode_commands(self) -> List[CliPipeline]:
         self.speed = min(self.speed, 9)
-        encode_command = self.chunk.create_chunk_ffmpeg_pipe_command(
-            video_filters=self.video_filters
-        )
-        encode_command += " | "
-        encode_command += f"{get_binary('aomenc')} - "
+        encode_command = f"{get_binary('aomenc')} - "
         encode_command += " --quiet "
         encode_command += f'-o "{self.output_path}" '
 
@@ -105,10 +101,14 @@ class EncoderAom(Encoder):
             pass1 = copy(encode_command)
             pass1 += " --pass=1"
 
-            return [pass1, pass2, f"rm {self.output_path}.log"]
+            return [
+                self.pipe_into(pass1),
+                self.pipe_into(pass2),
+                CliPipeline(["rm", f"{self.output_path}.log"]),
+            ]
         else:
             encode_command += " --pass=1"
-            return [encode_command]
+            return [self.pipe_into(encode_command)]
 
     def get_chunk_file_extension(self) -> str:
         return ".ivf"
@@ -1,6 +1,7 @@
 from typing import List
 
 from alabamaEncode.core.util.bin_utils import get_binary
+from alabamaEncode.core.util.cli_executor import CliPipeline
 from alabamaEncode.encoder.codec import Codec
 from alabamaEncode.encoder.encoder import Encoder
 from alabamaEncode.encoder.rate_dist import EncoderRateDistribution
@@ -11,11 +12,9 @@ class EncoderNVENCH264(Encoder):
     def get_pretty_name(self) -> str:
         return "NVENC_H264"
 
-    def get_encode_commands(self) -> List[str]:
+    def get_encode_commands(self) -> List[CliPipeline]:
         self.bit_override = 8  # TODO: check vaapi profile support
         vec = []
-        vec.append(self.get_ffmpeg_pipe_command())
-        vec.append("|")
         vec.append(get_binary("ffmpeg"))
         vec.append(" -hide_banner -y -i -")
         vec.append(f"-c:v h264_nvenc")
@@ -54,7 +53,7 @@ class EncoderNVENCH264(Encoder):
         # output
         vec.append(f'"{self.output_path}"')
 
-        return [" ".join(vec)]
+        return [self.pipe_into(" ".join(vec))]
 
     def get_chunk_file_extension(self) -> str:
         return ".mkv"
@@ -1,8 +1,9 @@
 import re
+import shlex
 from typing import List
 
-from alabamaEncode.core.util.bin_utils import get_binary, check_bin
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.bin_utils import get_binary, BinaryRegistry
+from alabamaEncode.core.util.cli_executor import CliPipeline
 from alabamaEncode.encoder.codec import Codec
 from alabamaEncode.encoder.encoder import Encoder
 from alabamaEncode.encoder.rate_dist import EncoderRateDistribution
@@ -18,50 +19,48 @@ class EncoderSvt(Encoder):
     def supports_grain_synth(self) -> bool:
         return True
 
-    def get_encode_commands(self) -> List[str]:
+    def get_encode_commands(self) -> List[CliPipeline]:
         if (
             self.keyint == -1 or self.keyint == -2
         ) and self.rate_distribution == EncoderRateDistribution.VBR:
             print("WARNING: keyint must be set for VBR, setting to 240")
             self.keyint = 240
 
-        kommand = ""
+        feeder = self.get_ffmpeg_pipe_argv()
 
-        if check_bin("taskset"):
-            if self.pin_to_core != -1:
-                kommand += f"taskset -a -c {self.pin_to_core} "
-
-        kommand += (
-            f"{self.get_ffmpeg_pipe_command()} | "
-            f"{get_binary('SvtAv1EncApp')}"
-            f" -i stdin"
-            f" --input-depth {self.bit_override}"
-            f" --progress 2 "
-        )
+        kommand = self.get_taskset_argv("encoder") + [
+            get_binary("SvtAv1EncApp"),
+            "-i",
+            "stdin",
+            "--input-depth",
+            self.bit_override,
+            "--progress",
+            "2",
+        ]
 
         match self.rate_distribution:
             case EncoderRateDistribution.CQ:
                 if self.passes != 1:
                     print("WARNING: passes must be 1 for CQ, setting to 1")
                     self.passes = 1
-                kommand += f" --crf {self.crf} --rc 0"
+                kommand += ["--crf", self.crf, "--rc", "0"]
             case EncoderRateDistribution.VBR:
-                kommand += f" --rc 1 --tbr {self.bitrate} --undershoot-pct 95 --overshoot-pct 10 "
+                kommand += ["--rc", "1", "--tbr", self.bitrate]
+                kommand += ["--undershoot-pct", "95", "--overshoot-pct", "10"]
             case EncoderRateDistribution.CQ_VBV:
-                kommand += f" --crf {self.crf} --mbr {self.bitrate}"
+                kommand += ["--crf", self.crf, "--mbr", self.bitrate]
             case EncoderRateDistribution.VBR_VBV:
                 raise Exception("FATAL: VBR_VBV is not supported")
 
-        kommand += f" --pin 0"
-        kommand += f" --lp {self.threads}"
+        kommand += ["--pin", "0"]
+        kommand += ["--lp", self.threads]
 
-        kommand += f" --preset {self.speed}"
+        kommand += ["--preset", self.speed]
 
         # check one be one if any flags are in the override flags, if not use the framework ones
         def add_flag(flag, value):
-            nonlocal kommand
             if flag not in self.override_flags:
-                kommand += f" {flag} {value}"
+                kommand.extend([flag, value])
 
         if 0 <= self.grain_synth <= 50 and "--film-grain":
             add_flag("--film-grain", self.grain_synth)
@@ -80,7 +79,7 @@ class EncoderSvt(Encoder):
             )
 
             if self.svt_master_display != "":
-                add_flag("--mastering-display", f'"{self.svt_master_display}"')
+                add_flag("--mastering-display", self.svt_master_display)
 
         add_flag("--tune", self.svt_tune)
         add_flag("--aq-mode", self.svt_aq_mode)
@@ -121,28 +120,31 @@ class EncoderSvt(Encoder):
             add_flag("--resize-kf-denominator", self.svt_resize_kf_denominator)
 
         if self.override_flags != "":
-            kommand += " " + self.override_flags + " "
+            kommand += shlex.split(self.override_flags)
 
-        stats_bit = ""
+        stats_bit = []
 
         if self.passes > 1:
-            stats_bit = f"--stats {self.output_path}.stat"
+            stats_bit = ["--stats", f"{self.output_path}.stat"]
+
+        def svt_pass(*args) -> CliPipeline:
+            return CliPipeline(feeder, kommand + list(args))
 
         match self.passes:
             case 2:
                 commands = [
-                    f"{kommand} --pass 1 {stats_bit}",
-                    f"{kommand} --pass 2 {stats_bit} -b {self.output_path}",
-                    f"rm {self.output_path}.stat",
+                    svt_pass("--pass", 1, *stats_bit),
+                    svt_pass("--pass", 2, *stats_bit, "-b", self.output_path),
+                    CliPipeline(["rm", f"{self.output_path}.stat"]),
                 ]
             case 1:
-                commands = [f'{kommand} -b "{self.output_path}"']
+                commands = [svt_pass("-b", self.output_path)]
             case 3:
                 commands = [
-                    f"{kommand} --pass 1 {stats_bit}",
-                    f"{kommand} --pass 2 {stats_bit}",
-                    f"{kommand} --pass 3 {stats_bit} -b {self.output_path}",
-                    f"rm {self.output_path}.stat",
+                    svt_pass("--pass", 1, *stats_bit),
+                    svt_pass("--pass", 2, *stats_bit),
+                    svt_pass("--pass", 3, *stats_bit, "-b", self.output_path),
+                    CliPipeline(["rm", f"{self.output_path}.stat"]),
                 ]
             case _:
                 raise Exception(f"FATAL: invalid passes count {self.passes}")
@@ -155,14 +157,14 @@ class EncoderSvt(Encoder):
     def get_version(self) -> str:
         # Svt[info]: -------------------------------------------
         # Svt[info]: SVT [version]:	SVT-AV1 Encoder Lib v1.7.0-2-g09df835
-        o = run_cli(f"{get_binary('SvtAv1EncApp')} --version").get_output()
+        o = BinaryRegistry.run_probe("SvtAv1EncApp", ["--version"])
         return " ".join(o.split(" ")[:-1])
 
     def is_psy(self) -> bool:
-        return "PSY" in self.get_version()
+        return BinaryRegistry.has_capability("SvtAv1EncApp", "psy")
 
     def parse_output_for_output(self, buffer) -> List[str]:
-        if buffer is None:
+        if buffer is None or "Encoding frame" not in buffer:
             return []
         match = re.search(r"Encoding frame .+\d f", buffer)
         if match:  # check if we are past the header, also extract the string
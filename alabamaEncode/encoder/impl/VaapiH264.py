@@ -1,6 +1,7 @@
 from typing import List
 
 from alabamaEncode.core.util.bin_utils import get_binary
+from alabamaEncode.core.util.cli_executor import CliPipeline
 from alabamaEncode.encoder.codec import Codec
 from alabamaEncode.encoder.encoder import Encoder
 from alabamaEncode.encoder.rate_dist import EncoderRateDistribution
@@ -13,11 +14,9 @@ class EncoderVaapiH264(Encoder):
     def get_codec(self) -> Codec:
         return Codec.h264
 
-    def get_encode_commands(self) -> List[str]:
+    def get_encode_commands(self) -> List[CliPipeline]:
         self.bit_override = 8  # TODO: check vaapi profile support
         vec = []
-        vec.append(self.get_ffmpeg_pipe_command())
-        vec.append("|")
         vec.append(get_binary("ffmpeg"))
         vec.append(" -hide_banner -y -i -")
         vec.append(f"-c:v h264_vaapi")
@@ -57,7 +56,7 @@ class EncoderVaapiH264(Encoder):
         # output
         vec.append(f'"{self.output_path}"')
 
-        return [" ".join(vec)]
+        return [self.pipe_into(" ".join(vec))]
 
     def get_chunk_file_extension(self) -> str:
         return ".avi"
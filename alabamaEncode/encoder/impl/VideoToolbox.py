@@ -1,6 +1,7 @@
 from typing import List
 
 from alabamaEncode.core.util.bin_utils import get_binary
+from alabamaEncode.core.util.cli_executor import CliPipeline
 from alabamaEncode.encoder.codec import Codec
 from alabamaEncode.encoder.encoder import Encoder
 from alabamaEncode.encoder.rate_dist import EncoderRateDistribution
@@ -13,10 +14,8 @@ class EncoderAppleHEVC(Encoder):
     def get_pretty_name(self) -> str:
         return "APPLE_H265"
 
-    def get_encode_commands(self) -> List[str]:
+    def get_encode_commands(self) -> List[CliPipeline]:
         vec = [
-            self.get_ffmpeg_pipe_command(),
-            "|",
             get_binary("ffmpeg"),
             " -hide_banner -y -i -",
             f"-c:v hevc_videotoolbox",
@@ -60,7 +59,7 @@ class EncoderAppleHEVC(Encoder):
 
         vec.append(f'"{self.output_path}"')
 
-        return [" ".join(vec)]
+        return [self.pipe_into(" ".join(vec))]
 
     def get_chunk_file_extension(self) -> str:
         return ".mkv"
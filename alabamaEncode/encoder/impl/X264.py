@@ -1,7 +1,7 @@
 from typing import List
 
 from alabamaEncode.core.util.bin_utils import get_binary
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
 from alabamaEncode.core.ffmpeg import Ffmpeg
 from alabamaEncode.core.util.path import PathAlabama
 from alabamaEncode.encoder.codec import Codec
@@ -27,18 +27,13 @@ class EncoderX264(Encoder):
             .strip()
         )
 
-    def get_encode_commands(self) -> List[str]:
+    def get_encode_commands(self) -> List[CliPipeline]:
         self.speed = max(min(self.speed, 9), 0)
 
         if not self.hdr:
             self.bit_override = 8
 
-        taskset = ""
-
-        if self.pin_to_core != -1:
-            taskset += f" taskset -a -c {self.pin_to_core} "
-
-        kommand = f" {self.get_ffmpeg_pipe_command()} |{taskset}{get_binary('x264')} - --stdin y4m "
+        kommand = f"{get_binary('x264')} - --stdin y4m "
 
         kommand += f" --threads {self.threads} "
 
@@ -156,35 +151,37 @@ class EncoderX264(Encoder):
             kommand += f" --pass 1 "
 
         if self.passes == 1:
-            return [f'{kommand} -o "{self.output_path}"']
+            return [self.pipe_into(f'{kommand} -o "{self.output_path}"')]
         elif self.passes > 1:
             com = []
             for i in range(self.passes):
-                com += [f'{kommand} --pass {i + 1} -o "{self.output_path}"']
+                com += [
+                    self.pipe_into(f'{kommand} --pass {i + 1} -o "{self.output_path}"')
+                ]
 
             com += [
-                f"rm -f {self.output_path}.stats",
-                f"rm -f {self.output_path}.stats.mbtree",
+                CliPipeline(["rm", "-f", f"{self.output_path}.stats"]),
+                CliPipeline(["rm", "-f", f"{self.output_path}.stats.mbtree"]),
             ]
 
             return com
         elif self.passes == -2:
             # if passes == -2, do second pass only
-            com = [f'{kommand} --pass 2 -o "{self.output_path}"']
+            com = [self.pipe_into(f'{kommand} --pass 2 -o "{self.output_path}"')]
             com += [
-                f"rm -f {self.output_path}.stats",
-                f"rm -f {self.output_path}.stats.mbtree",
+                CliPipeline(["rm", "-f", f"{self.output_path}.stats"]),
+                CliPipeline(["rm", "-f", f"{self.output_path}.stats.mbtree"]),
             ]
             return com
         elif self.passes == -3:
             # if passes == -3, do second and third pass
             com = [
-                f'{kommand} --pass 2 -o "{self.output_path}"',
-                f'{kommand} --pass 3 -o "{self.output_path}"',
+                self.pipe_into(f'{kommand} --pass 2 -o "{self.output_path}"'),
+                self.pipe_into(f'{kommand} --pass 3 -o "{self.output_path}"'),
             ]
             com += [
-                f"rm -f {self.output_path}.stats",
-                f"rm -f {self.output_path}.stats.mbtree",
+                CliPipeline(["rm", "-f", f"{self.output_path}.stats"]),
+                CliPipeline(["rm", "-f", f"{self.output_path}.stats.mbtree"]),
             ]
             return com
 
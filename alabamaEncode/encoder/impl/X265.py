@@ -1,7 +1,7 @@
 from typing import List
 
 from alabamaEncode.core.util.bin_utils import get_binary
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
 from alabamaEncode.encoder.codec import Codec
 from alabamaEncode.encoder.encoder import Encoder
 from alabamaEncode.encoder.rate_dist import EncoderRateDistribution
@@ -24,13 +24,11 @@ class EncoderX265(Encoder):
             .strip()
         )
 
-    def get_encode_commands(self) -> List[str]:
+    def get_encode_commands(self) -> List[CliPipeline]:
         if self.speed == 0:
             self.speed = 1
 
-        kommand = (
-            f" {self.get_ffmpeg_pipe_command()} | {get_binary('x265')} --input - --y4m "
-        )
+        kommand = f"{get_binary('x265')} --input - --y4m "
 
         if self.hdr:
             kommand += f" --output-depth {self.bit_override} "
@@ -87,11 +85,15 @@ class EncoderX265(Encoder):
             raise Exception("FATAL: 2 pass encoding not supported")
         elif self.passes == 1:
             hevc_file = self.output_path.replace(".mkv", ".hevc")
-            remux_command = (
-                f'{get_binary("mkvmerge")} -o "{self.output_path}" "{hevc_file}"'
+            remux_command = CliPipeline(
+                [get_binary("mkvmerge"), "-o", self.output_path, hevc_file]
             )
-            del_commnad = f'rm "{hevc_file}"'
-            return [f'{kommand} -o "{hevc_file}"', remux_command, del_commnad]
+            del_commnad = CliPipeline(["rm", hevc_file])
+            return [
+                self.pipe_into(f'{kommand} -o "{hevc_file}"'),
+                remux_command,
+                del_commnad,
+            ]
 
     def get_chunk_file_extension(self) -> str:
         return ".mkv"
@@ -1,7 +1,7 @@
 from typing import List
 
 from alabamaEncode.core.util.bin_utils import get_binary
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
 from alabamaEncode.encoder.codec import Codec
 from alabamaEncode.encoder.encoder import Encoder
 from alabamaEncode.encoder.rate_dist import EncoderRateDistribution
@@ -11,13 +11,11 @@ class EncoderRav1e(Encoder):
     def get_pretty_name(self) -> str:
         return "RAV1E"
 
-    def get_encode_commands(self) -> List[str]:
+    def get_encode_commands(self) -> List[CliPipeline]:
         vec = [
-            self.get_ffmpeg_pipe_command(),
-            "|",
             get_binary("rav1e"),
             "-",
-            f"-o {self.output_path}",
+            f'-o "{self.output_path}"',
             f"-y",
             f"--threads {self.threads}",
             f"--keyint {self.keyint}",
@@ -46,7 +44,7 @@ class EncoderRav1e(Encoder):
             vec.append(f"--transfer {self.transfer_characteristics}")
             vec.append(f"--matrix {self.matrix_coefficients}")
 
-        return [" ".join(vec)]
+        return [self.pipe_into(" ".join(vec))]
 
     def get_chunk_file_extension(self) -> str:
         return ".ivf"
@@ -2,7 +2,7 @@ import re
 from typing import List
 
 from alabamaEncode.core.util.bin_utils import get_binary
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
 from alabamaEncode.encoder.codec import Codec
 from alabamaEncode.encoder.encoder import Encoder
 from alabamaEncode.encoder.rate_dist import EncoderRateDistribution
@@ -25,13 +25,10 @@ class EncoderVPX(Encoder):
             raise ValueError(f"Invalid encoder: {codec}")
         self.codec = codec
 
-    def get_encode_commands(self) -> List[str]:
-        cli = ""
-        cli += self.get_ffmpeg_pipe_command()
-        cli += " | "
+    def get_encode_commands(self) -> List[CliPipeline]:
         vec = []
         vec.append(f"{get_binary('vpxenc')} -")
-        vec.append(f"--output={self.output_path}")
+        vec.append(f'--output="{self.output_path}"')
         vec.append(f"--codec={self.codec}")
         vec.append(f"--ivf")
         vec.append(f"--threads={self.threads}")
@@ -75,14 +72,16 @@ class EncoderVPX(Encoder):
 
         if self.passes == 1:
             vec.append(f"--passes=1")
-            return [cli + " ".join(vec)]
+            return [self.pipe_into(" ".join(vec))]
         elif self.passes == 2:
             vec.append(f"--passes=2")
-            vec.append(f"--fpf={self.output_path}.log")
+            vec.append(f'--fpf="{self.output_path}.log"')
             commands = []
             for i in range(1, self.passes + 1):
                 commands.append(
-                    cli + " ".join(vec) + f" --pass={i} --fpf={self.output_path}.log"
+                    self.pipe_into(
+                        " ".join(vec) + f' --pass={i} --fpf="{self.output_path}.log"'
+                    )
                 )
             return commands
 
@@ -0,0 +1,172 @@
+"""
+Calibration weighted celery dispatch and straggler copies, on a few local worker processes instead of a cluster.
+python -m alabamaEncode.experiments.celery_nodes [--equal] [--dont_speculate]
+
+Every worker is a real celery worker on a filesystem broker in CELERY_NODES_DIR, the chunks go through the job spec,
+the worker's ChunkEncoder and the upload to the coordinator like a real encode, only the final step sleeps instead of
+encoding, at each node's EXPERIMENT_FPS. The laptop throttles after a while and runs far slower than its
+calibration and its first chunks said, so whatever it has at the end straggles. --equal publishes the same
+calibration everywhere, the baseline without weights.
+"""
+
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from tqdm import tqdm
+
+# the broker and backend come from the env when celery_app is imported, the workers import this module too
+NODES_DIR = os.getenv("CELERY_NODES_DIR", "/tmp/celery_nodes")
+os.environ.setdefault("BROKER_URL", "filesystem://")
+os.environ.setdefault("BACKEND_URL", f"file://{NODES_DIR}/results")
+
+from alabamaEncode.core.chunk_encoder import ChunkEncoder
+from alabamaEncode.core.context import AlabamaContext
+from alabamaEncode.core.util.ivf import IvfWriter
+from alabamaEncode.encoder.stats import EncodeStats
+from alabamaEncode.parallel_execution.calibration import fetch_calibrations
+from alabamaEncode.parallel_execution.celery_app import app
+from alabamaEncode.parallel_execution.execute_commands import execute_commands
+from alabamaEncode.pipeline.chunk.final_encode_step import FinalEncodeStep
+from alabamaEncode.scene.chunk import ChunkObject
+
+for folder in ["queue", "control", "results"]:
+    os.makedirs(f"{NODES_DIR}/{folder}", exist_ok=True)
+app.conf.broker_transport_options = {
+    "data_folder_in": f"{NODES_DIR}/queue",
+    "data_folder_out": f"{NODES_DIR}/queue",
+    "control_folder": f"{NODES_DIR}/control",
+    # the default second between polls would dominate chunks this short
+    "polling_interval": 0.1,
+}
+
+# name, calibration fps, fps once it has been running for THROTTLE_AFTER seconds
+NODES = [
+    ("desktop", 24, 24),
+    ("server", 16, 16),
+    ("laptop", 8, 2),
+]
+THROTTLE_AFTER = 25
+# the worker's pool forks after importing this
+_worker_start = time.time()
+
+
+class SleepEncode(FinalEncodeStep):
+    """
+    Takes as long as encoding the chunk at the node's speed would, writes an ivf with the chunk's frame count
+    """
+
+    def run(self, enc, chunk, ctx, encoded_a_frame) -> EncodeStats:
+        frames = chunk.get_frame_count()
+        start = time.time()
+        fps = float(os.getenv("EXPERIMENT_FPS", "30"))
+        if time.time() - _worker_start > THROTTLE_AFTER:
+            fps = float(os.getenv("EXPERIMENT_THROTTLED_FPS", fps))
+        time.sleep(frames / fps)
+        with IvfWriter(
+            chunk.chunk_path, b"AV01", chunk.width, chunk.height, 24, 1
+        ) as ivf:
+            for i in range(frames):
+                ivf.write_frame(os.urandom(200), i)
+        return EncodeStats(
+            time_encoding=time.time() - start,
+            size=os.path.getsize(chunk.chunk_path) / 1000,
+            length_frames=frames,
+            basename=os.getenv("EXPERIMENT_NODE", ""),
+        )
+
+    def dry_run(self, enc, chunk) -> str:
+        return f"sleep {chunk.get_frame_count()} frames"
+
+
+def start_workers(equal: bool) -> list:
+    workers = []
+    for name, fps, throttled_fps in NODES:
+        env = {
+            **os.environ,
+            "EXPERIMENT_FPS": str(fps),
+            "EXPERIMENT_THROTTLED_FPS": str(throttled_fps),
+            # the same published speed everywhere leaves the weights at 1
+            "CALIBRATION_FPS": str(1 if equal else fps),
+            "EXPERIMENT_NODE": name,
+            "CELERY_WORK_DIR": f"{NODES_DIR}/work/{name}/",
+            # pickle is still accepted on the worker, celery refuses that as root without this
+            "C_FORCE_ROOT": "1",
+        }
+        workers.append(
+            subprocess.Popen(
+                [sys.executable, "-m", "celery", "-A", __spec__.name, "worker"]
+                + ["--hostname", f"{name}@local", "-c", "1", "--loglevel", "warning"],
+                env=env,
+                stdout=open(f"{NODES_DIR}/{name}.log", "w"),
+                stderr=subprocess.STDOUT,
+            )
+        )
+    return workers
+
+
+def make_jobs() -> list:
+    ctx = AlabamaContext()
+    ctx.temp_folder = f"{NODES_DIR}/temp/"
+    os.makedirs(f"{ctx.temp_folder}chunks", exist_ok=True)
+    ctx.chunk_analyze_chain = []
+    # by module name, the worker won't load a class from __main__
+    from alabamaEncode.experiments.celery_nodes import SleepEncode
+
+    ctx.chunk_encode_class = SleepEncode()
+    # a film's worth of scenes, 2 to 10 seconds
+    lengths = [48 + (i * 37) % 192 for i in range(20)]
+    ctx.total_chunks = len(lengths)
+    jobs = []
+    first = 0
+    for i, length in enumerate(lengths):
+        chunk = ChunkObject(first, first + length, "", 24, i, 1080, 1920)
+        chunk.chunk_path = f"{ctx.temp_folder}chunks/{i}.ivf"
+        jobs.append(ChunkEncoder(ctx, chunk))
+        first += length
+    return jobs
+
+
+if __name__ == "__main__":
+    equal = "--equal" in sys.argv
+    shutil.rmtree(NODES_DIR, ignore_errors=True)
+    for folder in ["queue", "control", "results"]:
+        os.makedirs(f"{NODES_DIR}/{folder}", exist_ok=True)
+    workers = start_workers(equal)
+    try:
+        while len(fetch_calibrations(app)) < len(NODES):
+            time.sleep(1)
+        jobs = make_jobs()
+        frames = sum(j.chunk.get_frame_count() for j in jobs)
+        print(
+            f"{len(jobs)} chunks, {frames} frames, "
+            f"at least {frames / sum(fps for _, fps, _ in NODES):.1f}s on {len(NODES)} nodes"
+        )
+
+        start = time.time()
+        asyncio.run(
+            execute_commands(
+                use_celery=True,
+                speculate="--dont_speculate" not in sys.argv,
+                command_objects=jobs,
+                pbar=tqdm(total=frames, unit="frame", dynamic_ncols=True),
+            )
+        )
+        print(f"makespan {time.time() - start:.1f}s")
+
+        # the workers print what they uploaded and which copies lost
+        for name, _, _ in NODES:
+            with open(f"{NODES_DIR}/{name}.log") as f:
+                log = f.read()
+            print(
+                f"{name}: {log.count('uploaded')} chunks, "
+                f"{log.count('delivered it first')} copies lost the race"
+            )
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
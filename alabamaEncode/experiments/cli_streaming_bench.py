@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of the coordinator side cost of following encoder progress output.
+Spawns a fake encoder that prints SVT style `--progress 2` lines and measures how much cpu time the *parent*
+process burns per 1000 "encoded" frames, comparing the old byte-at-a-time reader to the current run_cli.
+"""
+
+import re
+import subprocess
+import sys
+import time
+
+from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.encoder.impl.Svtenc import EncoderSvt
+
+FRAMES = 20000
+
+fake_encoder = (
+    f'{sys.executable} -c "import sys\n'
+    f"for i in range({FRAMES}):\n"
+    f"    sys.stderr.write(f'Encoding frame {{i:>8}} {{i*0.1:.2f}} kbps {{i*0.01:.2f}} fps\\\\n')\""
+)
+
+
+def legacy_run(cmd, on_frame):
+    """
+    The pre-streaming implementation, byte-at-a-time reads with a regex over the growing buffer
+    """
+    p = subprocess.Popen(
+        cmd,
+        shell=True,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    output = ""
+    output_buffer = ""
+    while p.poll() is None:
+        chunk = p.stdout.read(1).decode(errors="ignore")
+        output += chunk
+        output_buffer += chunk
+        match = re.search(r"Encoding frame .+\d f", output_buffer)
+        if match:
+            on_frame()
+            output_buffer = ""
+    p.wait()
+    output += p.stdout.read().decode(errors="ignore")
+    return output
+
+
+def streaming_run(cmd, on_frame):
+    enc = EncoderSvt()
+
+    def parse(line):
+        if len(enc.parse_output_for_output(line)) > 0:
+            on_frame()
+
+    return run_cli(
+        cmd, on_line=parse, max_output_size=enc.max_captured_output
+    ).get_output()
+
+
+def bench(name, func):
+    frames = 0
+
+    def on_frame():
+        nonlocal frames
+        frames += 1
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    func(fake_encoder, on_frame)
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    print(
+        f"{name}: {frames} frames reported, {cpu / frames * 1000 * 1000:.2f} ms coordinator cpu per 1000 frames,"
+        f" {wall:.2f}s wall"
+    )
+
+
+if __name__ == "__main__":
+    bench("legacy read(1)", legacy_run)
+    bench("streaming run_cli", streaming_run)
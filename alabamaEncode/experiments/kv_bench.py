@@ -0,0 +1,54 @@
+"""
+Benchmark of the AlabamaKv backends on a big bucket, the shape of `target_vmaf_probes` or `chunk_integrity` on a
+long encode. The json backend rewrites the whole bucket per set, so it only gets a fraction of the keys,
+otherwise this runs for hours.
+"""
+
+import shutil
+import tempfile
+import time
+
+from alabamaEncode.core.util.kv import AlabamaKv
+
+KEYS = 50_000
+JSON_KEYS = 2_000
+
+
+def timed(label, keys, func):
+    start = time.perf_counter()
+    func()
+    took = time.perf_counter() - start
+    print(f"  {label}: {took:.2f}s, {took / keys * 1e6:.1f} us per key")
+
+
+def bench(backend, keys):
+    folder = tempfile.mkdtemp()
+    try:
+        kv = AlabamaKv(folder, backend=backend)
+        value = {"crf": 30, "vmaf": 94.21, "bitrate": 1834}
+        print(f"{backend}, {keys} keys:")
+
+        def set_all():
+            for i in range(keys):
+                kv.set("probes", i, value)
+
+        def set_batched():
+            with kv.batch():
+                for i in range(keys):
+                    kv.set("probes_batched", i, value)
+
+        def get_all_keys():
+            for i in range(keys):
+                kv.get("probes", i)
+
+        timed("set", keys, set_all)
+        timed("set in one batch", keys, set_batched)
+        timed("get", keys, get_all_keys)
+        timed("get_all", keys, lambda: kv.get_all("probes"))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    bench("sqlite", KEYS)
+    bench("json", JSON_KEYS)
@@ -0,0 +1,28 @@
+"""
+Micro-benchmark of the cost of starting an encoder pipeline.
+Runs a trivial two stage pipeline many times, once as a `/bin/sh -c "a | b"` string and once as a shell-free
+CliPipeline, and prints the wall time per pipeline. The real encoders dwarf this, but it is paid per chunk per pass.
+"""
+
+import shutil
+import time
+
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
+
+RUNS = 500
+
+
+def bench(name, cmd):
+    run_cli(cmd).verify()  # warm up
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        run_cli(cmd).verify()
+    took = time.perf_counter() - start
+    print(f"{name}: {took / RUNS * 1000:.3f} ms per pipeline over {RUNS} runs")
+
+
+if __name__ == "__main__":
+    # the binary, not the shell builtin, encoders are never builtins
+    true = shutil.which("true")
+    bench("shell string", f"{true} | {true}")
+    bench("CliPipeline", CliPipeline([true], [true]))
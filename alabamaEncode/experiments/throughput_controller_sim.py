@@ -0,0 +1,46 @@
+"""
+Tune ThroughputController in the simulator, against every fixed jobs limit.
+python -m alabamaEncode.experiments.throughput_controller_sim [path/to/chunks.log]
+Without a chunks.log it replays synthetic chunks.
+"""
+
+import sys
+
+from alabamaEncode.parallel_execution.throughput_controller import (
+    ThroughputController,
+)
+from alabamaEncode.parallel_execution.throughput_sim import (
+    simulate,
+    synthetic_jobs,
+    jobs_from_chunks_log,
+    controller_limit,
+)
+
+CORES = 32
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        jobs = jobs_from_chunks_log(sys.argv[1])
+        print(f"replaying {len(jobs)} chunks from {sys.argv[1]}")
+    else:
+        jobs = synthetic_jobs()
+        print(f"{len(jobs)} synthetic chunks")
+
+    best = None
+    for fixed in range(1, CORES * 2 + 1):
+        makespan, _ = simulate(jobs, lambda now, frames, job_frames: fixed, cores=CORES)
+        if best is None or makespan < best[1]:
+            best = (fixed, makespan)
+    print(f"best fixed limit: {best[0]} jobs, {best[1]:.0f}s")
+
+    for start in [2, CORES // 2, CORES * 2]:
+        controller = ThroughputController(
+            start_limit=start, max_limit=CORES * 2, now=0.0
+        )
+        makespan, history = simulate(jobs, controller_limit(controller), cores=CORES)
+        limits = [limit for _, limit in history]
+        changes = sum(1 for a, b in zip(limits, limits[1:]) if a != b)
+        print(
+            f"controller from {start}: {makespan:.0f}s ({makespan / best[1] * 100 - 100:+.1f}% vs best fixed), "
+            f"mean limit {sum(limits) / len(limits):.1f}, {changes} limit changes"
+        )
@@ -3,7 +3,7 @@ import re
 import numpy as np
 from scipy.stats import hmean
 
-from alabamaEncode.core.util.bin_utils import get_binary
+from alabamaEncode.core.util.bin_utils import get_binary, BinaryRegistry
 from alabamaEncode.core.util.cli_executor import run_cli_parallel
 from alabamaEncode.core.util.path import PathAlabama
 from alabamaEncode.metrics.exception import XpsnrException
@@ -27,6 +27,9 @@ def calc_xpsnr(
         cleanup_comparison_pipes,
     )
 
+    if not BinaryRegistry.has_capability("ffmpeg", "xpsnr"):
+        raise XpsnrException("ffmpeg was not built with the xpsnr filter")
+
     owo = create_content_comparison_y4m_pipes(chunk=chunk, options=xspnr_options)
 
     reference_y4m_pipe = owo["ref_pipe"]
@@ -0,0 +1,130 @@
+"""
+Worker calibration, a short SvtAv1EncApp benchmark every celery worker runs on startup so the coordinator knows how
+fast each node is, see node_scheduler.py.
+
+Configured from the environment like the rest of the worker:
+CALIBRATION_PRESET (svt-av1 preset, default 4, the encoder's default speed), CALIBRATION_RESOLUTION (default
+1920x1080), CALIBRATION_FRAMES (default 48), set them to what this node usually encodes at. CALIBRATION_FPS skips
+the benchmark and publishes that number instead, e.g. for nodes measured by hand.
+
+The coordinator asks for the preset and resolution it encodes at, a worker that hasn't measured those yet benchmarks
+them in the background and answers with fps -1 until it has, the scheduler weights it like an average node meanwhile.
+"""
+
+import os
+import threading
+import time
+
+from alabamaEncode.core.util.bin_utils import get_binary
+from alabamaEncode.core.util.cli_executor import CliPipeline, run_cli
+
+__all__ = ["calibrate_worker", "get_calibration", "fetch_calibrations"]
+
+# tasks the worker runs at once, set by calibrate_worker
+_slots = 1
+# (preset, resolution) -> fps
+_measured = {}
+# the (preset, resolution) of the startup benchmark, what's published when nothing else was asked for
+_default = None
+_benchmark_lock = threading.Lock()
+_pending = set()
+
+
+def _benchmark(preset: str, resolution: str, frames: int) -> float:
+    """
+    :return: fps of a synthetic encode, -1 if it failed
+    """
+    start = time.monotonic()
+    success = run_cli(
+        CliPipeline(
+            [get_binary("ffmpeg"), "-v", "error", "-nostdin", "-f", "lavfi"]
+            + ["-i", f"testsrc2=size={resolution}:rate=24", "-frames:v", frames]
+            + ["-pix_fmt", "yuv420p10le", "-strict", "-1", "-f", "yuv4mpegpipe", "-"],
+            [get_binary("SvtAv1EncApp"), "-i", "stdin", "--preset", preset]
+            + ["--progress", "0", "-b", os.devnull],
+        )
+    ).success()
+    elapsed = time.monotonic() - start
+    if not success or elapsed <= 0:
+        return -1
+    return frames / elapsed
+
+
+def _measure(preset: str, resolution: str) -> float:
+    if "CALIBRATION_FPS" in os.environ:
+        fps = float(os.environ["CALIBRATION_FPS"])
+    else:
+        print(f"Calibrating, svt-av1 preset {preset} at {resolution}")
+        # one at a time, two benchmarks at once would both measure half the node
+        with _benchmark_lock:
+            fps = _benchmark(
+                preset, resolution, int(os.getenv("CALIBRATION_FRAMES", "48"))
+            )
+        print(f"Calibration: {fps:.2f} fps" if fps > 0 else "Calibration failed")
+    _measured[(preset, resolution)] = fps
+    _pending.discard((preset, resolution))
+    return fps
+
+
+def calibrate_worker(slots: int) -> dict:
+    """
+    Runs the benchmark once per worker process and keeps the result for get_calibration
+    :param slots: tasks the worker runs at once
+    """
+    global _slots, _default
+    _slots = slots
+    _default = (
+        os.getenv("CALIBRATION_PRESET", "4"),
+        os.getenv("CALIBRATION_RESOLUTION", "1920x1080"),
+    )
+    _measure(*_default)
+    return get_calibration()
+
+
+def get_calibration(preset: str = None, resolution: str = None) -> dict | None:
+    """
+    :param preset: what the coordinator encodes at, None for the startup benchmark's
+    :return: the calibration for that preset and resolution, fps -1 while it's still being measured,
+    None before calibrate_worker
+    """
+    if _default is None:
+        return None
+    key = (
+        str(preset) if preset is not None else _default[0],
+        resolution if resolution is not None else _default[1],
+    )
+    if "CALIBRATION_FPS" in os.environ and key not in _measured:
+        _measure(*key)
+    elif key not in _measured and key not in _pending:
+        # the control command has to answer within the broadcast's timeout, the benchmark takes longer
+        _pending.add(key)
+        threading.Thread(target=_measure, args=key, daemon=True).start()
+    return {
+        "fps": _measured.get(key, -1),
+        "slots": _slots,
+        "preset": key[0],
+        "resolution": key[1],
+    }
+
+
+def fetch_calibrations(
+    app, preset=None, resolution: str = None, timeout: float = 2
+) -> dict:
+    """
+    Asks every worker for its calibration, a broadcast to the whole cluster
+    :param preset: the svt-av1 preset to calibrate for, None for whatever the workers measured on startup
+    :param resolution: e.g. 1920x1080, same
+    :return: worker name -> calibration, only workers that support it
+    """
+    calibrations = {}
+    for reply in app.control.broadcast(
+        "calibration",
+        arguments={"preset": preset, "resolution": resolution},
+        reply=True,
+        timeout=timeout,
+    ):
+        for name, calibration in reply.items():
+            # workers without the command answer with an error
+            if isinstance(calibration, dict) and "fps" in calibration:
+                calibrations[name] = calibration
+    return calibrations
@@ -1,11 +1,26 @@
 # get broken/backend url from env
+import json
 import os
+import signal
+import threading
 import traceback
 from typing import Any
 
 from celery import Celery
+from celery.signals import worker_init, worker_process_init
+from celery.worker.control import inspect_command
 
+from alabamaEncode.parallel_execution.calibration import (
+    calibrate_worker,
+    get_calibration,
+)
 from alabamaEncode.parallel_execution.command import BaseCommandObject
+from alabamaEncode.parallel_execution.job_spec import job_from_spec
+from alabamaEncode.parallel_execution.result_upload import run_and_upload
+from alabamaEncode.parallel_execution.staging import (
+    release_chunk_source,
+    stage_chunk_source,
+)
 
 BROKER_URL = os.getenv("BROKER_URL", "redis://" + os.getenv("REDIS_HOST", "localhost"))
 BACKEND_URL = os.getenv(
@@ -21,7 +36,56 @@ app.conf.update(
     result_serializer="pickle",
     accept_content=["pickle"],
     broker_connection_retry_on_startup=True,
+    # every worker also listens on its own queue, the coordinator sends chunks to specific nodes, see node_scheduler
+    worker_direct=True,
+)
+
+
+@worker_init.connect
+def calibrate_on_startup(sender=None, **_):
+    calibrate_worker(slots=int(sender.concurrency) if sender is not None else 1)
+
+
+@worker_process_init.connect
+def lead_process_group(**_):
+    """
+    Every pool process leads its own process group, the encoders its tasks start inherit it,
+    see _terminate_encoders
+    """
+    global _leads_group
+    os.setpgid(0, 0)
+    _leads_group = True
+
+
+# set in pool processes, a solo pool's group is the worker's, or the shell's that started it
+_leads_group = False
+# the pool's own SIGTERM handler, _terminate_encoders hands over to it
+_pool_sigterm_handler = None
+
+
+def _terminate_encoders(signum, frame):
+    """
+    revoke(terminate=True) only signals the pool process, the encoders it started would keep running,
+    so the signal goes to the whole group first. The pool's handler then exits the task through its finally blocks,
+    which remove the work folder
+    """
+    signal.signal(signum, signal.SIG_IGN)
+    os.killpg(os.getpgrp(), signum)
+    if callable(_pool_sigterm_handler):
+        _pool_sigterm_handler(signum, frame)
+    else:
+        raise SystemExit(-(256 - signum))
+
+
+@inspect_command(
+    args=[("preset", str), ("resolution", str)],
+    signature="[preset [resolution]]",
 )
+def calibration(state, preset=None, resolution=None, **_):
+    """
+    This worker's calibration for the preset and resolution the coordinator encodes at, it weights the worker by this
+    """
+    return get_calibration(preset, resolution)
 
 
 @app.task(bind=True)
@@ -30,3 +94,35 @@ def run_command_on_celery(self, command: BaseCommandObject) -> Any:
         return command.run()
     except:
         traceback.print_exc()
+
+
+@app.task(bind=True)
+def run_job_spec_on_celery(self, spec: str) -> Any:
+    """
+    ChunkEncoders travel as a json job spec (see job_spec.py) instead of the pickled command,
+    with source staging the chunk's segment is fetched from the coordinator first,
+    and the encoded chunk is uploaded back to it
+    """
+    global _pool_sigterm_handler
+    own_group = _leads_group and threading.current_thread() is threading.main_thread()
+    if own_group:
+        _pool_sigterm_handler = signal.signal(signal.SIGTERM, _terminate_encoders)
+    try:
+        spec = json.loads(spec)
+        command = job_from_spec(spec)
+        staging = spec.get("staging")
+        if staging is not None:
+            stage_chunk_source(command.chunk, staging)
+        try:
+            if spec.get("upload") is not None:
+                return run_and_upload(command, spec["upload"])
+            return command.run()
+        finally:
+            if staging is not None:
+                release_chunk_source(staging)
+    except Exception:
+        # not BaseException, a terminated task exits through SystemExit
+        traceback.print_exc()
+    finally:
+        if own_group:
+            signal.signal(signal.SIGTERM, _pool_sigterm_handler)
@@ -0,0 +1,105 @@
+"""
+The http server celery workers talk to the coordinator through, source segments go out (staging.py) and encoded
+chunks come back (result_upload.py). Every route is /`name`/`chunk_index`, requests carry the session's key.
+"""
+
+import hashlib
+import secrets
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+__all__ = ["KEY_HEADER", "get_lan_ip", "sha256_file", "CoordinatorServer"]
+
+KEY_HEADER = "X-Coordinator-Key"
+
+
+def get_lan_ip() -> str:
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # doesn't even have to be reachable
+        s.connect(("10.255.255.255", 1))
+        return s.getsockname()[0]
+    finally:
+        s.close()
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024**2), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CoordinatorServer:
+    """
+    server = CoordinatorServer(ctx)
+    server.route("segments", handler)  # handler(request: BaseHTTPRequestHandler, method: str, chunk_index: int)
+    server.start()
+    ...
+    server.stop()
+    """
+
+    def __init__(self, ctx, port: int = 0):
+        """
+        :param port: 0 for any free port
+        """
+        self.ctx = ctx
+        self.port = port
+        self.key = secrets.token_urlsafe(16)
+        self.host = get_lan_ip()
+        self.routes: Dict[str, callable] = {}
+        self.http = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def route(self, name: str, handler: callable):
+        self.routes[name] = handler
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _dispatch(self, method: str):
+                if self.headers.get(KEY_HEADER) != server.key:
+                    self.send_error(403)
+                    return
+                parts = self.path.strip("/").split("/")
+                if (
+                    len(parts) != 2
+                    or parts[0] not in server.routes
+                    or not parts[1].isdigit()
+                ):
+                    self.send_error(404)
+                    return
+                server.routes[parts[0]](self, method, int(parts[1]))
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_HEAD(self):
+                self._dispatch("HEAD")
+
+            def do_PUT(self):
+                self._dispatch("PUT")
+
+            def log_message(self, format, *args):
+                server.ctx.log(format % args, category="coordinator_http")
+
+        return Handler
+
+    def start(self):
+        self.http = ThreadingHTTPServer(("0.0.0.0", self.port), self._handler())
+        self.http.daemon_threads = True
+        self.port = self.http.server_address[1]
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.http is not None:
+            self.http.shutdown()
+            self.http.server_close()
+            self.http = None
@@ -1,19 +1,50 @@
 import asyncio
 import os
+import threading
 import time
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
-from typing import List, Tuple
+from queue import SimpleQueue
+from typing import List
 
 import psutil
+from celery.exceptions import TimeoutError as CeleryTimeoutError
+from celery.result import AsyncResult, ResultSet
+from celery.utils.nodenames import worker_direct
 from tqdm import tqdm
 
 from alabamaEncode.core.chunk_encoder import ChunkEncoder
-from alabamaEncode.parallel_execution.celery_app import run_command_on_celery, app
+from alabamaEncode.core.util.cpu_topology import CoreAllocator
+from alabamaEncode.parallel_execution.calibration import fetch_calibrations
+from alabamaEncode.parallel_execution.celery_app import (
+    run_command_on_celery,
+    run_job_spec_on_celery,
+    app,
+)
 from alabamaEncode.parallel_execution.command import BaseCommandObject
+from alabamaEncode.parallel_execution.coordinator_server import CoordinatorServer
+from alabamaEncode.parallel_execution.forecast import EncodeForecast
+from alabamaEncode.parallel_execution.job_spec import build_job_spec, dump_job_spec
+from alabamaEncode.parallel_execution.node_scheduler import NodeScheduler
+from alabamaEncode.parallel_execution.process_pool import ChunkProcessPool
+from alabamaEncode.parallel_execution.progress import (
+    ProgressTracker,
+    get_encode_progress,
+)
+from alabamaEncode.parallel_execution.resources import ResourceMonitor
+from alabamaEncode.parallel_execution.result_upload import ResultReceiver
+from alabamaEncode.parallel_execution.staging import SegmentServer
+from alabamaEncode.parallel_execution.throughput_controller import (
+    ThroughputController,
+)
+from alabamaEncode.scene.chunk_cost import ChunkCostModel
 
 
 async def execute_commands(
     use_celery=False,
+    staging: str = "",
+    celery_port: int = 0,
+    speculate: bool = True,
     command_objects: List[BaseCommandObject] = None,
     multiprocess_workers: int = -1,
     pin_to_cores=False,
@@ -21,17 +52,35 @@ async def execute_commands(
     size_estimate_data: tuple = None,
     throughput_scaling=False,
     pbar: tqdm = None,
+    executor_type: str = "thread",
+    max_memory: int = -1,
+    rebalance_tail_threads: bool = False,
+    two_stage: bool = False,
+    analysis_workers: int = -1,
 ):
     """
     Execute a list of commands in parallel
     :param throughput_scaling:
     :param pbar:
-    :param pin_to_cores:
+    :param pin_to_cores: give every job its own set of cores (decoder and encoder pinned separately)
     :param use_celery: execute on a celery cluster
+    :param staging: with celery, "copy" or "lossless" serves workers a segment of each chunk's source
+    instead of them reading chunk.path, see staging.py; "" for off
+    :param celery_port: port workers reach the coordinator on, for segments and uploading the encoded chunks,
+    0 for any free one
+    :param speculate: with celery, once the queue is empty, run a copy of a chunk that is well past its predicted
+    time on a faster idle worker, the first to finish wins
     :param command_objects: objects with a `run()` method to execute
     :param multiprocess_workers: number of workers in multiprocess mode, -1 for auto adjust
     :param finished_scene_callback: call when a scene finishes, contains the number of finished scenes
     :param size_estimate_data: tuple(frames, kB) of scenes encoded so far for the estimate
+    :param executor_type: "thread" or "process", process runs ChunkEncoders in a process pool
+    :param max_memory: memory budget in bytes for all running ChunkEncoders together, -1 for 80% of ram
+    :param rebalance_tail_threads: once the queue can't fill the cores anymore, start the last ChunkEncoders
+    with more threads, see tail_threads
+    :param two_stage: run each ChunkEncoder's analyze chain and final encode as separate jobs, analysis runs
+    ahead on its own slots and hands analyzed chunks to the final encodes through a bounded queue
+    :param analysis_workers: concurrent analysis jobs in two stage mode, -1 for a quarter of the cores
     """
     if command_objects is None or len(command_objects) == 0:
         return
@@ -50,57 +99,377 @@ async def execute_commands(
     total_scenes = len(command_objects)
 
     if use_celery:
+        # seconds between worker samples, each one is a broadcast to the whole cluster
+        celery_worker_sample_interval = 30
+        # how often node dispatch assigns and speculates when no result comes in, results wake it up right away
+        celery_poll_interval = 1
+
         for a in command_objects:
             a.run_on_celery = True
 
-        running_tasks = [
-            run_command_on_celery.delay(command) for command in command_objects
-        ]
-        pbar.set_description(f"WORKERS - ESTM BITRATE -")
+        coordinator, staging_server, result_receiver = None, None, None
+        message_sizes = []
+        if are_commands_adaptive_commands:
+            ctx = command_objects[0].ctx
+            chunks = [c.chunk for c in command_objects]
+            # workers send encoded chunks back over http, with staging they also get their source from it
+            coordinator = CoordinatorServer(ctx, celery_port)
+            result_receiver = ResultReceiver(ctx, coordinator, chunks)
+            if staging != "":
+                staging_server = SegmentServer(ctx, coordinator, chunks, staging)
+            coordinator.start()
+            print(f"Workers reach the coordinator on {coordinator.url}")
+
+        # workers benchmark what this encode runs at, not only what they measured on startup
+        calibrate_for = {}
+        if are_commands_adaptive_commands:
+            # the output size if it's known already, get_output_res would run a probe encode for it
+            width, height = ctx.output_width, ctx.output_height
+            if width <= 0 or height <= 0:
+                width, height = command_objects[0].chunk.width, command_objects[0].chunk.height
+            calibrate_for["preset"] = ctx.prototype_encoder.speed
+            if width > 0 and height > 0:
+                calibrate_for["resolution"] = f"{width}x{height}"
+
+        def send(command, node: str = None) -> AsyncResult:
+            """
+            :param node: worker to run it on, None for whichever takes it off the shared queue
+            """
+            queue = worker_direct(node) if node is not None else None
+            if not are_commands_adaptive_commands:
+                return run_command_on_celery.apply_async((command,), queue=queue)
+            spec = dump_job_spec(
+                build_job_spec(
+                    command,
+                    staging=(
+                        staging_server.job_staging(command.chunk)
+                        if staging_server is not None
+                        else None
+                    ),
+                    upload=result_receiver.job_upload(command.chunk),
+                )
+            )
+            message_sizes.append(len(spec))
+            ctx.log(
+                f"chunk {command.chunk.chunk_index}: {len(spec)} byte task message",
+                category="celery_messages",
+            )
+            return run_job_spec_on_celery.apply_async((spec,), queue=queue)
+
+        num_workers = "-"
+        completed_count = 0
+
+        def task_finished(finished_command, result):
+            nonlocal completed_count, encoded_frames_so_far, encoded_size_so_far
+            completed_count += 1
+            if staging_server is not None:
+                staging_server.release(finished_command.chunk.chunk_index)
+            stats = None
+            if are_commands_adaptive_commands:
+                # a task that raised hands back the exception instead of (code, stats)
+                if isinstance(result, tuple):
+                    _, stats = result[:2]
+                    if len(result) > 2 and stats is not None:
+                        # the worker's temp folder is gone, what it would have kept there is recorded here
+                        result_receiver.record(finished_command.chunk, stats, result[2])
+                else:
+                    tqdm.write(f"{finished_command.chunk.log_prefix()}failed on celery: {result!r}")
+            if stats is not None:
+                pbar.update(finished_command.chunk.get_frame_count())
+                encoded_frames_so_far += stats["length_frames"]
+                encoded_size_so_far += stats["size"]
+                fps = command_objects[0].chunk.framerate
+                pbar.set_description(
+                    f"WORKERS {num_workers} ESTM BITRATE "
+                    f"{((encoded_size_so_far * 8) / (encoded_frames_so_far / fps)):.2f} kb/s"
+                )
+            else:
+                pbar.update()
 
-        while True:
+            if finished_scene_callback is not None:
+                finished_scene_callback(completed_count)
+
+        loop = asyncio.get_event_loop()
+
+        async def run_on_shared_queue():
+            """
+            Everything into celery's queue at once, workers take what they can
+            """
+            # task id -> command, a finished task finds its chunk without searching
+            tasks = {send(command).id: command for command in command_objects}
+            result_set = ResultSet(
+                [AsyncResult(task_id, app=app) for task_id in tasks]
+            )
+            results = asyncio.Queue()
+
+            def on_result(task_id, value):
+                # called from the collector thread as the backend pushes each result
+                loop.call_soon_threadsafe(results.put_nowait, (task_id, value))
+
+            # redis/amqp backends push results (pubsub), others fall back to waiting on the tasks one by one,
+            # either way no per-second poll over every outstanding task
+            join = (
+                result_set.join_native
+                if result_set.supports_native_join
+                else result_set.join
+            )
+            # tasks revoked while still queued never publish a state, so on the way out the join is stopped
+            # from its on_interval instead of waited out
+            stop_collecting = threading.Event()
+
+            class StopCollecting(Exception):
+                pass
+
+            def on_interval():
+                if stop_collecting.is_set():
+                    raise StopCollecting()
+
+            def collect():
+                try:
+                    join(
+                        callback=on_result,
+                        propagate=False,
+                        timeout=None,
+                        on_interval=on_interval,
+                    )
+                except StopCollecting:
+                    pass
+
+            collector = loop.run_in_executor(None, collect)
+
+            async def sample_workers():
+                """
+                Worker count for the progress bar, inspect() broadcasts to every worker so only every so often
+                """
+                nonlocal num_workers
+                while True:
+                    queues = await loop.run_in_executor(
+                        None, lambda: app.control.inspect().active_queues()
+                    )
+                    if queues is None or len(queues) == 0:
+                        tqdm.write(
+                            "No workers available, waiting for workers to become available"
+                        )
+                    num_workers = len(queues) if queues is not None else 0
+                    await asyncio.sleep(celery_worker_sample_interval)
+
+            worker_sampler = asyncio.create_task(sample_workers())
+            next_result = asyncio.ensure_future(results.get())
             try:
-                num_workers = len(app.control.inspect().active_queues())
-                if num_workers is None or num_workers < 0:
-                    print(
-                        "No workers available, waiting for workers to become available"
+                while completed_count < len(tasks):
+                    await asyncio.wait(
+                        [next_result, collector], return_when=asyncio.FIRST_COMPLETED
                     )
-                if all(task.ready() for task in running_tasks):
-                    break
-                for task in running_tasks:
-                    if task.ready():
-                        result = task.get()
-                        if are_commands_adaptive_commands and result is not None:
-                            finished_command = command_objects[
-                                running_tasks.index(task)
-                            ]
-                            pbar.update(finished_command.chunk.get_frame_count())
-                            pinned_code, stats = result
-                            encoded_frames_so_far += stats["length_frames"]
-                            encoded_size_so_far += stats["size"]
-                            bitrate_estimate = "ESTM BITRATE -"
-                            if encoded_frames_so_far > 0:
-                                fps = command_objects[0].chunk.framerate
-                                bitrate_estimate = (
-                                    f"ESTM BITRATE {((encoded_size_so_far * 8) / (encoded_frames_so_far / fps)):.2f} "
-                                    f"kb/s"
-                                )
-
-                            pbar.set_description(
-                                f"WORKERS {num_workers} {bitrate_estimate}"
+                    if not next_result.done():
+                        # the collector has stopped, raise why, results it delivered before that are still queued
+                        collector.result()
+                        if results.empty():
+                            raise RuntimeError(
+                                f"Celery stopped delivering results after {completed_count}/{len(tasks)} tasks"
                             )
+                        await next_result
+                    task_id, result = next_result.result()
+                    next_result = asyncio.ensure_future(results.get())
+                    task_finished(tasks[task_id], result)
+            except (KeyboardInterrupt, asyncio.CancelledError) as e:
+                print("Keyboard interrupt, cancelling tasks")
+                result_set.revoke()
+                raise e
+            finally:
+                stop_collecting.set()
+                worker_sampler.cancel()
+                next_result.cancel()
+
+        async def run_on_nodes(calibrations: dict):
+            """
+            The queue stays here, each worker gets chunks on its own queue as it has free slots,
+            weighted by its speed, stragglers get copies on faster nodes, see NodeScheduler
+            """
+            nonlocal num_workers
+            costs = {i: 1.0 for i in range(len(command_objects))}
+            if are_commands_adaptive_commands:
+                model = ChunkCostModel(ctx)
+                costs = {
+                    i: model.units(c.chunk) for i, c in enumerate(command_objects)
+                }
+            # a second copy of a ChunkEncoder is harmless, the first upload wins, arbitrary commands maybe not
+            scheduler = NodeScheduler(
+                costs, speculate=speculate and are_commands_adaptive_commands
+            )
+            scheduler.update_nodes(calibrations)
+            print(
+                "Dispatching to workers: "
+                + ", ".join(
+                    f"{name} " + (f"{c['fps']:.1f}fps" if c["fps"] > 0 else "unmeasured") + f" x{c['slots']}"
+                    for name, c in calibrations.items()
+                )
+            )
+
+            # task id -> (job key, node, result)
+            in_flight = {}
+            # sent tasks for the collector to start waiting on, None stops it
+            to_watch = SimpleQueue()
+            results = asyncio.Queue()
+
+            class WatchMore(Exception):
+                pass
+
+            def collect():
+                """
+                Waits on every task sent so far at once, like run_on_shared_queue's join,
+                started over only when more tasks are sent
+                """
+                watching = {}
+
+                def on_result(task_id, value):
+                    watching.pop(task_id, None)
+                    loop.call_soon_threadsafe(results.put_nowait, (task_id, value))
+
+                def on_interval():
+                    if not to_watch.empty():
+                        raise WatchMore()
+
+                while True:
+                    # nothing to wait on, block until something is sent
+                    pending = [to_watch.get()] if len(watching) == 0 else []
+                    while not to_watch.empty():
+                        pending.append(to_watch.get())
+                    for result in pending:
+                        if result is None:
+                            return
+                        watching[result.id] = result
+                    result_set = ResultSet(list(watching.values()))
+                    try:
+                        if result_set.supports_native_join:
+                            # redis/amqp push results, key/value backends get all the tasks in one request
+                            result_set.join_native(
+                                callback=on_result, propagate=False, timeout=None, on_interval=on_interval
+                            )
+                        elif hasattr(result_set.backend, "get_many"):
+                            # e.g. the filesystem backend, no native join but it polls all the tasks in one go too
+                            for task_id, meta in result_set.backend.get_many(set(watching), on_interval=on_interval):
+                                on_result(task_id, meta["result"])
                         else:
-                            pbar.update()
-                        running_tasks.remove(task)
-                await asyncio.sleep(1)
-            except KeyboardInterrupt as e:
+                            # join waits on one task at a time and runs on_interval once per task, come back up
+                            # every interval instead
+                            result_set.join(callback=on_result, propagate=False, timeout=celery_poll_interval)
+                    except (WatchMore, CeleryTimeoutError):
+                        pass
+
+            def dispatch(key, node):
+                result = send(command_objects[key], node)
+                in_flight[result.id] = (key, node, result)
+                to_watch.put(result)
+
+            collector = loop.run_in_executor(None, collect)
+            next_result = asyncio.ensure_future(results.get())
+            last_sample = time.monotonic()
+            try:
+                while len(scheduler.done) < len(costs):
+                    now = time.monotonic()
+                    if now - last_sample >= celery_worker_sample_interval:
+                        last_sample = now
+                        calibrations = await loop.run_in_executor(
+                            None, lambda: fetch_calibrations(app, **calibrate_for)
+                        )
+                        if len(calibrations) == 0:
+                            tqdm.write(
+                                "No workers available, waiting for workers to become available"
+                            )
+                        requeued = scheduler.update_nodes(calibrations)
+                        if len(requeued) > 0:
+                            tqdm.write(
+                                f"Requeued {len(requeued)} jobs of workers that went away"
+                            )
+                    num_workers = len(scheduler.nodes)
+
+                    for key, node in scheduler.assign(now):
+                        dispatch(key, node)
+                    for key, node in scheduler.speculate(now):
+                        tqdm.write(
+                            f"{command_objects[key].chunk.log_prefix()}running past its predicted time, "
+                            f"starting a copy on {node}"
+                        )
+                        dispatch(key, node)
+
+                    # wakes up for a result, or after the poll interval for the next assign/speculate round
+                    await asyncio.wait(
+                        [next_result, collector],
+                        timeout=celery_poll_interval,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    if collector.done():
+                        # it only returns when told to, raise why it stopped
+                        collector.result()
+                        raise RuntimeError(f"Celery stopped delivering results after {completed_count} tasks")
+                    if not next_result.done():
+                        continue
+                    finished = [next_result.result()]
+                    while not results.empty():
+                        finished.append(results.get_nowait())
+                    next_result = asyncio.ensure_future(results.get())
+
+                    now = time.monotonic()
+                    for task_id, value in finished:
+                        if task_id not in in_flight:
+                            # a copy revoked when another one won
+                            continue
+                        key, node, result = in_flight.pop(task_id)
+                        # a task that raised or was revoked hands back the exception
+                        ok = not isinstance(value, BaseException) and (
+                            not are_commands_adaptive_commands
+                            or (value is not None and value[1] is not None)
+                        )
+                        was_done = key in scheduler.done
+                        losers = scheduler.finished(key, node, now, ok)
+                        for other_id, (other_key, other_node, other) in list(
+                            in_flight.items()
+                        ):
+                            if other_key == key and other_node in losers:
+                                other.revoke(terminate=True)
+                                del in_flight[other_id]
+                        if not was_done and key in scheduler.done:
+                            task_finished(command_objects[key], value)
+            except (KeyboardInterrupt, asyncio.CancelledError) as e:
                 print("Keyboard interrupt, cancelling tasks")
-                for task in running_tasks:
-                    task.revoke()
+                for _, _, result in in_flight.values():
+                    result.revoke(terminate=True)
                 raise e
+            finally:
+                to_watch.put(None)
+                next_result.cancel()
+
+            if len(scheduler.speculative) > 0:
+                print(
+                    f"Started {len(scheduler.speculative)} copies of stragglers, "
+                    f"{scheduler.speculation_wins} finished first"
+                )
+
+        pbar.set_description(f"WORKERS - ESTM BITRATE -")
+        # workers that answer the calibration command get chunks from the coordinator one at a time, the ones still
+        # benchmarking count as average nodes until they're done, only without any the tasks go on a shared queue
+        calibrations = await loop.run_in_executor(
+            None, lambda: fetch_calibrations(app, **calibrate_for)
+        )
+        try:
+            if len(calibrations) > 0:
+                await run_on_nodes(calibrations)
+            else:
+                await run_on_shared_queue()
+        finally:
+            if staging_server is not None:
+                staging_server.stop()
+            if coordinator is not None:
+                coordinator.stop()
+                result_receiver.stop()
+            if len(message_sizes) > 0:
+                print(
+                    f"Sent {len(message_sizes)} celery tasks, message size avg "
+                    f"{sum(message_sizes) / len(message_sizes) / 1000:.1f}kB, max {max(message_sizes) / 1000:.1f}kB"
+                )
         pbar.close()
     else:
-        futures, completed_count = [], 0
+        completed_count = 0
 
         core_count, auto_scale = os.cpu_count(), multiprocess_workers == -1
         target_cpu_utilization, max_mem_usage = 95, 80
@@ -115,169 +484,398 @@ async def execute_commands(
 
         local_jobs_limit = multiprocess_workers if not auto_scale else 2
 
+        # analysis is decode and vmaf bound, finals are encoder bound, so each stage gets its own limit
+        two_stage = two_stage and are_commands_adaptive_commands
+        analysis_jobs_limit = (
+            analysis_workers if analysis_workers > 0 else max(1, core_count // 4)
+        )
+        # analyzed chunks waiting for a final encode slot, plus the ones being analyzed, can't exceed this,
+        # so analysis stays a few chunks ahead instead of racing through the whole queue
+        analysis_queue_size = analysis_jobs_limit * 2
+
         if throughput_scaling:
-            local_jobs_limit = core_count / 2
+            local_jobs_limit = max(1, core_count // 2)
 
         loop, executor = asyncio.get_event_loop(), ThreadPoolExecutor()
 
-        # array of zeros to keep track of which cores are used, used for thread pinning with taskset
-        used_cores = [0] * core_count
-
-        frame_encoded_history: List[Tuple[int, float]] = []
-        last_frame_encode = time.time()
-        thughput_history = []
-
-        current_thughput = -1
-        previuus_thughput = -1
-        thouput_compare = -1
-
-        # -1 for decreasing, 0 for stable, 1 for increasing
-        thouput_change_trend = 0
-        thouput_reverse_trend_trigger_counter = 0
-
-        def frames_encoded(frame_count=1):
-            nonlocal last_frame_encode
-            nonlocal frame_encoded_history
-            nonlocal current_thughput
-            nonlocal previuus_thughput
-            nonlocal thughput_history
-            now = time.time()
-            if last_frame_encode == -1:
-                last_frame_encode = now
-            time_since_update = now - last_frame_encode
-            last_frame_encode = now
-            frame_encoded_history.append((frame_count, time_since_update))
-
-            # measure the throughput based on the last 5 updates, save to history and print
-            if len(frame_encoded_history) > 5:
-                frame_encoded_history.pop(0)
-            total_frames = sum([f[0] for f in frame_encoded_history])
-            total_time = sum([f[1] for f in frame_encoded_history])
-            thughput = total_frames / total_time
-            thughput_history.append(thughput)
-            # calculate the average throughput from the last 3 updates
-            if len(thughput_history) > 3:
-                thughput_history.pop(0)
-            previuus_thughput = current_thughput
-            current_thughput = sum(thughput_history) / len(thughput_history)
-            # tqdm.write(
-            #     f"Current throughput: {current_thughput:.2f} f/s, Last: {previuus_thughput:.2f} f/s, currently running jobs: {len(futures)}"
-            # )
-
-        def callback_wrapper():
-            pbar.update()
-            frames_encoded()
-
-        # in the case that the encoder class supports "encoded a frame callback",
-        # we can update the progress bar immediately after a frame is encoded,
-        # so we set the callback
-        if are_commands_adaptive_commands:
-            for c in command_objects:
-                c.encoded_a_frame_callback = (
-                    lambda frame, bitrate, fps: callback_wrapper()
-                )
+        # how often the progress bar gets cpu/mem stats, and how often auto scaling may move the jobs limit
+        stats_interval, scale_interval = 1, 7
+        # how often the per-job frame counters are summed up into the progress bar
+        progress_interval = 0.25
 
-        pbar.set_description(f"WORKERS: - CPU -% SWAP -%")
+        # hands out topology aware core sets sized to each job's threads, for pinning with taskset
+        core_allocator = CoreAllocator() if pin_to_cores else None
 
-        while completed_count < total_scenes:
-            currently_running_jobs = len(futures)
+        # hill climbs the jobs limit on frames/s across all jobs, see ThroughputController
+        throughput_controller = (
+            ThroughputController(
+                start_limit=local_jobs_limit, max_limit=core_count * 2
+            )
+            if throughput_scaling
+            else None
+        )
 
-            # Start new jobs if we are under the local_jobs_limit
-            while (
-                currently_running_jobs <= local_jobs_limit
-                and completed_count + currently_running_jobs < total_scenes
-            ):
-                command = command_objects[completed_count + currently_running_jobs]
-                if pin_to_cores and 0 in used_cores:
-                    core = used_cores.index(0)
-                    used_cores[core] = 1
-                    command.pin_to_core = core
-                future = loop.run_in_executor(executor, command.run)
-                futures.append(future)
-                currently_running_jobs = len(futures)
-
-            # wait for any of the tasks to finish
-            done, pending = await asyncio.wait(futures, timeout=7)
-            futures = [f for f in futures if not f.done()]
-            currently_running_jobs = len(futures)
-
-            # do stuff with the finished tasks
-            for future in done:
-                rslt = await future
-                units_encoded = 1
-                if are_commands_adaptive_commands and rslt is not None:
-                    pined_core: int = rslt[0]
-                    stats = rslt[1]
-                    command_object = command_objects[completed_count]
-                    if not command_object.supports_encoded_a_frame_callback():
-                        units_encoded = command_object.chunk.get_frame_count()
-                        frames_encoded(units_encoded)
-                    if stats is not None:
-                        encoded_frames_so_far += stats["length_frames"]
-                        encoded_size_so_far += stats["size"]
+        # jobs count frames into their own counter, progress_timer samples them all, no per-frame pbar calls
+        progress_tracker = ProgressTracker(pbar)
+        # ETA and final size from the cost of what is left, see EncodeForecast
+        forecast = (
+            EncodeForecast(
+                command_objects[0].ctx,
+                command_objects,
+                workers=local_jobs_limit,
+                done_frames=encoded_frames_so_far,
+                done_size_kb=encoded_size_so_far,
+            )
+            if are_commands_adaptive_commands
+            else None
+        )
 
-                    if pin_to_cores:
-                        used_cores[pined_core] = 0
+        # until the first stats tick, with the forecast of the last session if there was one
+        pbar.set_description(
+            f"WORKERS: - CPU -% SWAP -%{f' {forecast}' if forecast is not None else ''}"
+        )
 
-                pbar.update(units_encoded)
+        # future -> the command it runs, so a finished future maps back to its own chunk
+        running = {}
+        next_command_index = 0
+        # in two stage mode: analysis futures -> command, and the analyzed chunks waiting for a final encode
+        analysing = {}
+        analysed = deque()
+        # jobs that got to their final encode (or failed before it), what the tail logic counts down
+        finals_started = 0
+        # seconds both stages had work running at the same time
+        overlap_seconds = 0
+        # set by the stats timer when the jobs limit grows or memory frees up, so the slots get filled right away
+        limit_changed = asyncio.Event()
+
+        # per job rss/cpu accounting, a job only starts if its expected memory footprint fits the budget
+        resource_monitor = (
+            ResourceMonitor(max_memory) if are_commands_adaptive_commands else None
+        )
+        admission_blocked = False
+        # threads the last tail job started with, for logging changes only
+        last_tail_threads = None
+
+        # cores that had nothing to do while we were encoding, summed over all cores
+        idle_cpu_time_start = get_idle_cpu_seconds()
+        encode_start = time.time()
+
+        def admit(command) -> bool:
+            nonlocal admission_blocked
+            if resource_monitor is not None and not resource_monitor.can_admit(
+                command, [*running.values(), *analysing.values()]
+            ):
+                admission_blocked = True
+                return False
+            return True
+
+        def free_cores(starting: int) -> int:
+            """
+            Cores the running jobs don't hold, what a tail job can grow into
+            """
+            if core_allocator is not None:
+                # what the allocator can hand out, less a decoder core for each job about to start
+                return len(core_allocator.free) - starting
+            base = command_objects[0].ctx.prototype_encoder.threads
+            return core_count - sum(
+                c.threads if c.threads is not None else base
+                for c in [*running.values(), *analysing.values()]
+            )
 
-                completed_count += 1
+        def submit(command, analysis=False):
+            nonlocal finals_started
+            nonlocal last_tail_threads
+            threads = (
+                command.ctx.prototype_encoder.threads
+                if are_commands_adaptive_commands
+                else 1
+            )
+            if not analysis:
+                finals_started += 1
+                if are_commands_adaptive_commands and rebalance_tail_threads:
+                    # the command we are starting counts as not started, and only as many start as the limit lets
+                    left = total_scenes - finals_started + 1
+                    starting = min(left, max(1, local_jobs_limit + 1 - len(running)))
+                    threads = tail_threads(threads, free_cores(starting), starting)
+                    command.threads = threads
+                    if threads != last_tail_threads and last_tail_threads is not None:
+                        tqdm.write(f"{left} chunks left to start, starting them with {threads} threads")
+                    last_tail_threads = threads
+            if core_allocator is not None:
+                # None when the cores are all taken, the job then runs unpinned
+                command.core_set = core_allocator.allocate(threads)
+            if not analysis:
+                # a job in the process pool counts its frames in shared memory the sampler reads
+                progress = progress_tracker.start(
+                    command, process_pool.job_progress(command) if process_pool is not None else None
+                )
+                if are_commands_adaptive_commands:
+                    command.encoded_a_frame_callback = progress.frame_encoded
+            if analysis:
+                future = (
+                    process_pool.submit_analysis(command)
+                    if process_pool is not None
+                    else loop.run_in_executor(executor, command.run_analysis)
+                )
+                analysing[future] = command
+            else:
+                future = (
+                    process_pool.submit(command)
+                    if process_pool is not None
+                    else loop.run_in_executor(executor, command.run)
+                )
+                running[future] = command
+
+        def start_jobs():
+            nonlocal next_command_index
+            nonlocal admission_blocked
+            admission_blocked = False
+            # finals first, they are what the analysis is waiting to hand off to
+            while len(running) <= local_jobs_limit:
+                if two_stage:
+                    if len(analysed) == 0:
+                        break
+                    command = analysed[0]
+                    command.stage = "final"
+                elif next_command_index < total_scenes:
+                    command = command_objects[next_command_index]
+                else:
+                    break
+                if not admit(command):
+                    break
+                if two_stage:
+                    analysed.popleft()
+                else:
+                    next_command_index += 1
+                submit(command)
 
-            # update the progress bar with the current system stats
-            bitrate_estimate = " ESTM BITRATE N/A"
-            if encoded_frames_so_far > 0:
-                fps = command_objects[0].chunk.framerate
-                bitrate_estimate = (
-                    f" ESTM BITRATE {((encoded_size_so_far * 8) / (encoded_frames_so_far / fps)):.2f} "
-                    f"kb/s"
+            while (
+                two_stage
+                and len(analysing) < analysis_jobs_limit
+                and len(analysing) + len(analysed) < analysis_queue_size
+                and next_command_index < total_scenes
+            ):
+                command = command_objects[next_command_index]
+                command.stage = "analysis"
+                if not admit(command):
+                    break
+                next_command_index += 1
+                submit(command, analysis=True)
+
+        def update_stats(cpu_percent, memory_percent):
+            estimate = ""
+            if forecast is not None:
+                forecast.update(progress_tracker)
+                estimate = f" {forecast}"
+                if forecast.size_kb > 0 and forecast.total_frames > 0:
+                    fps = command_objects[0].chunk.framerate
+                    estimate += (
+                        f" ESTM BITRATE {((forecast.size_kb * 8) / (forecast.total_frames / fps)):.2f} kb/s"
+                    )
+            jobs_memory = ""
+            if resource_monitor is not None:
+                jobs_memory = (
+                    f" ({resource_monitor.used_memory() / 1024**3:.1f}"
+                    f"/{resource_monitor.max_memory / 1024**3:.1f}G)"
                 )
-            cpu_percent = psutil.cpu_percent()
-            memory_percent = psutil.virtual_memory().percent
+            analysis = ""
+            if two_stage:
+                analysis = f" ANALYSIS {len(analysing)} QUEUED {len(analysed)}"
+            job_fps = ""
+            progress = get_encode_progress()
+            if are_commands_adaptive_commands and progress is not None:
+                if len(progress.job_fps) > 0:
+                    job_fps = (
+                        f" FPS {progress.fps:.1f} "
+                        f"({min(progress.job_fps):.1f}-{max(progress.job_fps):.1f}/job)"
+                    )
             pbar.set_description(
-                f"WORKERS {currently_running_jobs} CPU {int(cpu_percent)}% "
-                f"MEM {int(memory_percent)}%{bitrate_estimate}"
+                f"WORKERS {len(running)}{analysis}{job_fps} CPU {int(cpu_percent)}% "
+                f"MEM {int(memory_percent)}%{jobs_memory}{estimate}"
             )
-            # change the local_jobs_limit based on the picked strategy
-            if throughput_scaling:
-                if thouput_compare != current_thughput:
-                    tqdm.write(
-                        f"Checking throughput, current: {current_thughput:.2f} f/s, previous: {previuus_thughput:.2f} f/s"
-                    )
-                    # if we observe that throughput is decreasing, reverse the trend
-                    if previuus_thughput > current_thughput:
-                        thouput_reverse_trend_trigger_counter += 1
-                        if thouput_reverse_trend_trigger_counter <= 2:
-                            thouput_reverse_trend_trigger_counter = 0
-                            if thouput_change_trend == -1:
-                                thouput_change_trend = 1
-                            elif thouput_change_trend == 1:
-                                thouput_change_trend = -1
+
+        async def stats_timer():
+            """
+            Samples the system and redraws the progress bar on its own clock,
+            and moves local_jobs_limit based on the picked strategy
+            """
+            nonlocal local_jobs_limit
+            nonlocal overlap_seconds
+            last_scale = time.time()
+            while True:
+                await asyncio.sleep(stats_interval)
+                cpu_percent = psutil.cpu_percent()
+                memory_percent = psutil.virtual_memory().percent
+                if resource_monitor is not None:
+                    resource_monitor.sample([*running.values(), *analysing.values()])
+                if len(running) > 0 and len(analysing) > 0:
+                    overlap_seconds += stats_interval
+                update_stats(cpu_percent, memory_percent)
+                if forecast is not None:
+                    forecast.save()
+
+                if admission_blocked:
+                    # running jobs may have freed memory since, try again
+                    limit_changed.set()
+
+                previous_limit = local_jobs_limit
+
+                if throughput_controller is not None:
+                    # the controller keeps its own measuring window, and once every job has started there is
+                    # nothing left to tune, the tail would only skew its measurements
+                    if finals_started < total_scenes:
+                        local_jobs_limit = throughput_controller.update()
+                        if local_jobs_limit != previous_limit:
                             tqdm.write(
-                                f"Reversing jobs limit trend to {'increasing' if thouput_change_trend == 1 else 'decreasing'}"
+                                f"Throughput {throughput_controller.last_throughput:.2f} f/s, "
+                                f"jobs limit {previous_limit} -> {local_jobs_limit}"
                             )
-                            if thouput_change_trend == 1:
-                                tqdm.write(
-                                    f"Increasing local_jobs_limit to {local_jobs_limit + 1}"
-                                )
-                                local_jobs_limit += 1
-                            # if the throughput is decreasing, decrease the local_jobs_limit
-                            elif thouput_change_trend == -1:
-                                tqdm.write(
-                                    f"Decreasing local_jobs_limit to {local_jobs_limit - 1}"
-                                )
-                                local_jobs_limit -= 1
-
-                            thouput_compare = current_thughput
-            elif auto_scale and currently_running_jobs > 0:             
-                local_jobs_limit += (
-                    1
-                    if cpu_percent <= target_cpu_utilization
-                    and memory_percent <= max_mem_usage
-                    else -1
+                elif (
+                    auto_scale
+                    and len(running) > 0
+                    and time.time() - last_scale >= scale_interval
+                ):
+                    last_scale = time.time()
+                    if resource_monitor is not None:
+                        # back off while memory is tight, only grow if another job would be admitted
+                        memory_ok = (
+                            not resource_monitor.under_pressure()
+                            and not admission_blocked
+                        )
+                    else:
+                        memory_ok = memory_percent <= max_mem_usage
+                    local_jobs_limit += (
+                        1
+                        if cpu_percent <= target_cpu_utilization and memory_ok
+                        else -1
+                    )
+                    local_jobs_limit = max(1, min(local_jobs_limit, max_jobs_limit))
+
+                if local_jobs_limit > previous_limit:
+                    limit_changed.set()
+
+        async def progress_timer():
+            """
+            Sums up the job counters into the progress bar and the throughput controller, and publishes
+            the aggregate for get_encode_progress (the status api)
+            """
+            while True:
+                await asyncio.sleep(progress_interval)
+                progress_tracker.sample()
+                if throughput_controller is not None:
+                    throughput_controller.frames_encoded(progress_tracker.new_units, progress_tracker.new_job_units)
+
+        process_pool = None
+        if executor_type == "process" and are_commands_adaptive_commands:
+            # +1 since the limit check lets one job over
+            process_pool = ChunkProcessPool(
+                command_objects,
+                max_workers=int(max_jobs_limit)
+                + 1
+                + (analysis_jobs_limit if two_stage else 0),
+            )
+
+        stats_task = asyncio.create_task(stats_timer())
+        progress_task = asyncio.create_task(progress_timer())
+        try:
+            while completed_count < total_scenes:
+                # Start new jobs if we are under the local_jobs_limit
+                start_jobs()
+
+                # sleep until a job finishes or the limit grows, no polling
+                limit_changed.clear()
+                limit_waiter = asyncio.create_task(limit_changed.wait())
+                done, _ = await asyncio.wait(
+                    [*running, *analysing, limit_waiter],
+                    return_when=asyncio.FIRST_COMPLETED,
                 )
-                local_jobs_limit = max(1, min(local_jobs_limit, max_jobs_limit))
+                limit_waiter.cancel()
+
+                # do stuff with the finished tasks
+                for future in done:
+                    if future is limit_waiter:
+                        continue
+                    stage_jobs = analysing if future in analysing else running
+                    command_object = stage_jobs.pop(future)
+                    if resource_monitor is not None:
+                        resource_monitor.job_finished(command_object)
+                    if core_allocator is not None and command_object.core_set is not None:
+                        core_allocator.release(command_object.core_set)
+                        command_object.core_set = None
+                    rslt = await future
+
+                    if stage_jobs is analysing:
+                        if rslt:
+                            analysed.append(command_object)
+                            continue
+                        # the analysis failed (and logged why), the integrity check redoes the chunk
+                        finals_started += 1
+                        rslt = None
+
+                    units_encoded = 0 if are_commands_adaptive_commands else 1
+                    if are_commands_adaptive_commands and rslt is not None:
+                        units_encoded = command_object.chunk.get_frame_count()
+                    if forecast is not None:
+                        forecast.chunk_finished(
+                            command_object, rslt[1] if rslt is not None else None
+                        )
+
+                    progress_tracker.finish(command_object, units_encoded)
+
+                    completed_count += 1
+
+                    if finished_scene_callback is not None:
+                        finished_scene_callback(completed_count)
+        finally:
+            stats_task.cancel()
+            progress_task.cancel()
+            # whatever finished since the last sample
+            progress_tracker.sample()
+            if forecast is not None:
+                forecast.update(progress_tracker)
+                forecast.save()
+            if process_pool is not None:
+                process_pool.shutdown()
+            if resource_monitor is not None:
+                resource_monitor.model.save()
+            # the status api falls back to its own value, not this encode's last sample
+            progress_tracker.close()
+
+        encode_time = time.time() - encode_start
+        idle_core_seconds = get_idle_cpu_seconds() - idle_cpu_time_start
+        pbar.close()
+        tqdm.write(
+            f"Encoded {total_scenes} scenes in {encode_time:.1f}s, idle core-seconds: {idle_core_seconds:.0f} "
+            f"({idle_core_seconds / max(encode_time * core_count, 1) * 100:.1f}% of {core_count} cores)"
+        )
+        if forecast is not None and completed_count == total_scenes:
+            forecast.report()
+        if two_stage:
+            tqdm.write(
+                f"Analysis ran alongside final encodes for {overlap_seconds}s "
+                f"({overlap_seconds / max(encode_time, 1) * 100:.0f}% of the encode)"
+            )
 
-            if finished_scene_callback is not None:
-                finished_scene_callback(completed_count)
 
-        pbar.close()
+def get_idle_cpu_seconds() -> float:
+    """
+    :return: seconds all cpus spent idle (or waiting on io) since boot, summed over cores
+    """
+    cpu_times = psutil.cpu_times()
+    return cpu_times.idle + getattr(cpu_times, "iowait", 0)
+
+
+def tail_threads(base_threads: int, free_cores: int, starting: int) -> int:
+    """
+    Encoder threads for a job that starts while `starting` jobs (itself included) can still start, with
+    `free_cores` not held by the jobs that are running.
+    As long as those jobs can fill the free cores at `base_threads` that's what it gets. Past that each gets an
+    even share of the free cores, so the threads grow as the jobs still running finish and concurrency drops,
+    and the last one gets every core instead of one lonely `--lp 1` encode at the end.
+    Never more than is free, that would only oversubscribe the jobs still running.
+    An encoder can't change its threads once running, so this only works on jobs that haven't started.
+    """
+    starting = max(1, starting)
+    if starting * base_threads >= free_cores:
+        return base_threads
+    return free_cores // starting
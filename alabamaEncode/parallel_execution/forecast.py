@@ -0,0 +1,180 @@
+import time
+from typing import List
+
+from alabamaEncode.core.chunk_encoder import ChunkEncoder
+from alabamaEncode.parallel_execution.progress import ProgressTracker
+from alabamaEncode.scene.chunk_cost import ChunkCostModel
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 0:
+        return "-"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class EncodeForecast:
+    """
+    ETA and final size of the local encode, aware of what is still queued.
+
+    Time: every chunk left has a cost from ChunkCostModel, analysis chain included, so probe heavy or complex chunks
+    still in the queue count for what they are, not as average frames. The rate is cost units done per wall second
+    this session. Running chunks count as partly done, the analysis share once it is done, plus the share of frames
+    the final encode reported. Until there is a measurement, a chunks.log calibration from an earlier session gives
+    the rate, or there is no ETA.
+    Size: kB per (frame x relative complexity) of the chunks finished so far, times that for the chunks left.
+
+    Kept in the kv across resumes, together with the first forecast made past `reference_progress`, which gets
+    compared against what really happened once the encode is done.
+    """
+
+    kv_key = "encode_forecast"
+    reference_progress = 0.1
+    # no measured rate before this many seconds in, the first chunks finishing early says little
+    min_measure_seconds = 30
+
+    def __init__(
+        self,
+        ctx,
+        command_objects: List[ChunkEncoder],
+        workers: int,
+        done_frames: int = 0,
+        done_size_kb: float = 0,
+    ):
+        """
+        :param workers: expected parallel jobs, for the calibrated rate before anything finishes
+        :param done_frames: frames of chunks encoded in earlier sessions
+        :param done_size_kb: their size
+        """
+        self.kv = ctx.get_kv()
+        self.model = ChunkCostModel(ctx)
+        self.workers = max(1, workers)
+        # the final encode's part of a chunk's cost, the rest is analysis
+        self.final_share = 1 / self.model.chain_factor
+
+        self.pending = {c.chunk.chunk_index: c for c in command_objects}
+        self.units = {i: self.model.units(c.chunk) for i, c in self.pending.items()}
+        self.session_units = sum(self.units.values())
+        self.remaining_units = self.session_units
+
+        self.done_frames = done_frames
+        self.done_size_kb = done_size_kb
+        # what the session's finished chunks are worth in size units, and their size
+        self.size_units_done, self.size_kb_session = 0.0, 0.0
+
+        state = self.kv.get_global(self.kv_key) or {}
+        self.previous_seconds = state.get("seconds", 0)
+        self.reference = state.get("reference")
+        self.eta = state.get("eta", -1)
+        self.size_kb = state.get("size_kb", -1)
+
+        self.total_frames = done_frames + sum(
+            c.chunk.get_frame_count() for c in command_objects
+        )
+        self.start = time.monotonic()
+
+    def _size_units(self, chunk) -> float:
+        complexity = 1.0
+        if chunk.complexity > 0 and self.model.mean_complexity > 0:
+            complexity = chunk.complexity / self.model.mean_complexity
+        return chunk.get_frame_count() * complexity
+
+    def chunk_finished(self, command: ChunkEncoder, stats: dict | None):
+        index = command.chunk.chunk_index
+        if self.pending.pop(index, None) is None:
+            return
+        if stats is not None and stats.get("size", -1) > 0:
+            self.done_frames += stats["length_frames"]
+            self.done_size_kb += stats["size"]
+            self.size_units_done += self._size_units(command.chunk)
+            self.size_kb_session += stats["size"]
+
+    def _done_fraction(self, command: ChunkEncoder, tracker: ProgressTracker):
+        job = tracker.jobs.get(command)
+        frames = job.frames if job is not None else 0
+        if frames == 0 and command.analyzed_encoder is None:
+            return 0.0
+        final_done = min(1.0, frames / max(1, command.chunk.get_frame_count()))
+        return 1 - self.final_share + self.final_share * final_done
+
+    def update(self, tracker: ProgressTracker, now: float = None):
+        """
+        Recomputes eta and size_kb
+        """
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.start
+
+        self.remaining_units = sum(
+            self.units[i] * (1 - self._done_fraction(c, tracker))
+            for i, c in self.pending.items()
+        )
+        done_units = self.session_units - self.remaining_units
+
+        rate = -1
+        if elapsed >= self.min_measure_seconds and done_units > 0:
+            rate = done_units / elapsed
+        elif self.model.seconds_per_unit > 0:
+            rate = self.workers / self.model.seconds_per_unit
+        if rate > 0:
+            self.eta = self.remaining_units / rate
+
+        if self.size_units_done > 0:
+            kb_per_unit = self.size_kb_session / self.size_units_done
+            remaining_size_units = sum(
+                self._size_units(c.chunk) for c in self.pending.values()
+            )
+            self.size_kb = self.done_size_kb + kb_per_unit * remaining_size_units
+        elif self.done_frames > 0:
+            # only earlier sessions to go by, no complexity for those
+            self.size_kb = self.done_size_kb / self.done_frames * self.total_frames
+
+        progress = (
+            1 - self.remaining_units / self.session_units if self.session_units else 1
+        )
+        if (
+            self.reference is None
+            and progress >= self.reference_progress
+            and self.eta >= 0
+        ):
+            self.reference = {
+                "progress": progress,
+                "total_seconds": self.previous_seconds + elapsed + self.eta,
+                "size_kb": self.size_kb,
+            }
+
+    def save(self):
+        self.kv.set_global(
+            self.kv_key,
+            {
+                "seconds": self.previous_seconds + time.monotonic() - self.start,
+                "reference": self.reference,
+                "eta": self.eta,
+                "size_kb": self.size_kb,
+            },
+        )
+
+    def __str__(self):
+        size = f"{self.size_kb / 1000**2:.2f}GB" if self.size_kb > 0 else "-"
+        return f"ETA {format_seconds(self.eta)} SIZE {size}"
+
+    def report(self):
+        """
+        Once everything is encoded, how far off the reference forecast was
+        """
+        seconds = self.previous_seconds + time.monotonic() - self.start
+        # a later integrity rerun is a new encode as far as the forecast goes
+        self.kv.set_global(self.kv_key, None)
+        if self.reference is None:
+            print(f"Encode took {format_seconds(seconds)}, no forecast to compare")
+            return
+        line = (
+            f"Forecast at {self.reference['progress'] * 100:.0f}%: {format_seconds(self.reference['total_seconds'])}, "
+            f"actual {format_seconds(seconds)} "
+            f"({(self.reference['total_seconds'] / max(seconds, 1) - 1) * 100:+.1f}%)"
+        )
+        if self.reference["size_kb"] > 0 and self.done_size_kb > 0:
+            line += (
+                f"; size {self.reference['size_kb'] / 1000:.1f}MB, actual {self.done_size_kb / 1000:.1f}MB "
+                f"({(self.reference['size_kb'] / self.done_size_kb - 1) * 100:+.1f}%)"
+            )
+        print(line)
@@ -0,0 +1,157 @@
+"""
+Compact, versioned job descriptions for sending ChunkEncoders to celery workers.
+
+Pickling a ChunkEncoder drags the whole context along, the chunk sequence, every other job in ctx.chunk_jobs, the
+kv handle. A job spec is just the chunk, the context's settings, and the prototype encoder, analyze chain and final
+step as class name + plain attributes, all json. The worker rebuilds a ChunkEncoder from it.
+"""
+
+import importlib
+import json
+from enum import Enum
+
+from alabamaEncode.core.chunk_encoder import ChunkEncoder
+from alabamaEncode.core.context import AlabamaContext
+from alabamaEncode.scene.chunk import ChunkObject
+
+__all__ = ["JOB_SPEC_VERSION", "build_job_spec", "dump_job_spec", "job_from_spec"]
+
+# bump when the layout changes, workers refuse specs they don't understand
+JOB_SPEC_VERSION = 3
+
+# attributes that are rebuilt on the worker or meaningless there, safe to leave out of a spec,
+# anything else that isn't plain json is an error, the worker would silently fall back to class defaults
+_ctx_skip = {
+    "chunk_jobs",
+    "chunk_sequence",
+    "kv",
+    "prototype_encoder",
+    "chunk_analyze_chain",
+    "chunk_encode_class",
+}
+_encoder_skip = {"chunk", "core_set", "_output_path"}
+
+
+class _NotPlain(Exception):
+    pass
+
+
+def _plain(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Enum):
+        return {"__enum__": _class_path(type(value)), "name": value.name}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        return {k: _plain(v) for k, v in value.items()}
+    raise _NotPlain()
+
+
+def _unplain(value):
+    if isinstance(value, list):
+        return [_unplain(v) for v in value]
+    if isinstance(value, dict):
+        if "__enum__" in value:
+            return _load_class(value["__enum__"])[value["name"]]
+        return {k: _unplain(v) for k, v in value.items()}
+    return value
+
+
+def _state(obj, skip=()) -> dict:
+    """
+    :return: the object's instance attributes as json
+    :raises ValueError: if an attribute outside `skip` can't be expressed in json
+    """
+    state = {}
+    not_plain = []
+    for key, value in vars(obj).items():
+        if key in skip:
+            continue
+        try:
+            state[key] = _plain(value)
+        except _NotPlain:
+            not_plain.append(f"{type(obj).__name__}.{key}")
+    if len(not_plain) > 0:
+        raise ValueError(
+            f"Can't put {', '.join(not_plain)} into a job spec, the worker would encode with the class defaults, "
+            f"make them plain json or add them to the skip list in job_spec.py"
+        )
+    return state
+
+
+def _class_path(cls) -> str:
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+def _load_class(path: str):
+    module, name = path.split(":")
+    # the spec comes over the broker, only ever instantiate our own classes
+    if not module.startswith("alabamaEncode."):
+        raise ValueError(f"Refusing to load {path} from a job spec")
+    return getattr(importlib.import_module(module), name)
+
+
+def _describe(obj, skip=()) -> dict | None:
+    if obj is None:
+        return None
+    return {"class": _class_path(type(obj)), "state": _state(obj, skip)}
+
+
+def _rebuild(description: dict | None):
+    if description is None:
+        return None
+    cls = _load_class(description["class"])
+    obj = cls.__new__(cls)
+    obj.__dict__.update(_unplain(description["state"]))
+    return obj
+
+
+def build_job_spec(
+    command: ChunkEncoder, staging: dict = None, upload: dict = None
+) -> dict:
+    """
+    :param staging: where the worker fetches the chunk's source segment from, see staging.SegmentServer,
+    None if workers read chunk.path directly
+    :param upload: where the worker sends the encoded chunk, see result_upload.ResultReceiver,
+    None if it writes chunk.chunk_path directly
+    """
+    ctx = command.ctx
+    return {
+        "version": JOB_SPEC_VERSION,
+        "chunk": command.chunk.dict(),
+        "threads": command.threads,
+        "ctx": _state(ctx, _ctx_skip),
+        "encoder": _describe(ctx.prototype_encoder, _encoder_skip),
+        "analyze_chain": [_describe(step) for step in ctx.chunk_analyze_chain],
+        "final_step": _describe(ctx.chunk_encode_class),
+        "staging": staging,
+        "upload": upload,
+    }
+
+
+def dump_job_spec(spec: dict) -> str:
+    return json.dumps(spec, separators=(",", ":"))
+
+
+def job_from_spec(spec: dict | str) -> ChunkEncoder:
+    if isinstance(spec, str):
+        spec = json.loads(spec)
+    if spec.get("version") != JOB_SPEC_VERSION:
+        raise ValueError(
+            f"Job spec version {spec.get('version')} != {JOB_SPEC_VERSION}, update the worker or the coordinator"
+        )
+
+    ctx = AlabamaContext()
+    ctx.__dict__.update(_unplain(spec["ctx"]))
+    ctx.prototype_encoder = _rebuild(spec["encoder"])
+    ctx.chunk_analyze_chain = [_rebuild(step) for step in spec["analyze_chain"]]
+    ctx.chunk_encode_class = _rebuild(spec["final_step"])
+
+    chunk = ChunkObject()
+    chunk.__dict__ = spec["chunk"]
+
+    command = ChunkEncoder(ctx, chunk)
+    command.threads = spec["threads"]
+    command.run_on_celery = True
+    return command
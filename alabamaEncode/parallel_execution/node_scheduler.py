@@ -0,0 +1,263 @@
+"""
+Which celery node runs which chunk, for clusters of nodes that aren't equally fast.
+
+Nodes are weighted by their calibration (see calibration.py), the coordinator keeps the queue and hands a chunk to a
+node whenever it has a free slot, the costliest chunks to the fast nodes and the cheap ones to the slow nodes. Near the
+end a node doesn't start a chunk another node would finish sooner, even counting the wait for that node to free up,
+so the slow laptop doesn't take the last chunk of a film. Once the queue is empty, a chunk running well past its
+predicted time gets a copy on a node that would be faster at it, whichever finishes first wins.
+
+Pure bookkeeping, no celery, `now` is passed in so it can be driven by a simulation.
+"""
+
+import statistics
+from typing import Dict, List, Tuple
+
+__all__ = ["WorkerNode", "NodeScheduler"]
+
+
+class WorkerNode:
+    def __init__(self, name: str, fps: float = -1.0, slots: int = 1):
+        """
+        :param fps: calibration benchmark result, -1 if the node didn't publish one
+        :param slots: tasks the node runs at once
+        """
+        self.name = name
+        self.fps = fps
+        self.slots = max(1, slots)
+        # speed relative to the median node
+        self.weight = 1.0
+        self.running: Dict[int, float] = {}  # job key -> start time
+        # seconds per cost unit of the jobs this node finished
+        self.observed: List[float] = []
+        # worker samples in a row the node didn't answer
+        self.missed_samples = 0
+
+    def free_slots(self) -> int:
+        return self.slots - len(self.running)
+
+
+class NodeScheduler:
+    """
+    scheduler.update_nodes({name: {"fps": 41.2, "slots": 4}}) whenever the workers are sampled
+    scheduler.assign(now) -> [(key, node name)] to send, they count as started
+    scheduler.speculate(now) -> [(key, node name)] copies of stragglers to send
+    scheduler.finished(key, node, now, ok) -> node names still running a copy of it, to cancel
+    """
+
+    # a chunk is a straggler past this many times its predicted time
+    speculation_slack = 1.25
+    # a node's speed is what its last few jobs took, a laptop that throttles is slow from then on
+    recent_jobs = 3
+    # finished jobs needed before predicting anything
+    min_finished = 2
+    # a node gone for this many worker samples is dropped and its jobs requeued, one can be a slow reply
+    max_missed_samples = 2
+
+    def __init__(self, costs: Dict[int, float], speculate: bool = True):
+        """
+        :param costs: job key -> cost, e.g. ChunkCostModel units
+        :param speculate: run copies of stragglers, only for jobs that are safe to run twice
+        """
+        self.costs = costs
+        self.speculate_enabled = speculate
+        # costliest first
+        self.pending: List[int] = sorted(costs, key=lambda k: -costs[k])
+        self.nodes: Dict[str, WorkerNode] = {}
+        self.done = set()
+        # seconds x node weight / cost of every finished job
+        self.ratios: List[float] = []
+        # job key -> node running its speculative copy
+        self.speculative: Dict[int, str] = {}
+        self.speculation_wins = 0
+
+    def update_nodes(self, calibrations: Dict[str, dict]) -> List[int]:
+        """
+        :param calibrations: node name -> {"fps", "slots"} of the nodes that are up now
+        :return: keys that were running on nodes that are gone, back in the queue
+        """
+        requeued = []
+        for name in list(self.nodes):
+            if name in calibrations:
+                continue
+            self.nodes[name].missed_samples += 1
+            if self.nodes[name].missed_samples < self.max_missed_samples:
+                continue
+            for key in self.nodes.pop(name).running:
+                if key not in self.done and not self._copies(key):
+                    requeued.append(key)
+        for name, calibration in calibrations.items():
+            node = self.nodes.get(name)
+            if node is None:
+                node = self.nodes[name] = WorkerNode(name)
+            node.missed_samples = 0
+            node.fps = calibration.get("fps", -1)
+            node.slots = max(1, calibration.get("slots", 1))
+
+        measured = [n.fps for n in self.nodes.values() if n.fps > 0]
+        median = statistics.median(measured) if measured else -1
+        for node in self.nodes.values():
+            node.weight = node.fps / median if node.fps > 0 and median > 0 else 1.0
+
+        self.pending = sorted(self.pending + requeued, key=lambda k: -self.costs[k])
+        return requeued
+
+    def _copies(self, key: int) -> List[WorkerNode]:
+        return [n for n in self.nodes.values() if key in n.running]
+
+    def seconds_per_unit(self, node: WorkerNode) -> float:
+        """
+        :return: what a cost unit takes on the node, -1 until enough jobs finished
+        """
+        if len(node.observed) > 0:
+            return statistics.mean(node.observed[-self.recent_jobs :])
+        if len(self.ratios) < self.min_finished:
+            return -1
+        return statistics.mean(self.ratios) / node.weight
+
+    def predict(self, key: int, node: WorkerNode) -> float:
+        spu = self.seconds_per_unit(node)
+        return self.costs[key] * spu if spu > 0 else -1
+
+    def _drain_seconds(self, now: float, exclude: WorkerNode) -> float:
+        """
+        :return: about how long the other nodes need for everything queued and running, -1 if unknown
+        """
+        if len(self.ratios) < self.min_finished:
+            return -1
+        capacity = sum(
+            n.weight * n.slots for n in self.nodes.values() if n is not exclude
+        )
+        if capacity <= 0:
+            return -1
+        work = sum(self.costs[k] for k in self.pending)
+        for node in self.nodes.values():
+            if node is exclude:
+                continue
+            for key, start in node.running.items():
+                predicted = self.predict(key, node)
+                if predicted > 0:
+                    work += self.costs[key] * max(0.0, 1 - (now - start) / predicted)
+        return work * statistics.mean(self.ratios) / capacity
+
+    def _free_in(self, node: WorkerNode, now: float) -> float:
+        """
+        :return: about how long until the node has a free slot, -1 if there's no telling, e.g. its jobs are overdue
+        """
+        if node.free_slots() > 0:
+            return 0
+        remaining = [
+            self.predict(key, node) - (now - start)
+            for key, start in node.running.items()
+        ]
+        remaining = [r for r in remaining if r > 0]
+        return min(remaining) if len(remaining) > 0 else -1
+
+    def _sooner_elsewhere(
+        self, key: int, node: WorkerNode, now: float, predicted: float
+    ) -> bool:
+        """
+        :return: another node would finish the job before this one, counting the wait for it to free up
+        """
+        for other in self.nodes.values():
+            if other is node:
+                continue
+            free_in = self._free_in(other, now)
+            elsewhere = self.predict(key, other)
+            if free_in >= 0 and 0 < elsewhere and free_in + elsewhere < predicted:
+                return True
+        return False
+
+    def assign(self, now: float) -> List[Tuple[int, str]]:
+        assigned = []
+        held = set()
+        while len(self.pending) > 0:
+            free = [
+                n
+                for n in self.nodes.values()
+                if n.free_slots() > 0 and n.name not in held
+            ]
+            if len(free) == 0:
+                break
+            node = max(free, key=lambda n: n.weight)
+            # fast nodes take the costliest chunk, slow ones the cheapest
+            key = self.pending[0] if node.weight >= 1 else self.pending[-1]
+
+            predicted = self.predict(key, node)
+            drain = self._drain_seconds(now, exclude=node)
+            if 0 < drain < predicted and self._sooner_elsewhere(
+                key, node, now, predicted
+            ):
+                # the others run out of work before this node would be done, and one of them gets through
+                # the chunk sooner even after finishing what it has, leave it to that one
+                held.add(node.name)
+                continue
+
+            self.pending.remove(key)
+            self.started(key, node.name, now)
+            assigned.append((key, node.name))
+        return assigned
+
+    def started(self, key: int, node_name: str, now: float):
+        self.nodes[node_name].running[key] = now
+
+    def speculate(self, now: float) -> List[Tuple[int, str]]:
+        """
+        :return: copies to launch, only once nothing is queued
+        """
+        if not self.speculate_enabled or len(self.pending) > 0:
+            return []
+        copies = []
+        stragglers = []
+        for node in self.nodes.values():
+            for key, start in node.running.items():
+                if len(self._copies(key)) > 1:
+                    continue
+                predicted = self.predict(key, node)
+                if predicted > 0 and now - start > predicted * self.speculation_slack:
+                    stragglers.append(((now - start) / predicted, key, node))
+
+        for _, key, slow in sorted(stragglers, key=lambda s: -s[0]):
+            # faster by what the nodes actually did, the calibration can be off, e.g. a laptop that throttles
+            slow_predicted = self.predict(key, slow)
+            faster = [
+                n
+                for n in self.nodes.values()
+                if n is not slow
+                and n.free_slots() > 0
+                and 0 < self.predict(key, n) < slow_predicted
+            ]
+            if len(faster) == 0:
+                continue
+            node = min(faster, key=lambda n: self.predict(key, n))
+            self.started(key, node.name, now)
+            self.speculative[key] = node.name
+            copies.append((key, node.name))
+        return copies
+
+    def finished(self, key: int, node_name: str, now: float, ok: bool) -> List[str]:
+        """
+        :param ok: the job produced a result, a failed copy leaves the others running
+        :return: nodes still running a copy of the job, their copies lost
+        """
+        node = self.nodes.get(node_name)
+        start = node.running.pop(key, None) if node is not None else None
+        if key in self.done:
+            return []
+        others = [n.name for n in self._copies(key)]
+        if not ok and len(others) > 0:
+            return []
+
+        self.done.add(key)
+        if key in self.pending:
+            # requeued when its node went quiet, but the node came through after all
+            self.pending.remove(key)
+        for name in others:
+            self.nodes[name].running.pop(key, None)
+        if ok and start is not None and self.costs[key] > 0:
+            spu = (now - start) / self.costs[key]
+            node.observed.append(spu)
+            self.ratios.append(spu * node.weight)
+        if ok and self.speculative.get(key) == node_name:
+            self.speculation_wins += 1
+        return others
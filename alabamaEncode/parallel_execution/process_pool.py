@@ -0,0 +1,202 @@
+import asyncio
+import copy
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from alabamaEncode.core.chunk_encoder import ChunkEncoder
+from alabamaEncode.core.media_info import MediaInfo
+from alabamaEncode.core.util import bin_utils
+from alabamaEncode.core.util.cli_executor import add_owned_pid, release_owner
+from alabamaEncode.core.util.cpu_topology import CoreSet
+from alabamaEncode.parallel_execution.progress import JobProgress, SharedJobProgress
+from alabamaEncode.scene.chunk import ChunkObject
+
+# set once per worker process by _init_worker
+_worker_ctx = None
+_worker_progress_queue = None
+_worker_frame_counters = None
+
+
+def _init_worker(ctx, progress_queue, frame_counters, registered_bins):
+    """
+    :param frame_counters: the pool's shared per-job frame counters, see ChunkProcessPool.job_progress
+    :param registered_bins: the parent's register_bin calls, a spawned process starts without them
+    """
+    global _worker_ctx, _worker_progress_queue, _worker_frame_counters
+    _worker_ctx = ctx
+    _worker_progress_queue = progress_queue
+    _worker_frame_counters = frame_counters
+    # same as the parent, see paths.py
+    MediaInfo.set_cache_folder(ctx.temp_folder)
+    for name, cli in registered_bins:
+        bin_utils.register_bin(name, cli)
+
+
+def run_chunk_in_worker(
+    chunk: ChunkObject,
+    core_set: CoreSet,
+    frame_slot: int,
+    threads: int = None,
+    analysis: tuple = None,
+):
+    """
+    Runs in the pool, the process side of ChunkEncoder.run
+    :param chunk: the chunk to encode, the job description is just this + the cores
+    :param core_set: cores to pin to, None for none
+    :param threads: ChunkEncoder.threads, None for the encoder's own
+    :param analysis: what analyze_chunk_in_worker returned, to only run the final encode
+    :param frame_slot: the job's frame counter to count encoded frames into, None for no per-frame progress
+    :return: the same (core_set, stats) ChunkEncoder.run returns
+    """
+    # the whole worker counts as the job's process tree in the parent's resource accounting
+    _worker_progress_queue.put(("pid", chunk.chunk_index, os.getpid()))
+    command = ChunkEncoder(_worker_ctx, chunk)
+    command.core_set = core_set
+    command.threads = threads
+    if analysis is not None:
+        command.analyzed_encoder, command.timing = analysis
+    if frame_slot is not None:
+
+        def frame_encoded(*_):
+            # only this job writes its slot, and the parent only reads it
+            _worker_frame_counters[frame_slot] += 1
+
+        command.encoded_a_frame_callback = frame_encoded
+    try:
+        return command.run()
+    finally:
+        # the parent (and the integrity check after the encode) only sees what made it to disk
+        _worker_ctx.get_kv().flush()
+        release_owner(chunk.chunk_index)
+
+
+def analyze_chunk_in_worker(chunk: ChunkObject, core_set: CoreSet, threads: int = None):
+    """
+    Runs in the pool, the process side of ChunkEncoder.run_analysis
+    :return: (analyzed encoder, timing) for the final encode to pick up, None if the analysis failed
+    """
+    _worker_progress_queue.put(("pid", chunk.chunk_index, os.getpid()))
+    command = ChunkEncoder(_worker_ctx, chunk)
+    command.core_set = core_set
+    command.threads = threads
+    try:
+        if not command.run_analysis():
+            return None
+        return command.analyzed_encoder, command.timing
+    finally:
+        _worker_ctx.get_kv().flush()
+        release_owner(chunk.chunk_index)
+
+
+class ChunkProcessPool:
+    """
+    Runs ChunkEncoder jobs in a ProcessPoolExecutor instead of threads, so the python heavy parts
+    (vmaf log parsing, grain synth, kv io) don't fight over one GIL.
+
+    The context is pickled once per worker process, stripped of the job list and kv handle,
+    each job only ships its ChunkObject, CoreSet and thread count.
+    Per-frame progress is a shared memory counter per job the parent samples, see job_progress,
+    the only messages back are the worker pid each job runs in.
+    """
+
+    def __init__(self, command_objects: List[ChunkEncoder], max_workers: int):
+        ctx = command_objects[0].ctx
+        # anything the workers read has to be on disk before they start
+        ctx.get_kv().flush()
+
+        worker_ctx = copy.copy(ctx)
+        worker_ctx.chunk_jobs = []
+        worker_ctx.chunk_sequence = None
+        worker_ctx.kv = None
+
+        # spawn, forking a process that has kv flush threads and an event loop running is asking for trouble
+        mp_context = multiprocessing.get_context("spawn")
+        self.progress_queue = mp_context.Queue()
+        # one frame counter per job, no lock since only the job's worker writes it
+        self.frame_counters = mp_context.Array("q", len(command_objects), lock=False)
+        self.frame_slots = {
+            c.chunk.chunk_index: slot for slot, c in enumerate(command_objects)
+        }
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(
+                worker_ctx,
+                self.progress_queue,
+                self.frame_counters,
+                list(bin_utils.bins),
+            ),
+        )
+        self.progress_thread = threading.Thread(
+            target=self._forward_progress, daemon=True
+        )
+        self.progress_thread.start()
+
+    def _forward_progress(self):
+        while True:
+            message = self.progress_queue.get()
+            if message is None:
+                return
+            kind, chunk_index, payload = message
+            if kind == "pid":
+                add_owned_pid(chunk_index, payload)
+
+    def job_progress(self, command: ChunkEncoder) -> JobProgress:
+        """
+        :return: the JobProgress for ProgressTracker.start, the worker counts the job's frames straight into it
+        """
+        return SharedJobProgress(
+            self.frame_counters, self.frame_slots[command.chunk.chunk_index]
+        )
+
+    def submit(self, command: ChunkEncoder) -> asyncio.Future:
+        return asyncio.wrap_future(
+            self.executor.submit(
+                run_chunk_in_worker,
+                command.chunk,
+                command.core_set,
+                (
+                    self.frame_slots[command.chunk.chunk_index]
+                    if command.encoded_a_frame_callback is not None
+                    else None
+                ),
+                command.threads,
+                (
+                    (command.analyzed_encoder, command.timing)
+                    if command.analyzed_encoder is not None
+                    else None
+                ),
+            )
+        )
+
+    def submit_analysis(self, command: ChunkEncoder) -> asyncio.Future:
+        """
+        :return: future of ChunkEncoder.run_analysis's result, the analyzed encoder is set on the parent side
+        command, so the final encode can be submitted like any other
+        """
+
+        async def analyze():
+            result = await asyncio.wrap_future(
+                self.executor.submit(
+                    analyze_chunk_in_worker,
+                    command.chunk,
+                    command.core_set,
+                    command.threads,
+                )
+            )
+            if result is None:
+                return False
+            command.analyzed_encoder, command.timing = result
+            return True
+
+        return asyncio.ensure_future(analyze())
+
+    def shutdown(self):
+        # don't block on an interrupt, on a normal finish every job is done anyway
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.progress_queue.put(None)
+        self.progress_thread.join()
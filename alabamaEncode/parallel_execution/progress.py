@@ -0,0 +1,189 @@
+"""
+Encode progress without per-frame locking or tqdm calls.
+Every running job counts its frames into its own JobProgress from whatever thread runs it, the scheduler samples
+all of them a few times a second, and that one sample drives the progress bar, the throughput controller and the
+status api.
+"""
+
+import time
+from typing import Dict, List
+
+from tqdm import tqdm
+
+__all__ = [
+    "JobProgress",
+    "SharedJobProgress",
+    "ProgressSnapshot",
+    "ProgressTracker",
+    "get_encode_progress",
+]
+
+# the last sample of the running encode, for things that poll like the status api
+_latest_snapshot = None
+
+
+def get_encode_progress():
+    """
+    :return: the latest ProgressSnapshot of the encode running in this process, None if there is none
+    """
+    return _latest_snapshot
+
+
+class JobProgress:
+    """
+    Frames one running job has encoded so far.
+    Only the job's own thread writes it and the scheduler only reads, an int attribute is safe without a lock.
+    """
+
+    __slots__ = ("frames", "sampled_frames", "fps")
+
+    def __init__(self):
+        self.frames = 0
+        self.sampled_frames = 0
+        self.fps = -1.0
+
+    def frame_encoded(self, *_):
+        """
+        Fits the encoded_a_frame_callback signature, (frame, bitrate, fps)
+        """
+        self.frames += 1
+
+
+class SharedJobProgress(JobProgress):
+    """
+    A JobProgress whose frames live in a shared memory counter, for jobs running in another process,
+    the worker increments counters[slot] and the sampler reads it, no message per frame
+    """
+
+    __slots__ = ("counters", "slot")
+
+    def __init__(self, counters, slot: int):
+        """
+        :param counters: e.g. a multiprocessing Array("q", ...) shared with the worker
+        """
+        self.counters = counters
+        self.slot = slot
+        super().__init__()
+
+    @property
+    def frames(self) -> int:
+        return self.counters[self.slot]
+
+    @frames.setter
+    def frames(self, value: int):
+        self.counters[self.slot] = value
+
+
+class ProgressSnapshot:
+    def __init__(
+        self,
+        done: int,
+        total: int,
+        fps: float,
+        eta: float,
+        job_fps: List[float],
+    ):
+        """
+        :param done: units (frames, or commands for plain commands) done, including earlier sessions
+        :param eta: seconds left at the current fps, -1 if unknown
+        :param job_fps: fps of every running job
+        """
+        self.done = done
+        self.total = total
+        self.fps = fps
+        self.eta = eta
+        self.job_fps = job_fps
+
+    @property
+    def percent(self) -> float:
+        return self.done / self.total * 100 if self.total > 0 else 0
+
+
+class ProgressTracker:
+    """
+    tracker.start(command) -> JobProgress, hand its frame_encoded to the job as the frame callback
+    tracker.finish(command, units) once the job is done
+    tracker.sample() a few times a second, pushes the new units to the pbar and returns a ProgressSnapshot
+    tracker.close() once the encode is over
+    """
+
+    def __init__(self, pbar: tqdm, smoothing: float = 0.2):
+        """
+        :param smoothing: weight of the newest sample in the fps averages, lower is steadier
+        """
+        self.pbar = pbar
+        self.smoothing = smoothing
+        self.jobs: Dict[object, JobProgress] = {}
+        self.finished_units = 0
+        self.counted = 0
+        # units the last sample found, what the throughput controller is fed
+        self.new_units = 0
+        # the same per running job, zero for the ones that found none
+        self.new_job_units: Dict[object, int] = {}
+        self.fps = -1.0
+        self.last_sample = time.monotonic()
+
+    def start(self, command, job: JobProgress = None) -> JobProgress:
+        """
+        :param job: where the job counts its frames, a plain JobProgress if None
+        """
+        job = JobProgress() if job is None else job
+        self.jobs[command] = job
+        return job
+
+    def finish(self, command, units: int):
+        """
+        :param units: what the job is worth once done, e.g. the chunk's frames,
+        frames it reported on the way are replaced by this, unless it reported more (a job that failed halfway)
+        """
+        job = self.jobs.pop(command, None)
+        self.finished_units += max(units, job.frames if job is not None else 0)
+
+    def _smooth(self, old: float, new: float) -> float:
+        return new if old < 0 else old * (1 - self.smoothing) + new * self.smoothing
+
+    def sample(self, now: float = None) -> ProgressSnapshot:
+        """
+        :return: the progress now, also published for get_encode_progress
+        """
+        global _latest_snapshot
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.last_sample
+        self.last_sample = now
+
+        self.new_job_units = {
+            command: job.frames - job.sampled_frames
+            for command, job in self.jobs.items()
+        }
+        jobs = list(self.jobs.values())
+        counted = self.finished_units + sum(job.frames for job in jobs)
+        self.new_units = counted - self.counted
+        self.counted = counted
+        if self.new_units > 0:
+            self.pbar.update(self.new_units)
+
+        if elapsed > 0:
+            self.fps = self._smooth(self.fps, self.new_units / elapsed)
+            for job in jobs:
+                job.fps = self._smooth(
+                    job.fps, (job.frames - job.sampled_frames) / elapsed
+                )
+        for job in jobs:
+            job.sampled_frames = job.frames
+
+        remaining = max(0, self.pbar.total - self.pbar.n) if self.pbar.total else 0
+        _latest_snapshot = ProgressSnapshot(
+            done=self.pbar.n,
+            total=self.pbar.total or 0,
+            fps=max(0.0, self.fps),
+            eta=remaining / self.fps if self.fps > 0 else -1,
+            job_fps=[max(0.0, job.fps) for job in jobs],
+        )
+        return _latest_snapshot
+
+    def close(self):
+        """
+        Stops publishing, get_encode_progress goes back to None instead of reporting this encode forever
+        """
+        global _latest_snapshot
+        _latest_snapshot = None
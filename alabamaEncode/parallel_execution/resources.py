@@ -0,0 +1,218 @@
+"""
+Per-job resource accounting and memory admission control for local chunk scheduling.
+Every process a job starts is attributed to it (see cli_executor.process_owner), the monitor sums RSS and cpu over
+those processes and their children, and only lets a new job start if its expected footprint fits in the budget.
+"""
+
+import json
+import os
+import threading
+from typing import List
+
+import psutil
+
+from alabamaEncode.core.util.cli_executor import get_owned_pids, release_owner
+from alabamaEncode.core.util.kv import write_json_atomic
+
+__all__ = ["parse_memory_size", "MemoryFootprintModel", "ResourceMonitor"]
+
+
+def parse_memory_size(size: str) -> int:
+    """
+    :param size: "16G", "1500M", "512K", or a plain number of megabytes, -1 for auto
+    :return: size in bytes, -1 for auto
+    """
+    size = str(size).strip().upper().removesuffix("B")
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    try:
+        if size[-1:] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+        value = float(size)
+    except ValueError:
+        raise ValueError(f"Can't parse memory size {size}, expected e.g. 16G or 1500M")
+    return -1 if value < 0 else int(value * units["M"])
+
+
+def footprint_key(command) -> str:
+    """
+    :return: "encoder|preset|WxH", what the memory footprint of a chunk job is learned against,
+    prefixed with "analysis|" for the analysis stage of the two stage scheduler
+    """
+    ctx = command.ctx
+    enc = ctx.prototype_encoder
+    width, height = ctx.output_width, ctx.output_height
+    if width <= 0 or height <= 0:
+        width, height = command.chunk.width, command.chunk.height
+    key = f"{enc.__class__.__name__}|{enc.speed}|{width}x{height}"
+    return f"analysis|{key}" if getattr(command, "stage", None) == "analysis" else key
+
+
+class MemoryFootprintModel:
+    """
+    Peak RSS of a chunk job per (encoder, preset, resolution), learned from finished jobs and kept across runs.
+    Unknown keys get a guess from the pixel count until the first job of that kind finishes.
+    """
+
+    model_file = os.path.expanduser("~/.alabamaEncoder/memory_footprints.json")
+    # weight of a new observation, peaks are noisy between scenes
+    learn_rate = 0.3
+    # on top of the learned peak
+    headroom = 1.15
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.peaks: dict[str, float] = {}
+        if os.path.exists(self.model_file):
+            try:
+                with open(self.model_file) as f:
+                    self.peaks = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self.peaks = {}
+
+    @staticmethod
+    def guess(key: str) -> int:
+        resolution = key.rsplit("|", 1)[-1]
+        width, height = (int(x) for x in resolution.split("x"))
+        if width <= 0 or height <= 0:
+            width, height = 1920, 1080
+        # ~200 bytes a pixel covers svt/aom lookahead buffers at the usual presets, plus the ffmpeg decoder
+        return width * height * 200 + 64 * 1024**2
+
+    def estimate(self, key: str) -> int:
+        with self.lock:
+            peak = self.peaks.get(key)
+        if peak is None:
+            return self.guess(key)
+        return int(peak * self.headroom)
+
+    def learn(self, key: str, peak_rss: int):
+        if peak_rss <= 0:
+            return
+        with self.lock:
+            old = self.peaks.get(key)
+            if old is None:
+                self.peaks[key] = peak_rss
+            else:
+                # a bigger peak is taken at once, a smaller one only slowly pulls the estimate down
+                self.peaks[key] = max(
+                    peak_rss, old * (1 - self.learn_rate) + peak_rss * self.learn_rate
+                )
+
+    def save(self):
+        with self.lock:
+            peaks = dict(self.peaks)
+        try:
+            os.makedirs(os.path.dirname(self.model_file), exist_ok=True)
+            write_json_atomic(self.model_file, peaks)
+        except OSError:
+            pass
+
+
+class ResourceMonitor:
+    """
+    Samples the process trees of running jobs and decides if another job fits.
+
+    sample() -> refreshes per-job rss/cpu, call it periodically
+    can_admit(command, running_commands) -> bool
+    under_pressure() -> bool, the system is low on memory or swapping, don't add work
+    job_finished(command) -> records the job's peak into the footprint model
+    """
+
+    # never leave less than this share of ram available to the rest of the system
+    min_available_share = 0.05
+
+    def __init__(self, max_memory: int = -1, model: MemoryFootprintModel = None):
+        """
+        :param max_memory: bytes all jobs together may use, -1 for 80% of ram
+        """
+        total = psutil.virtual_memory().total
+        self.max_memory = max_memory if max_memory > 0 else int(total * 0.8)
+        self.model = model if model is not None else MemoryFootprintModel()
+        self.job_rss: dict[int, int] = {}
+        self.job_cpu: dict[int, float] = {}
+        self.job_peak_rss: dict[int, int] = {}
+        self.processes: dict[int, psutil.Process] = {}
+        self.swapped_in = psutil.swap_memory().sin
+        self.swapping = False
+
+    def _process(self, pid: int) -> psutil.Process:
+        # keep the Process objects around, cpu_percent is measured between two calls on the same one
+        p = self.processes.get(pid)
+        if p is None:
+            p = psutil.Process(pid)
+            p.cpu_percent(None)
+            self.processes[pid] = p
+        return p
+
+    def job_tree(self, owner) -> List[psutil.Process]:
+        tree = {}
+        for pid in get_owned_pids(owner):
+            try:
+                p = self._process(pid)
+                if not p.is_running():
+                    continue
+                tree[p.pid] = p
+                for child in p.children(recursive=True):
+                    tree[child.pid] = self._process(child.pid)
+            except psutil.Error:
+                continue
+        return list(tree.values())
+
+    def sample(self, running_commands):
+        alive = set()
+        for command in running_commands:
+            owner = command.chunk.chunk_index
+            rss, cpu = 0, 0.0
+            for p in self.job_tree(owner):
+                try:
+                    rss += p.memory_info().rss
+                    cpu += p.cpu_percent(None)
+                    alive.add(p.pid)
+                except psutil.Error:
+                    continue
+            self.job_rss[owner] = rss
+            self.job_cpu[owner] = cpu
+            self.job_peak_rss[owner] = max(self.job_peak_rss.get(owner, 0), rss)
+
+        self.processes = {pid: p for pid, p in self.processes.items() if pid in alive}
+
+        swapped_in = psutil.swap_memory().sin
+        self.swapping = swapped_in > self.swapped_in
+        self.swapped_in = swapped_in
+
+    def committed_memory(self, running_commands) -> int:
+        """
+        :return: what the running jobs use, or are expected to grow to if they haven't peaked yet
+        """
+        return sum(
+            max(
+                self.job_rss.get(c.chunk.chunk_index, 0),
+                self.model.estimate(footprint_key(c)),
+            )
+            for c in running_commands
+        )
+
+    def used_memory(self) -> int:
+        return sum(self.job_rss.values())
+
+    def under_pressure(self) -> bool:
+        vm = psutil.virtual_memory()
+        return self.swapping or vm.available < vm.total * self.min_available_share
+
+    def can_admit(self, command, running_commands) -> bool:
+        if len(running_commands) == 0:
+            return True  # always make progress, even if one job alone is over budget
+        if self.under_pressure():
+            return False
+        needed = self.model.estimate(footprint_key(command))
+        if self.committed_memory(running_commands) + needed > self.max_memory:
+            return False
+        vm = psutil.virtual_memory()
+        return vm.available - needed > vm.total * self.min_available_share
+
+    def job_finished(self, command):
+        owner = command.chunk.chunk_index
+        self.model.learn(footprint_key(command), self.job_peak_rss.pop(owner, 0))
+        self.job_rss.pop(owner, None)
+        self.job_cpu.pop(owner, None)
+        release_owner(owner)
@@ -0,0 +1,312 @@
+"""
+Encoded chunks coming back from celery workers over http instead of through a shared filesystem.
+
+The worker encodes into a local work folder, then PUTs the chunk to the coordinator with its sha256. The coordinator
+appends to a partial file next to the chunk's path in temp/chunks/, so a dropped connection resumes from what
+already arrived (HEAD tells the worker the offset), checks the hash once everything is there and renames the file
+into place, a chunk path only ever holds a complete, verified chunk.
+"""
+
+import glob
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from typing import Dict, List
+
+import requests
+
+from alabamaEncode.core.util.kv import AlabamaKv
+from alabamaEncode.parallel_execution.coordinator_server import (
+    KEY_HEADER,
+    CoordinatorServer,
+    sha256_file,
+)
+from alabamaEncode.scene.chunk import ChunkObject
+
+__all__ = [
+    "ChunkAlreadyUploaded",
+    "ResultReceiver",
+    "upload_result",
+    "run_and_upload",
+]
+
+
+class ChunkAlreadyUploaded(Exception):
+    """
+    Another copy of the job delivered the chunk first
+    """
+
+
+class ResultReceiver:
+    """
+    Takes chunk uploads on the coordinator's server.
+
+    results = ResultReceiver(ctx, server, chunks)
+    spec["upload"] = results.job_upload(chunk)
+    results.record(chunk, stats, kv_entries) with what the task returned
+    results.stop() prints what came in
+    """
+
+    def __init__(self, ctx, server: CoordinatorServer, chunks: List[ChunkObject]):
+        if ctx.multi_res_pipeline:
+            # the candidate and final encodes live in the worker's temp folder, which is gone after the upload,
+            # and the trellis between the two stages needs all of them in one place
+            raise ValueError(
+                "The multi res pipeline needs a temp folder shared with the workers, "
+                "it can't run with chunks uploaded from celery workers"
+            )
+        self.ctx = ctx
+        self.server = server
+        self.chunks: Dict[int, ChunkObject] = {c.chunk_index: c for c in chunks}
+        self.locks: Dict[int, threading.Lock] = {
+            i: threading.Lock() for i in self.chunks
+        }
+        self.received_bytes = 0
+        self.received_chunks = 0
+        # uploads that picked up a partial file instead of starting over
+        self.resumed = 0
+        self.rejected = 0
+        # the first complete upload of a chunk wins, speculative copies finishing later are turned away
+        self.done = set()
+        server.route("results", self._handle)
+
+    def job_upload(self, chunk: ChunkObject) -> dict:
+        """
+        :return: where the worker sends the chunk, goes into the job spec
+        """
+        return {
+            "url": f"{self.server.url}/results/{chunk.chunk_index}",
+            "key": self.server.key,
+        }
+
+    def _part_path(self, chunk_index: int, sha256: str) -> str:
+        # next to the chunk so the final rename stays on one filesystem
+        return f"{self.chunks[chunk_index].chunk_path}.{sha256[:16]}.part"
+
+    @staticmethod
+    def _offset(path: str) -> int:
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _handle(self, request: BaseHTTPRequestHandler, method: str, chunk_index: int):
+        sha256 = request.headers.get("X-Content-Sha256", "")
+        if chunk_index not in self.chunks or len(sha256) != 64:
+            request.send_error(404 if chunk_index not in self.chunks else 400)
+            return
+        part = self._part_path(chunk_index, sha256)
+
+        if chunk_index in self.done:
+            request.send_response(409)
+            request.send_header("X-Upload-Done", "1")
+            request.end_headers()
+            return
+
+        if method == "HEAD":
+            request.send_response(200)
+            request.send_header("X-Upload-Offset", str(self._offset(part)))
+            request.end_headers()
+            return
+        if method != "PUT":
+            request.send_error(405)
+            return
+
+        offset = _size_header(request, "X-Upload-Offset", default=0)
+        total = _size_header(request, "X-Total-Size")
+        length = _size_header(request, "Content-Length")
+        if offset is None or total is None or length is None or offset > total:
+            request.send_error(400, "missing or bad upload size headers")
+            return
+        with self.locks[chunk_index]:
+            if chunk_index in self.done:
+                request.send_response(409)
+                request.send_header("X-Upload-Done", "1")
+                request.end_headers()
+                return
+            current = self._offset(part)
+            if offset != current:
+                request.send_response(409)
+                request.send_header("X-Upload-Offset", str(current))
+                request.end_headers()
+                return
+            if offset > 0:
+                self.resumed += 1
+
+            # whatever arrives stays in the part file, a broken connection resumes from there
+            with open(part, "ab") as f:
+                left = length
+                while left > 0:
+                    block = request.rfile.read(min(left, 1024**2))
+                    if not block:
+                        break
+                    f.write(block)
+                    left -= len(block)
+            current = self._offset(part)
+            self.received_bytes += current - offset
+
+            if current < total:
+                request.send_response(200)
+                request.send_header("X-Upload-Offset", str(current))
+                request.end_headers()
+                return
+
+            if current > total or sha256_file(part) != sha256:
+                os.remove(part)
+                self.rejected += 1
+                self.ctx.log(
+                    f"chunk {chunk_index}: upload failed its checksum, discarded",
+                    category="uploads",
+                )
+                request.send_error(422, "checksum mismatch")
+                return
+
+            os.replace(part, self.chunks[chunk_index].chunk_path)
+            self.done.add(chunk_index)
+            # a copy that lost the race may have left half an upload
+            for leftover in glob.glob(
+                f"{glob.escape(self.chunks[chunk_index].chunk_path)}.*.part"
+            ):
+                os.remove(leftover)
+            self.received_chunks += 1
+            self.ctx.log(
+                f"chunk {chunk_index}: received {total} bytes, resumed at {offset}",
+                category="uploads",
+            )
+            request.send_response(201)
+            request.end_headers()
+
+    def record(self, chunk: ChunkObject, stats: dict, kv_entries: list):
+        """
+        What ChunkEncoder would have written into the temp folder if it ran here, the chunks.log line and
+        everything the job put into the kv
+        :param kv_entries: [bucket, key, value, individual_mode] lists, see run_and_upload
+        """
+        with open(f"{self.ctx.temp_folder}/chunks.log", "a") as f:
+            f.write(json.dumps(stats) + "\n")
+        kv = self.ctx.get_kv()
+        with kv.batch():
+            for bucket, key, value, individual_mode in kv_entries:
+                kv.set(bucket, key, value, individual_mode=individual_mode)
+
+    def stop(self):
+        if self.received_chunks == 0:
+            return
+        print(
+            f"Received {self.received_chunks} chunks from workers, {self.received_bytes / 1000**2:.1f}MB, "
+            f"{self.resumed} resumed uploads, {self.rejected} failed checksums"
+        )
+
+
+def _size_header(request: BaseHTTPRequestHandler, name: str, default=None):
+    """
+    :return: the header as a non-negative int, `default` if it's missing, None if it's not a valid size
+    """
+    value = request.headers.get(name)
+    if value is None:
+        return default
+    try:
+        size = int(value)
+    except ValueError:
+        return None
+    return size if size >= 0 else None
+
+
+def upload_result(path: str, upload: dict, retries: int = 5) -> int:
+    """
+    Sends a finished chunk to the coordinator, resuming after dropped connections
+    :param upload: the job spec's upload entry, see ResultReceiver.job_upload
+    :return: bytes sent
+    """
+    sha256 = sha256_file(path)
+    total = os.path.getsize(path)
+    headers = {KEY_HEADER: upload["key"], "X-Content-Sha256": sha256}
+    sent = 0
+    for attempt in range(retries + 1):
+        try:
+            r = requests.head(upload["url"], headers=headers, timeout=30)
+            if "X-Upload-Done" in r.headers:
+                raise ChunkAlreadyUploaded()
+            offset = int(r.headers["X-Upload-Offset"])
+            with open(path, "rb") as f:
+                f.seek(offset)
+                r = requests.put(
+                    upload["url"],
+                    data=f,
+                    headers={
+                        **headers,
+                        "X-Upload-Offset": str(offset),
+                        "X-Total-Size": str(total),
+                        "Content-Length": str(total - offset),
+                    },
+                    timeout=(10, 600),
+                )
+            if r.status_code == 201:
+                return sent + total - offset
+            if "X-Upload-Done" in r.headers:
+                raise ChunkAlreadyUploaded()
+            if r.status_code in (200, 409, 422):
+                # partly through, someone else moved the offset, or it got corrupted on the way and starts over
+                sent += max(0, int(r.headers.get("X-Upload-Offset", offset)) - offset)
+                continue
+            r.raise_for_status()
+        except requests.RequestException:
+            if attempt == retries:
+                raise
+            time.sleep(2**attempt)
+    raise RuntimeError(f"Failed to upload {path} to {upload['url']}")
+
+
+def run_and_upload(command, upload: dict):
+    """
+    Runs a ChunkEncoder on a worker with everything it writes in a local work folder,
+    then uploads the chunk to the coordinator
+    :param command: ChunkEncoder
+    :param upload: the job spec's upload entry
+    :return: what command.run() returns plus every kv entry the job wrote, (code, stats, [(bucket, key, value,
+    individual_mode)]), None if another copy of the job delivered the chunk first
+    """
+    work_root = os.getenv("CELERY_WORK_DIR", "/tmp/celery/work/")
+    os.makedirs(work_root, exist_ok=True)
+    work = tempfile.mkdtemp(dir=work_root)
+    chunk = command.chunk
+    coordinator_chunk_path = chunk.chunk_path
+    # the coordinator's temp folder only exists on the coordinator, the kv, probes and logs go here instead
+    command.ctx.temp_folder = os.path.join(work, "")
+    chunk.chunk_path = os.path.join(work, os.path.basename(chunk.chunk_path))
+    # everything the job writes goes back with the result, e.g. grain_synth, target vmaf probes, chunk integrity
+    command.ctx.kv = AlabamaKv(
+        command.ctx.temp_folder,
+        backend=command.ctx.kv_backend,
+        flush_interval=command.ctx.kv_flush_interval,
+        record_writes=True,
+    )
+    try:
+        result = command.run()
+        if result is None or result[1] is None:
+            return result
+        start = time.time()
+        try:
+            sent = upload_result(chunk.chunk_path, upload)
+        except ChunkAlreadyUploaded:
+            print(f"Chunk {chunk.chunk_index}: another worker delivered it first")
+            return None
+        print(
+            f"Chunk {chunk.chunk_index}: uploaded {sent} bytes in {time.time() - start:.1f}s"
+        )
+        # some steps key by the chunk's path, e.g. grain_synth, the coordinator knows it by its own path
+        kv_entries = [
+            (
+                bucket,
+                key.replace(chunk.chunk_path, coordinator_chunk_path),
+                value,
+                individual_mode,
+            )
+            for bucket, key, value, individual_mode in command.ctx.kv.written()
+        ]
+        return *result, kv_entries
+    finally:
+        # stops the write-behind thread before its folder goes
+        command.ctx.kv.close()
+        shutil.rmtree(work, ignore_errors=True)
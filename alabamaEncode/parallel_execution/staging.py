@@ -0,0 +1,562 @@
+"""
+Source staging for celery workers, so they don't need the input on shared storage.
+
+The coordinator cuts each chunk's frame range out of the source into a small self-contained segment, a stream copy
+starting at the keyframe before the chunk, or a lossless ffv1 intermediate when a copy can't be cut cleanly, and
+serves it over http. Workers download the segment into a local LRU cache, verify its sha256, and encode from it with
+the chunk's frame indexes rebased onto the segment.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from typing import Dict, List
+
+import requests
+
+from alabamaEncode.core.ffmpeg import Ffmpeg
+from alabamaEncode.core.util.bin_utils import get_binary
+from alabamaEncode.core.util.cli_executor import CliPipeline, run_cli
+from alabamaEncode.core.util.path import PathAlabama
+from alabamaEncode.parallel_execution.coordinator_server import (
+    KEY_HEADER,
+    CoordinatorServer,
+    sha256_file,
+)
+from alabamaEncode.parallel_execution.resources import parse_memory_size
+from alabamaEncode.scene.chunk import ChunkObject
+
+__all__ = [
+    "Segment",
+    "SegmentCutter",
+    "SegmentServer",
+    "SegmentCache",
+    "stage_chunk_source",
+    "release_chunk_source",
+]
+
+STAGING_MODES = ["copy", "lossless"]
+
+
+class Segment:
+    def __init__(self, path="", first_frame_index=0, last_frame_index=0, sha256=""):
+        """
+        :param first_frame_index: where the chunk starts inside the segment
+        :param last_frame_index: where it ends, first_frame_index + the chunk's length
+        """
+        self.path = path
+        self.first_frame_index = first_frame_index
+        self.last_frame_index = last_frame_index
+        self.sha256 = sha256
+
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+
+class SegmentCutter:
+    """
+    Cuts chunks out of their source into `folder`/`chunk_index`.mkv
+
+    "copy": stream copy from the keyframe before the chunk, cheap to cut and about as big as the source's range,
+    the chunk starts some frames into the segment. Falls back to lossless when there is no keyframe close enough
+    before the chunk or the copy doesn't come out with the frames the chunk needs.
+    "lossless": ffv1 of exactly the chunk's frames, works for any source, costs a decode and is several times bigger
+    """
+
+    # how far before a chunk to look for a keyframe to copy from, further is a lot of frames nobody encodes
+    keyframe_search_seconds = 20
+    # concurrent cuts, each one reads the source
+    max_concurrent_cuts = 2
+
+    def __init__(self, folder: str, mode: str = "copy"):
+        if mode not in STAGING_MODES:
+            raise ValueError(
+                f"Unknown staging mode {mode}, expected one of {STAGING_MODES}"
+            )
+        self.folder = folder
+        self.mode = mode
+        os.makedirs(folder, exist_ok=True)
+        self._cut_slots = threading.Semaphore(self.max_concurrent_cuts)
+
+    @staticmethod
+    def segment_id(chunk: ChunkObject, mode: str) -> str:
+        """
+        :return: what a worker caches a segment under, the same for the same source range across sessions
+        """
+        stat = os.stat(chunk.path)
+        key = (
+            f"{os.path.abspath(chunk.path)}|{stat.st_size}|{stat.st_mtime_ns}|"
+            f"{chunk.first_frame_index}|{chunk.last_frame_index}|{chunk.end_override}|{mode}"
+        )
+        return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+    @staticmethod
+    def _frames_needed(chunk: ChunkObject) -> int:
+        if chunk.end_override != -1 and chunk.length > chunk.end_override:
+            return chunk.end_override
+        return chunk.get_frame_count()
+
+    @staticmethod
+    def _start_time(path: str) -> float:
+        out = (
+            run_cli(
+                CliPipeline(
+                    [get_binary("ffprobe"), "-v", "error", "-show_entries"]
+                    + ["format=start_time", "-of", "csv=p=0", path]
+                )
+            )
+            .verify()
+            .get_output()
+            .strip()
+        )
+        try:
+            return float(out)
+        except ValueError:
+            return 0.0
+
+    def _keyframe_before(self, path: str, timestamp: float) -> float | None:
+        """
+        :return: pts of the last video keyframe at or before `timestamp`, None if there is none in the search window
+        """
+        window_start = max(0.0, timestamp - self.keyframe_search_seconds)
+        out = (
+            run_cli(
+                CliPipeline(
+                    [get_binary("ffprobe"), "-v", "error", "-select_streams", "v:0"]
+                    + ["-read_intervals", f"{window_start}%{timestamp + 0.001}"]
+                    + ["-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path]
+                )
+            )
+            .verify()
+            .get_output()
+        )
+        keyframe = None
+        for line in out.splitlines():
+            parts = line.strip().split(",")
+            if len(parts) < 2 or "K" not in parts[1]:
+                continue
+            try:
+                pts = float(parts[0])
+            except ValueError:
+                continue
+            if pts <= timestamp + 1e-6 and (keyframe is None or pts > keyframe):
+                keyframe = pts
+        return keyframe
+
+    @staticmethod
+    def _packet_count(path: str) -> int:
+        return (
+            run_cli(
+                CliPipeline(
+                    [get_binary("ffprobe"), "-v", "error", "-select_streams", "v:0"]
+                    + ["-count_packets", "-show_entries", "stream=nb_read_packets"]
+                    + ["-of", "csv=p=0", path]
+                )
+            )
+            .verify()
+            .get_as_int()
+        )
+
+    def _cut_copy(self, chunk: ChunkObject, path: str) -> Segment | None:
+        start, _ = chunk._get_seek_times()
+        fps = chunk.framerate
+        source_start = self._start_time(chunk.path)
+        target = source_start + start
+        keyframe = self._keyframe_before(chunk.path, target)
+        if keyframe is None:
+            return None
+
+        frames_needed = self._frames_needed(chunk)
+        # half a frame past the keyframe so the seek can't land on the one before it,
+        # copyts keeps the source timestamps so we can check where it really started
+        frames = round((target - keyframe) * fps) + frames_needed + 2
+        run_cli(
+            CliPipeline(
+                [get_binary("ffmpeg"), "-v", "error", "-nostdin", "-y"]
+                + ["-ss", keyframe - source_start + 0.5 / fps, "-i", chunk.path]
+                + ["-map", "0:v:0", "-c", "copy", "-copyts", "-frames:v", frames, path]
+            )
+        ).verify(files=[path])
+
+        # ffmpeg seeks are relative to the file's start time, for the segment as much as for the source
+        first_frame_index = round((target - self._start_time(path)) * fps)
+        if (
+            first_frame_index < 0
+            or self._packet_count(path) < first_frame_index + frames_needed
+        ):
+            return None
+        return Segment(
+            path,
+            first_frame_index,
+            first_frame_index + chunk.get_frame_count(),
+        )
+
+    def _cut_lossless(self, chunk: ChunkObject, path: str) -> Segment:
+        start, _ = chunk._get_seek_times()
+        run_cli(
+            CliPipeline(
+                [get_binary("ffmpeg"), "-v", "error", "-nostdin", "-y"]
+                + ["-ss", start, "-i", chunk.path, "-map", "0:v:0"]
+                + ["-frames:v", self._frames_needed(chunk)]
+                + ["-c:v", "ffv1", "-level", "3", "-g", "1", path]
+            )
+        ).verify(files=[path])
+        return Segment(path, 0, chunk.get_frame_count())
+
+    def cut(self, chunk: ChunkObject) -> Segment:
+        path = os.path.join(self.folder, f"{chunk.chunk_index}.mkv")
+        with self._cut_slots:
+            segment = None
+            if self.mode == "copy":
+                try:
+                    segment = self._cut_copy(chunk, path)
+                except RuntimeError:
+                    segment = None
+            if segment is None:
+                segment = self._cut_lossless(chunk, path)
+        segment.sha256 = sha256_file(path)
+        return segment
+
+
+class SegmentServer:
+    """
+    Serves chunk segments to the workers on the coordinator's server, cut on first request.
+
+    segments = SegmentServer(ctx, server, chunks, "copy")
+    spec["staging"] = segments.job_staging(chunk)
+    segments.release(chunk_index) once the chunk is encoded
+    segments.stop() prints what went over the wire against what the same ranges are in the source
+    """
+
+    def __init__(
+        self,
+        ctx,
+        server: CoordinatorServer,
+        chunks: List[ChunkObject],
+        mode: str = "copy",
+    ):
+        self.ctx = ctx
+        self.server = server
+        self.mode = mode
+        self.folder = os.path.join(ctx.temp_folder, "segments")
+        self.cutter = SegmentCutter(self.folder, mode)
+        self.chunks: Dict[int, ChunkObject] = {c.chunk_index: c for c in chunks}
+        self.segments: Dict[int, Segment] = {}
+        self.locks: Dict[int, threading.Lock] = {
+            i: threading.Lock() for i in self.chunks
+        }
+        # chunk index -> bytes served, more than one download of a chunk is a retry or a cache miss
+        self.served: Dict[int, int] = {}
+        self.downloads = 0
+        self._source_bitrates: Dict[str, float] = {}
+        server.route("segments", self._handle)
+
+    def job_staging(self, chunk: ChunkObject) -> dict:
+        """
+        :return: what a worker needs to fetch the chunk's segment, goes into the job spec
+        """
+        return {
+            "url": f"{self.server.url}/segments/{chunk.chunk_index}",
+            "key": self.server.key,
+            "segment": SegmentCutter.segment_id(chunk, self.mode),
+        }
+
+    def _source_bytes(self, chunk: ChunkObject) -> float:
+        """
+        :return: about what the chunk's range is in the source, average bitrate times duration
+        """
+        if chunk.path not in self._source_bitrates:
+            path = PathAlabama(chunk.path)
+            self._source_bitrates[chunk.path] = os.path.getsize(
+                chunk.path
+            ) / Ffmpeg.get_video_length(path)
+        return self._source_bitrates[chunk.path] * chunk.get_lenght()
+
+    def segment(self, chunk_index: int) -> Segment:
+        with self.locks[chunk_index]:
+            segment = self.segments.get(chunk_index)
+            if segment is None or not os.path.exists(segment.path):
+                start = time.time()
+                segment = self.cutter.cut(self.chunks[chunk_index])
+                self.segments[chunk_index] = segment
+                self.ctx.log(
+                    f"chunk {chunk_index}: cut {segment.size()} byte segment in {time.time() - start:.1f}s, "
+                    f"starts at frame {segment.first_frame_index}",
+                    category="staging",
+                )
+            return segment
+
+    def _served(self, chunk_index: int, sent: int):
+        self.downloads += 1
+        self.served[chunk_index] = self.served.get(chunk_index, 0) + sent
+        self.ctx.log(
+            f"chunk {chunk_index}: served {sent} bytes, "
+            f"source range ~{self._source_bytes(self.chunks[chunk_index]):.0f} bytes",
+            category="staging",
+        )
+
+    def _handle(self, request: BaseHTTPRequestHandler, method: str, chunk_index: int):
+        if method != "GET":
+            request.send_error(405)
+            return
+        if chunk_index not in self.chunks:
+            request.send_error(404)
+            return
+        try:
+            segment = self.segment(chunk_index)
+        except Exception as e:
+            self.ctx.log(
+                f"chunk {chunk_index}: failed to cut segment, {e}",
+                category="staging",
+            )
+            request.send_error(500, str(e))
+            return
+
+        request.send_response(200)
+        request.send_header("Content-Type", "video/x-matroska")
+        request.send_header("Content-Length", str(segment.size()))
+        request.send_header("X-First-Frame-Index", str(segment.first_frame_index))
+        request.send_header("X-Last-Frame-Index", str(segment.last_frame_index))
+        request.send_header("X-Segment-Sha256", segment.sha256)
+        request.end_headers()
+        with open(segment.path, "rb") as f:
+            shutil.copyfileobj(f, request.wfile, 1024**2)
+        self._served(chunk_index, segment.size())
+
+    def release(self, chunk_index: int):
+        """
+        The chunk is encoded, its segment won't be asked for again
+        """
+        with self.locks[chunk_index]:
+            segment = self.segments.pop(chunk_index, None)
+            if segment is not None and os.path.exists(segment.path):
+                os.remove(segment.path)
+
+    def stop(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+        if len(self.served) == 0:
+            return
+        sent = sum(self.served.values())
+        source = sum(self._source_bytes(self.chunks[i]) for i in self.served)
+        print(
+            f"Staging ({self.mode}) sent {sent / 1000**2:.1f}MB for {len(self.served)} chunks in {self.downloads} "
+            f"downloads, avg {sent / len(self.served) / 1000**2:.2f}MB per chunk, "
+            f"the same ranges are ~{source / len(self.served) / 1000**2:.2f}MB in the source"
+        )
+
+
+class SegmentCache:
+    """
+    Worker side segment cache, evicts the least recently used segments past `max_size` bytes.
+    Configured from the environment like the rest of the worker, SEGMENT_CACHE_DIR and SEGMENT_CACHE_SIZE (e.g. 20G)
+
+    Every pool process of the worker shares the folder, so a job marks the segment it encodes from with an
+    `<id>.<pid>.<thread>.inuse` file until release(), eviction leaves marked segments alone.
+    Markers of processes that died are dropped when eviction comes across them.
+    """
+
+    def __init__(self, folder: str = None, max_size: int = None):
+        self.folder = folder or os.getenv("SEGMENT_CACHE_DIR", "/tmp/celery/segments/")
+        self.max_size = (
+            max_size
+            if max_size is not None
+            else parse_memory_size(os.getenv("SEGMENT_CACHE_SIZE", "20G"))
+        )
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _paths(self, segment_id: str):
+        base = os.path.join(self.folder, segment_id)
+        return base + ".mkv", base + ".json"
+
+    def _marker(self, segment_id: str) -> str:
+        return os.path.join(
+            self.folder, f"{segment_id}.{os.getpid()}.{threading.get_ident()}.inuse"
+        )
+
+    def _remove(self, segment_id: str):
+        for p in self._paths(segment_id):
+            if os.path.exists(p):
+                os.remove(p)
+
+    def _cached(self, segment_id: str) -> Segment | None:
+        """
+        :return: the cached segment, None if it isn't cached or the file doesn't match what was downloaded
+        """
+        path, meta_path = self._paths(segment_id)
+        if not os.path.exists(path) or not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            size = meta.pop("size", -1)
+            segment = Segment(**meta)
+            intact = (
+                os.path.getsize(path) == size and sha256_file(path) == segment.sha256
+            )
+        except (OSError, ValueError, TypeError):
+            intact = False
+        if not intact:
+            print(f"Cached segment {segment_id} is damaged, fetching it again")
+            self._remove(segment_id)
+            return None
+        os.utime(path)
+        return segment
+
+    def _download(self, staging: dict) -> Segment:
+        path, meta_path = self._paths(staging["segment"])
+        part = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        digest = hashlib.sha256()
+        try:
+            with requests.get(
+                staging["url"],
+                headers={KEY_HEADER: staging["key"]},
+                stream=True,
+                # the coordinator may have to cut the segment first
+                timeout=(10, 600),
+            ) as r:
+                r.raise_for_status()
+                with open(part, "wb") as f:
+                    for block in r.iter_content(1024**2):
+                        digest.update(block)
+                        f.write(block)
+                segment = Segment(
+                    path,
+                    int(r.headers["X-First-Frame-Index"]),
+                    int(r.headers["X-Last-Frame-Index"]),
+                    r.headers["X-Segment-Sha256"],
+                )
+            if digest.hexdigest() != segment.sha256:
+                raise RuntimeError(
+                    f"Segment {staging['url']} failed its checksum, {digest.hexdigest()} != {segment.sha256}"
+                )
+            os.replace(part, path)
+
+            # the other pool processes read the meta without a lock, so it appears whole or not at all
+            with open(part, "w") as f:
+                json.dump({**segment.__dict__, "size": os.path.getsize(path)}, f)
+            os.replace(part, meta_path)
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+        return segment
+
+    def _in_use(self, names: List[str]) -> set:
+        """
+        :param names: the folder's listing
+        :return: ids of the segments some live job has marked
+        """
+        in_use = set()
+        for name in names:
+            if not name.endswith(".inuse"):
+                continue
+            segment_id, pid = name.split(".")[:2]
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                # the job's process died without releasing it
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    pass
+                continue
+            except (PermissionError, ValueError):
+                pass
+            in_use.add(segment_id)
+        return in_use
+
+    def _evict(self):
+        if self.max_size < 0:
+            return
+        names = os.listdir(self.folder)
+        in_use = self._in_use(names)
+        entries = []
+        for name in names:
+            if not name.endswith(".mkv"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name.removesuffix(".mkv")))
+        total = sum(size for _, size, _ in entries)
+        for _, size, segment_id in sorted(entries):
+            if total <= self.max_size:
+                break
+            if segment_id in in_use:
+                continue
+            self._remove(segment_id)
+            total -= size
+
+    def get(self, staging: dict, retries: int = 2) -> (Segment, int):
+        """
+        Marks the segment in use, release() it once the job is done with it
+        :param staging: the job spec's staging entry, see SegmentServer.job_staging
+        :return: the local segment, and the bytes downloaded for it, 0 on a cache hit
+        """
+        # marked before looking, so another process can't evict it in between
+        open(self._marker(staging["segment"]), "w").close()
+        try:
+            segment = self._cached(staging["segment"])
+            if segment is not None:
+                return segment, 0
+
+            for attempt in range(retries + 1):
+                try:
+                    segment = self._download(staging)
+                    break
+                except (requests.RequestException, RuntimeError):
+                    if attempt == retries:
+                        raise
+                    time.sleep(2**attempt)
+        except BaseException:
+            self.release(staging["segment"])
+            raise
+        self._evict()
+        return segment, os.path.getsize(segment.path)
+
+    def release(self, segment_id: str):
+        """
+        The job is done with the segment, it can be evicted again
+        """
+        try:
+            os.remove(self._marker(segment_id))
+        except FileNotFoundError:
+            pass
+
+
+_cache = None
+
+
+def stage_chunk_source(chunk: ChunkObject, staging: dict) -> int:
+    """
+    Points the chunk at a locally cached segment of its source, frame indexes rebased onto the segment,
+    the segment stays in the cache until release_chunk_source
+    :param staging: the job spec's staging entry
+    :return: bytes downloaded, 0 if the segment was cached
+    """
+    global _cache
+    if _cache is None:
+        _cache = SegmentCache()
+    segment, fetched = _cache.get(staging)
+
+    chunk.path = segment.path
+    chunk.first_frame_index = segment.first_frame_index
+    chunk.last_frame_index = segment.last_frame_index
+    if fetched > 0:
+        print(f"Chunk {chunk.chunk_index}: fetched {fetched} byte source segment")
+    else:
+        print(f"Chunk {chunk.chunk_index}: source segment cached")
+    return fetched
+
+
+def release_chunk_source(staging: dict):
+    """
+    Lets the cache evict the segment stage_chunk_source marked, once the chunk is encoded
+    """
+    if _cache is not None:
+        _cache.release(staging["segment"])
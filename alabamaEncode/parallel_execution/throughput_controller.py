@@ -0,0 +1,229 @@
+import time
+
+
+class ThroughputController:
+    """
+    Picks the number of parallel jobs that maximises frames/s across all jobs, by hill climbing on the jobs limit.
+
+    Throughput is measured over fixed windows. After every move the controller waits `settle_windows` windows
+    (jobs need time to start or drain) before it trusts a measurement. It then compares the new limit against
+    the one it came from:
+    - better by more than `hysteresis`, keep moving the same way, doubling the step each time (up to `max_step`)
+    - worse by more than `hysteresis`, go back and try the other direction, with the step reset
+    - anything in between, hold
+    While holding it probes a neighbour, alternating sides, because the best limit drifts with content.
+    Steps start at `probe_share` of the current limit, one job more or less out of 60 is lost in the noise.
+    A probe that doesn't find anything better halves the probe step, down to one job, after that it doubles the
+    windows between probes, from `probe_after` up to `max_probe_after`. So once the limit has settled it mostly
+    stays put, a better limit resets both.
+    Lowering the limit only takes effect as jobs finish, with per-job counts it keeps settling until they have.
+
+    Total frames/s swings with the mix of chunks running, an easy chunk encodes several times faster than a hard
+    one, by more than the hysteresis. So with per-job frame counts a move is judged on the jobs that ran through the
+    window before and the one after it: how much those same jobs sped up or slowed down, times how many jobs ran.
+    Without them (or too few jobs in common) it compares the smoothed totals per limit.
+
+    controller.frames_encoded(n, {job: frames})  # from the progress sampling, every running job, even at 0
+    jobs_limit = controller.update()  # periodically, cheap if the window hasn't elapsed
+    """
+
+    # jobs that ran through both windows needed to judge a move on them
+    min_paired_jobs = 2
+    # windows to wait at most for the running jobs to drain down to a lowered limit
+    max_drain_windows = 20
+
+    def __init__(
+        self,
+        start_limit: int,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        window: float = 15,
+        hysteresis: float = 0.03,
+        probe_after: int = 6,
+        max_probe_after: int = 64,
+        settle_windows: int = 1,
+        smoothing: float = 0.5,
+        max_step: int = None,
+        probe_share: float = 0.125,
+        now: float = None,
+    ):
+        """
+        :param window: seconds of throughput per measurement
+        :param hysteresis: relative throughput change that counts as a difference, 0.03 = 3%
+        :param max_probe_after: longest wait between probes, in windows, once probes stopped finding anything
+        :param smoothing: weight of a new measurement in a limit's score
+        :param max_step: biggest jump of the limit in one move, defaults to an eighth of max_limit
+        :param probe_share: size of a fresh step relative to the current limit
+        :param now: start time, defaults to time.monotonic(), the simulator passes its own clock
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = max(min_limit, min(int(start_limit), max_limit))
+        self.window = window
+        self.hysteresis = hysteresis
+        self.probe_after = probe_after
+        self.max_probe_after = max(probe_after, max_probe_after)
+        # windows between probes right now, grows while probes don't pay off
+        self.probe_interval = probe_after
+        # shrinks the probe steps while probes don't pay off
+        self.probe_scale = 1.0
+        self.settle_windows = settle_windows
+        self.smoothing = smoothing
+        self.max_step = max_step if max_step is not None else max(1, max_limit // 8)
+        self.probe_share = probe_share
+
+        self.scores: dict[int, float] = {}
+        self.came_from: int | None = None
+        # probes flip the direction before moving, so the first one goes up
+        self.direction = -1
+        self.step = self._fresh_step()
+        # nothing is known at the start, so probe right after the first measurement
+        self.holds = probe_after
+        self.settling = settle_windows
+        self.drain_windows = 0
+
+        self.frames = 0.0
+        self.window_start = time.monotonic() if now is None else now
+        self.last_throughput = -1.0
+
+        # per-job counts of the window being measured
+        self.samples = 0
+        self.job_frames: dict = {}
+        self.job_samples: dict = {}
+        # frames/s of the jobs that ran through the last window, and how many jobs ran on average
+        self.last_rates: dict = {}
+        self.last_jobs = 0.0
+        # the same, for the last window before the latest move
+        self.rates_before: dict = {}
+        self.jobs_before = 0.0
+
+    def frames_encoded(self, frames: float = 1, jobs: dict = None):
+        """
+        :param jobs: job -> frames encoded since the last call, for every running job
+        """
+        self.frames += frames
+        if jobs is None:
+            return
+        self.samples += 1
+        for job, n in jobs.items():
+            self.job_frames[job] = self.job_frames.get(job, 0) + n
+            self.job_samples[job] = self.job_samples.get(job, 0) + 1
+
+    def update(self, now: float = None) -> int:
+        """
+        :return: the jobs limit to use from now on
+        """
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.window_start
+        if elapsed < self.window:
+            return self.limit
+
+        throughput = self.frames / elapsed
+        self.frames = 0.0
+        self.window_start = now
+        self.last_throughput = throughput
+        self.last_rates = {
+            job: n / elapsed
+            for job, n in self.job_frames.items()
+            if self.job_samples[job] == self.samples
+        }
+        self.last_jobs = (
+            sum(self.job_samples.values()) / self.samples if self.samples > 0 else 0
+        )
+        self.samples = 0
+        self.job_frames, self.job_samples = {}, {}
+
+        if self.settling > 0:
+            self.settling -= 1
+            return self.limit
+        if (
+            self.last_jobs > self.limit + 0.5
+            and self.drain_windows < self.max_drain_windows
+        ):
+            # still more jobs running than the new limit allows, nothing to measure yet
+            self.drain_windows += 1
+            return self.limit
+        self.drain_windows = 0
+
+        old = self.scores.get(self.limit)
+        self.scores[self.limit] = (
+            throughput
+            if old is None
+            else old * (1 - self.smoothing) + throughput * self.smoothing
+        )
+        return self._decide()
+
+    def _decide(self) -> int:
+        here = self.scores[self.limit]
+        came_from, self.came_from = self.came_from, None
+
+        if came_from is not None:
+            gain = self._gain(came_from)
+            if gain < 1 - self.hysteresis:
+                # that step hurt, undo it, the next probe flips the direction so it looks on the other side
+                self.direction = 1 if self.limit > came_from else -1
+                self.step = self._fresh_step()
+                self._back_off()
+                return self._move_to(came_from, judge=False)
+            if gain > 1 + self.hysteresis:
+                self.probe_interval = self.probe_after
+                self.probe_scale = 1.0
+                self.direction = 1 if self.limit > came_from else -1
+                candidate = self.limit + self.direction * self.step
+                self.step = min(self.step * 2, self.max_step)
+                known = self.scores.get(candidate)
+                if known is None or known >= here * (1 - self.hysteresis):
+                    return self._move_to(candidate)
+            else:
+                self._back_off()
+                if self.limit > came_from:
+                    # no real difference, the smaller limit is cheaper on memory
+                    self.step = self._fresh_step()
+                    return self._move_to(came_from, judge=False)
+
+        self.holds += 1
+        if self.holds >= self.probe_interval:
+            # flip first, so consecutive probes look on both sides
+            self.direction = -self.direction
+            self.step = self._fresh_step()
+            return self._move_to(self.limit + self.direction * self.step)
+        return self.limit
+
+    def _gain(self, came_from: int) -> float:
+        """
+        :return: throughput at the current limit relative to `came_from`
+        """
+        common = [job for job in self.last_rates if job in self.rates_before]
+        before = sum(self.rates_before[job] for job in common)
+        if len(common) >= self.min_paired_jobs and before > 0 and self.jobs_before > 0:
+            # only contention changed for these, the chunk mix is the same on both sides
+            speed = sum(self.last_rates[job] for job in common) / before
+            return speed * self.last_jobs / self.jobs_before
+        there = self.scores.get(came_from, self.scores[self.limit])
+        return self.scores[self.limit] / there if there > 0 else 1.0
+
+    def _back_off(self):
+        if self._fresh_step() > 1:
+            self.probe_scale /= 2
+        else:
+            self.probe_interval = min(self.probe_interval * 2, self.max_probe_after)
+
+    def _fresh_step(self) -> int:
+        return max(
+            1,
+            min(round(self.limit * self.probe_share * self.probe_scale), self.max_step),
+        )
+
+    def _move_to(self, limit: int, judge: bool = True) -> int:
+        """
+        :param judge: compare the new limit against this one after settling, not for going back to a known limit
+        """
+        limit = max(self.min_limit, min(limit, self.max_limit))
+        self.holds = 0
+        if limit != self.limit:
+            if judge:
+                self.came_from = self.limit
+                self.rates_before, self.jobs_before = self.last_rates, self.last_jobs
+            self.limit = limit
+            self.settling = self.settle_windows
+        return self.limit
@@ -0,0 +1,123 @@
+"""
+Deterministic simulator for the local job scheduler, so jobs-limit strategies like ThroughputController can be
+tuned and checked without encoding anything.
+
+The machine model: `cores` cores, every job wants up to `job_threads` cores of cpu. Until the cores are
+oversubscribed each job runs at full speed. Past that the cores are shared, and contention (cache thrashing,
+context switches, memory bandwidth) eats `contention` of the capacity per 100% oversubscription.
+So throughput climbs with the jobs limit, flattens, and then drops, which is what the controller has to find.
+"""
+
+import json
+import random
+from collections import deque
+from typing import Callable, List, Tuple
+
+
+class SimJob:
+    def __init__(self, frames: int, work: float):
+        """
+        :param frames: frames in the chunk
+        :param work: core-seconds the chunk takes to encode
+        """
+        self.frames = frames
+        self.work = work
+        self.done_work = 0.0
+
+
+def synthetic_jobs(
+    count=1000, seed=0, mean_frames=200, seconds_per_frame=1.0
+) -> List[SimJob]:
+    """
+    Chunks of random length and complexity, same seed same jobs
+    """
+    rng = random.Random(seed)
+    jobs = []
+    for _ in range(count):
+        frames = max(10, int(rng.gauss(mean_frames, mean_frames / 3)))
+        complexity = rng.lognormvariate(0, 0.4)
+        jobs.append(SimJob(frames, frames * seconds_per_frame * complexity))
+    return jobs
+
+
+def jobs_from_chunks_log(path: str, job_threads: float = 1) -> List[SimJob]:
+    """
+    Replay a recorded encode, `chunks.log` in the temp folder has a json line per finished chunk
+    :param job_threads: the cores a job had when it was recorded, turns wall time into core-seconds
+    """
+    jobs = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line == "":
+                continue
+            stats = json.loads(line)
+            frames = stats["length_frames"]
+            seconds = (
+                frames / stats["total_fps"]
+                if stats.get("total_fps", -1) > 0
+                else stats["time_encoding"]
+            )
+            if frames <= 0 or seconds <= 0:
+                continue
+            jobs.append(SimJob(frames, seconds * job_threads))
+    return jobs
+
+
+def simulate(
+    jobs: List[SimJob],
+    jobs_limit: Callable[[float, float, dict], int],
+    cores=16,
+    job_threads=1.0,
+    contention=0.5,
+    step=1.0,
+) -> Tuple[float, List[Tuple[float, int]]]:
+    """
+    Run the jobs in order, like execute_commands does
+    :param jobs_limit: called every step with (now, frames encoded during the step, job -> its frames during
+    the step), returns the jobs limit, e.g. a fixed number or a ThroughputController
+    :return: makespan in seconds, and the (time, jobs limit) history
+    """
+    queue = deque(SimJob(j.frames, j.work) for j in jobs)
+    running: List[SimJob] = []
+    now, limit, history = 0.0, jobs_limit(0.0, 0, {}), []
+
+    while queue or running:
+        while len(running) < limit and queue:
+            running.append(queue.popleft())
+
+        wanted = len(running) * job_threads
+        oversubscription = max(0.0, wanted / cores - 1)
+        capacity = cores / (1 + contention * oversubscription)
+        per_job = min(job_threads, capacity / len(running))
+
+        frames = 0.0
+        job_frames = {}
+        for job in list(running):
+            progress = min(per_job * step, job.work - job.done_work)
+            job.done_work += progress
+            job_frames[job] = job.frames * progress / job.work
+            frames += job_frames[job]
+            if job.done_work >= job.work - 1e-9:
+                running.remove(job)
+
+        now += step
+        # once nothing is left to start the limit doesn't matter, and the tail would only confuse a controller
+        if queue:
+            limit = jobs_limit(now, frames, job_frames)
+        history.append((now, limit))
+
+    return now, history
+
+
+def controller_limit(controller, per_job=True) -> Callable[[float, float, dict], int]:
+    """
+    Adapts a ThroughputController to simulate's jobs_limit callback
+    :param per_job: feed it per-job frames, like execute_commands does, False for only the total
+    """
+
+    def limit(now, frames, job_frames):
+        controller.frames_encoded(frames, job_frames if per_job else None)
+        return controller.update(now)
+
+    return limit
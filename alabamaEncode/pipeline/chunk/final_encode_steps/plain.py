@@ -57,5 +57,5 @@ class PlainFinalEncode(FinalEncodeStep):
         return stats
 
     def dry_run(self, enc: Encoder, chunk: ChunkObject) -> str:
-        joined = " && ".join(enc.get_encode_commands())
+        joined = " && ".join(str(c) for c in enc.get_encode_commands())
         return joined
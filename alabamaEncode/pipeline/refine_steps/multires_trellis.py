@@ -52,6 +52,25 @@ class MutliResTrellis(RefineStep):
 
         fps = sequence.chunks[0].framerate
 
+        # every candidate gets looked up once per vmaf target, fetch them all in one go
+        candidate_keys = {
+            (chunk.chunk_index, res): [
+                f"{chunk.chunk_index}_{res}_{crf}" for crf in crf_range
+            ]
+            for chunk in sequence.chunks
+            for res in resolutions
+        }
+        multi_res_candidates = ctx.get_kv().get_many(
+            "multi_res_candidates",
+            [key for keys in candidate_keys.values() for key in keys],
+        )
+        candidates_by_chunk = {
+            chunk_res: [
+                multi_res_candidates[key] for key in keys if key in multi_res_candidates
+            ]
+            for chunk_res, keys in candidate_keys.items()
+        }
+
         trellis_paths = {}
         for res in resolutions:
             for vmaf_target in vmafs:
@@ -59,13 +78,7 @@ class MutliResTrellis(RefineStep):
                 print(f"Calculating trellis for res: {res} vmaf_target: {vmaf_target}")
                 for chunk in sequence.chunks:
                     all_crfs = []
-                    for crf in crf_range:
-                        data = ctx.get_kv().get(
-                            "multi_res_candidates",
-                            f"{chunk.chunk_index}_{res}_{crf}",
-                        )
-                        if data is None:
-                            continue
+                    for data in candidates_by_chunk.get((chunk.chunk_index, res), []):
                         data = {
                             "vmaf": data["vmaf"],
                             "crf": data["crf"],
@@ -177,6 +190,7 @@ class MutliResTrellis(RefineStep):
         #     ],
         # }
 
+        trellis = {}
         for path in final_paths:
             obj = {"res": path["res"], "chunks": []}
 
@@ -188,10 +202,8 @@ class MutliResTrellis(RefineStep):
                     }
                 )
 
-            ctx.get_kv().set(
-                "multires_trellis",
-                f"{path['vmaf_target']}",
-                obj,
-            )
+            trellis[f"{path['vmaf_target']}"] = obj
 
-        ctx.get_kv().set("multires_final_paths", "final_paths", final_paths)
+        with ctx.get_kv().batch():
+            ctx.get_kv().set_many("multires_trellis", trellis)
+            ctx.get_kv().set("multires_final_paths", "final_paths", final_paths)
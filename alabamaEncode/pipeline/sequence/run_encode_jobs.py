@@ -21,25 +21,17 @@ async def run_encode_jobs(ctx):
             print(
                 f"Starting encoding of {len(ctx.chunk_jobs)} out of {len(ctx.chunk_sequence.chunks)} scenes"
             )
-            saved_progress = ctx.get_kv().get_global("pbar_progress")
             pbar = tqdm(
-                total=sum([c.chunk.length for c in ctx.chunk_jobs]),
+                total=sum([c.chunk.length for c in ctx.chunk_jobs])
+                + ctx.last_session_encoded_frames,
                 desc="Encoding",
                 unit="frame",
                 dynamic_ncols=True,
                 unit_scale=True,
                 smoothing=0,
-                initial=saved_progress if saved_progress is not None else 0,
+                initial=ctx.last_session_encoded_frames,
             )
 
-            saved_total = ctx.get_kv().get_global("pbar_total")
-            if saved_total is not None:
-                pbar.total = saved_total
-
-            saved_estimation = ctx.get_kv().get_global("pbar_estimation")
-            if saved_estimation is not None:
-                pbar.set_postfix(estimation=saved_estimation)
-
             pbar.refresh()
 
             def update_proc_done(num_finished_scenes):
@@ -56,6 +48,9 @@ async def run_encode_jobs(ctx):
                 await asyncio.create_task(
                     execute_commands(
                         use_celery=ctx.use_celery,
+                        staging=ctx.celery_staging,
+                        celery_port=ctx.celery_port,
+                        speculate=ctx.celery_speculation,
                         command_objects=ctx.chunk_jobs,
                         multiprocess_workers=ctx.multiprocess_workers,
                         pin_to_cores=ctx.pin_to_cores,
@@ -66,6 +61,11 @@ async def run_encode_jobs(ctx):
                         ),
                         throughput_scaling=ctx.throughput_scaling,
                         pbar=pbar,
+                        executor_type=ctx.executor,
+                        max_memory=ctx.max_memory,
+                        rebalance_tail_threads=ctx.rebalance_tail_threads,
+                        two_stage=ctx.two_stage,
+                        analysis_workers=ctx.analysis_workers,
                     )
                 )
             except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
@@ -75,12 +75,7 @@ async def run_encode_jobs(ctx):
                 for task in asyncio.all_tasks():
                     task.cancel()
 
-                # save pbar progress in kv
-                kv = ctx.get_kv()
-                kv.set_global("pbar_progress", pbar.n)
-                if kv.get_global("pbar_total") is None:
-                    kv.set_global("pbar_total", pbar.total)
-                kv.set_global("pbar_estimation", pbar.postfix.get("estimation"))
+                # the eta/size forecast saved itself in the kv, the next session picks it up
                 quit()
 
         for refine_step in get_refine_steps(ctx):
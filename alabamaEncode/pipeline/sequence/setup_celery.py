@@ -1,19 +1,11 @@
 from alabamaEncode.parallel_execution.celery_app import app
+from alabamaEncode.parallel_execution.coordinator_server import get_lan_ip
 
 
 def setup_celery(ctx):
     if ctx.use_celery:
         print("Using celery")
-        import socket
-
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        try:
-            # doesn't even have to be reachable
-            s.connect(("10.255.255.255", 1))
-            host_address = s.getsockname()[0]
-        finally:
-            s.close()
-        print(f"Got lan ip: {host_address}")
+        print(f"Got lan ip: {get_lan_ip()}")
 
         num_workers = app.control.inspect().active_queues()
         if num_workers is None:
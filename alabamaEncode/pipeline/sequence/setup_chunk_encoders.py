@@ -4,9 +4,12 @@ import random
 from alabamaEncode.core.chunk_encoder import ChunkEncoder
 from alabamaEncode.core.util.opinionated_vmaf import get_vmaf_list
 from alabamaEncode.scene.annel import annealing
+from alabamaEncode.scene.chunk_cost import ChunkCostModel, lpt_order, report_makespan
 
 
 def setup_chunk_encoders(ctx):
+    kv = ctx.get_kv().snapshot()
+
     def is_chunk_done(_chunk):
         if ctx.multi_res_pipeline:
             enc = ctx.get_encoder()
@@ -22,7 +25,7 @@ def setup_chunk_encoders(ctx):
 
             return True
         else:
-            return _chunk.is_done(kv=ctx.get_kv())
+            return _chunk.is_done(kv=kv)
 
     for chunk in ctx.chunk_sequence.chunks:
         if not is_chunk_done(chunk):
@@ -50,6 +53,18 @@ def setup_chunk_encoders(ctx):
                 ctx.chunk_jobs.sort(key=lambda x: x.chunk.length, reverse=True)
             case "even":
                 ctx.chunk_jobs = annealing(ctx.chunk_jobs, 1000)
+            case "lpt":
+                model = ChunkCostModel(ctx)
+                ctx.chunk_jobs = lpt_order(ctx.chunk_jobs, model)
+                # celery workers are only known once the jobs are dispatched, locally auto scaling settles
+                # around the core count
+                if not ctx.use_celery:
+                    workers = (
+                        ctx.multiprocess_workers
+                        if ctx.multiprocess_workers > 0
+                        else os.cpu_count()
+                    )
+                    report_makespan(ctx.chunk_jobs, model, workers)
             case "reverse":
                 ctx.chunk_jobs.reverse()
             case "sequential":
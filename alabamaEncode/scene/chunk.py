@@ -1,9 +1,12 @@
 import os.path
+from typing import List, Tuple
 
 from tqdm import tqdm
 
 from alabamaEncode.core.ffmpeg import Ffmpeg
-from alabamaEncode.core.util.kv import AlabamaKv
+from alabamaEncode.core.util.bin_utils import get_binary
+from alabamaEncode.core.util.ivf import is_ivf, count_ivf_frames, IvfFormatError
+from alabamaEncode.core.util.kv import AlabamaKv, KvSnapshot
 from alabamaEncode.core.util.path import PathAlabama
 
 
@@ -139,6 +142,25 @@ class ChunkObject:
         if self.first_frame_index == -1 or self.last_frame_index == -1:
             return f' -i "{self.path}" '
 
+        start_time, duration = self._get_seek_times()
+
+        return f' -ss {str(start_time)} -i "{self.path}" -t {str(duration)} '
+
+    def get_ss_ffmpeg_argv(self) -> List[str]:
+        """
+        :return: the argv version of get_ss_ffmpeg_command_pair, ['-ss', '12', '-i', 'clip.mp4', '-t', '2']
+        """
+        if self.first_frame_index == -1 or self.last_frame_index == -1:
+            return ["-i", self.path]
+
+        start_time, duration = self._get_seek_times()
+
+        return ["-ss", str(start_time), "-i", self.path, "-t", str(duration)]
+
+    def _get_seek_times(self) -> Tuple[float, float]:
+        """
+        :return: start time and duration of the chunk in seconds
+        """
         # get framerate
         if self.framerate == -1:
             self.framerate = Ffmpeg.get_video_frame_rate(PathAlabama(self.path))
@@ -152,8 +174,7 @@ class ChunkObject:
         end_thingy = float(local_overriden_end) / self.framerate
         start_time = float(self.first_frame_index) / self.framerate
         duration = end_thingy - start_time
-
-        return f' -ss {str(start_time)} -i "{self.path}" -t {str(duration)} '
+        return start_time, duration
 
     def get_width(self) -> int:
         if self.width == -1:
@@ -188,6 +209,42 @@ class ChunkObject:
 
         return end_command
 
+    def create_chunk_ffmpeg_pipe_argv(
+        self, video_filters="", bit_depth=10
+    ) -> List[str]:
+        """
+        argv version of create_chunk_ffmpeg_pipe_command, for use in a CliPipeline
+        :param video_filters: ffmpeg vf filters, e.g., scaling tonemapping
+        :param bit_depth: bit depth of the output stream 8 or 10
+        :return: ffmpeg argv that pipes a y4m stream into stdout
+        """
+        argv = [
+            get_binary("ffmpeg"),
+            "-threads",
+            "1",
+            "-v",
+            "fatal",
+            "-nostdin",
+            "-hwaccel",
+            "auto",
+            *self.get_ss_ffmpeg_argv(),
+            "-pix_fmt",
+            "yuv420p" if bit_depth == 8 else "yuv420p10le",
+            "-an",
+            "-sn",
+            "-strict",
+            "-1",
+        ]
+
+        if video_filters is not None and video_filters != "":
+            # no shell in between, so drop the flag and quoting that the string version tolerates
+            if video_filters.startswith("-vf"):
+                video_filters = video_filters[len("-vf") :].strip()
+            argv += ["-vf", video_filters.strip("\"'")]
+
+        argv += ["-f", "yuv4mpegpipe", "-"]
+        return argv
+
     def log_prefix(self):
         return f"[{self.chunk_index}] "
 
@@ -202,11 +259,15 @@ class ChunkObject:
             return True
 
         try:
-            path = PathAlabama(self.chunk_path)
-            if Ffmpeg.check_for_invalid(path):
-                raise FfmpegDecodeFailException()
-
-            actual_frame_count = Ffmpeg.get_frame_count(path)
+            if is_ivf(self.chunk_path):
+                # walking the ivf frame headers also catches truncated files, no need for ffmpeg
+                actual_frame_count = count_ivf_frames(self.chunk_path)
+            else:
+                path = PathAlabama(self.chunk_path)
+                if Ffmpeg.check_for_invalid(path):
+                    raise FfmpegDecodeFailException()
+
+                actual_frame_count = Ffmpeg.get_frame_count(path)
             expected_frame_count = self.last_frame_index - self.first_frame_index
 
             if actual_frame_count != expected_frame_count:
@@ -224,8 +285,8 @@ class ChunkObject:
                         expected_frame_count=expected_frame_count,
                     )
         except Exception as e:
-            if isinstance(e, WrongFrameCountError) or isinstance(
-                e, FfmpegDecodeFailException
+            if isinstance(
+                e, (WrongFrameCountError, FfmpegDecodeFailException, IvfFormatError)
             ):
                 if not quiet:
                     tqdm.write(
@@ -236,7 +297,12 @@ class ChunkObject:
         self.chunk_done = True
         return False
 
-    def is_done(self, quiet=False, kv: AlabamaKv = None, length_of_sequence=-1) -> bool:
+    def is_done(
+        self,
+        quiet=False,
+        kv: AlabamaKv | KvSnapshot = None,
+        length_of_sequence=-1,
+    ) -> bool:
         """
         checks if the chunk is done
         :param quiet log what's wrong with the chunk to stdout
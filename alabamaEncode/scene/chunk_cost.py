@@ -0,0 +1,143 @@
+import json
+import os
+import statistics
+from typing import List
+
+from alabamaEncode.core.chunk_encoder import ChunkEncoder
+from alabamaEncode.scene.chunk import ChunkObject
+
+
+class ChunkCostModel:
+    """
+    Estimates how long a chunk takes, analysis chain included, so the scheduler can start the expensive ones first.
+
+    cost = frames * pixels (relative to 1080p) * complexity (relative to the sequence mean) * analysis chain * passes
+    That's in made up units, good enough for ordering. If the temp folder has a chunks.log from an earlier
+    session, the units get calibrated to seconds against how long those chunks really took.
+    """
+
+    # extra work an analysis step adds, as a share of the final encode
+    analysis_step_costs = {
+        "VbrPerChunkOptimised": 0.5,
+        "GrainSynth": 0.15,
+        "NewGrainSynth": 0.15,
+        "EncodeMultiResCandidates": 2.0,
+        "LumaBoost": 0.05,
+    }
+    # one TargetVmaf probe, a faster preset encode plus a vmaf run
+    vmaf_probe_cost = 0.35
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.chain_factor = self._chain_factor()
+        self.passes = max(1, ctx.prototype_encoder.passes)
+
+        complexities = []
+        if ctx.chunk_sequence is not None:
+            complexities = [
+                c.complexity for c in ctx.chunk_sequence.chunks if c.complexity > 0
+            ]
+        self.mean_complexity = statistics.mean(complexities) if complexities else -1
+
+        self.seconds_per_unit = self._calibrate()
+
+    def _chain_factor(self) -> float:
+        factor = 1.0
+        for step in self.ctx.chunk_analyze_chain:
+            name = step.__class__.__name__
+            if name == "TargetVmaf":
+                factor += self.ctx.probe_count * self.vmaf_probe_cost
+            else:
+                factor += self.analysis_step_costs.get(name, 0)
+        return factor
+
+    def units(self, chunk: ChunkObject) -> float:
+        width, height = chunk.width, chunk.height
+        if width <= 0 or height <= 0:
+            width, height = self.ctx.output_width, self.ctx.output_height
+        pixels = width * height / (1920 * 1080) if width > 0 and height > 0 else 1
+
+        complexity = 1.0
+        if chunk.complexity > 0 and self.mean_complexity > 0:
+            complexity = chunk.complexity / self.mean_complexity
+
+        return (
+            chunk.get_frame_count()
+            * pixels
+            * complexity
+            * self.chain_factor
+            * self.passes
+        )
+
+    def _calibrate(self) -> float:
+        """
+        :return: seconds per unit from the chunks.log of earlier sessions, -1 if there is none
+        """
+        log_path = f"{self.ctx.temp_folder}/chunks.log"
+        if self.ctx.chunk_sequence is None or not os.path.exists(log_path):
+            return -1
+        chunks = {c.chunk_index: c for c in self.ctx.chunk_sequence.chunks}
+        ratios = []
+        with open(log_path) as f:
+            for line in f:
+                try:
+                    stats = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                chunk = chunks.get(stats.get("chunk_index"))
+                if chunk is None or stats.get("total_fps", -1) <= 0:
+                    continue
+                seconds = stats["length_frames"] / stats["total_fps"]
+                units = self.units(chunk)
+                if units > 0:
+                    ratios.append(seconds / units)
+        # median, one chunk that sat behind a stalled disk shouldn't skew everything
+        return statistics.median(ratios) if ratios else -1
+
+    def estimate(self, chunk: ChunkObject) -> float:
+        """
+        :return: estimated seconds if calibrated, else units
+        """
+        units = self.units(chunk)
+        return units * self.seconds_per_unit if self.seconds_per_unit > 0 else units
+
+
+def lpt_order(jobs: List[ChunkEncoder], model: ChunkCostModel) -> List[ChunkEncoder]:
+    """
+    Longest processing time first, big chunks start early so the small ones fill the gaps at the end
+    """
+    return sorted(jobs, key=lambda job: model.estimate(job.chunk), reverse=True)
+
+
+def list_schedule_makespan(costs: List[float], workers: int) -> float:
+    """
+    :return: when the last job finishes if `workers` run the jobs in the given order, each taking the next job
+    when it frees up, like execute_commands does
+    """
+    finish_times = [0.0] * max(1, workers)
+    for cost in costs:
+        i = finish_times.index(min(finish_times))
+        finish_times[i] += cost
+    return max(finish_times)
+
+
+def ideal_makespan(costs: List[float], workers: int) -> float:
+    """
+    :return: lower bound on any order's makespan, all work perfectly spread, or the single biggest job
+    """
+    if len(costs) == 0:
+        return 0
+    return max(sum(costs) / max(1, workers), max(costs))
+
+
+def report_makespan(jobs: List[ChunkEncoder], model: ChunkCostModel, workers: int):
+    costs = [model.estimate(job.chunk) for job in jobs]
+    makespan = list_schedule_makespan(costs, workers)
+    ideal = ideal_makespan(costs, workers)
+    if ideal <= 0:
+        return
+    unit = "s" if model.seconds_per_unit > 0 else " units"
+    print(
+        f"Estimated makespan on {workers} workers: {makespan:.0f}{unit}, "
+        f"ideal {ideal:.0f}{unit} (+{(makespan / ideal - 1) * 100:.1f}%)"
+    )
@@ -8,6 +8,12 @@ from tqdm import tqdm
 from alabamaEncode.core.ffmpeg import Ffmpeg
 from alabamaEncode.core.util.bin_utils import get_binary
 from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.ivf import (
+    is_ivf,
+    concat_ivf,
+    count_ivf_frames,
+    IvfFormatError,
+)
 from alabamaEncode.core.util.path import PathAlabama
 
 
@@ -126,17 +132,28 @@ class VideoConcatenator:
 
         concat_vid_ext = ".mkv"
 
-        if Ffmpeg.get_codec(PathAlabama(self.files[0])) == "av1":
+        all_ivf = all(is_ivf(file) for file in self.files)
+        if all_ivf or Ffmpeg.get_codec(PathAlabama(self.files[0])) == "av1":
             concat_vid_ext = ".ivf"
 
         self.vid_output = f"{self.temp_dir}vid{concat_vid_ext}"
         print("Concating Video")
+        if not os.path.exists(self.vid_output) and all_ivf:
+            try:
+                concat_ivf(self.files, self.vid_output)
+            except IvfFormatError as e:
+                print(f"Native ivf concat failed, falling back to ffmpeg: {e}")
         if not os.path.exists(self.vid_output):
             os.system(
                 f'{get_binary("ffmpeg")} -y -stats -v error -f concat '
                 f'-safe 0 -i "{concat_file_path}" -c:v copy -map_metadata -1 -vsync cfr "{self.vid_output}"'
             )
-        if Ffmpeg.check_for_invalid(PathAlabama(self.vid_output)):
+        if is_ivf(self.vid_output):
+            try:
+                count_ivf_frames(self.vid_output)
+            except (IvfFormatError, OSError):
+                raise Exception("Concating chunks failed")
+        elif Ffmpeg.check_for_invalid(PathAlabama(self.vid_output)):
             raise Exception("Concating chunks failed")
 
         os.remove(concat_file_path)
@@ -1,6 +1,8 @@
 import copy
 import os
 import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List
 
 from tqdm.asyncio import tqdm
@@ -106,11 +108,35 @@ class ChunkSequence:
 
         seq_chunks = list(self.chunks)
         total_chunks = len(self.chunks)
+        if kv is not None:
+            # one read of the integrity cache instead of one per chunk
+            kv = kv.snapshot()
         invalid_chunks: List[ChunkObject or None] = []
 
-        for chunk in tqdm(seq_chunks, desc="Checking files", unit="file"):
-            if not chunk.is_done(kv=kv, length_of_sequence=total_chunks):
-                invalid_chunks.append(chunk)
+        def check(_chunk: ChunkObject) -> ChunkObject | None:
+            if not _chunk.is_done(kv=kv, length_of_sequence=total_chunks):
+                return _chunk
+            return None
+
+        # ivf chunks are checked by reading their frame headers, other containers spawn ffmpeg/ffprobe,
+        # both spend most of the time waiting on io, so a thread pool is enough
+        start = time.perf_counter()
+        with ThreadPoolExecutor(
+            max_workers=min(32, (os.cpu_count() or 1) * 2)
+        ) as executor:
+            futures = [executor.submit(check, chunk) for chunk in seq_chunks]
+            for future in tqdm(
+                as_completed(futures),
+                total=len(futures),
+                desc="Checking files",
+                unit="file",
+            ):
+                invalid_chunks.append(future.result())
+        took = time.perf_counter() - start
+        if total_chunks > 0 and took > 0:
+            print(
+                f"Checked {total_chunks} chunks in {took:.2f}s ({total_chunks / took:.1f} chunks/s)"
+            )
 
         del_count = 0
 
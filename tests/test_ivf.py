@@ -0,0 +1,105 @@
+"""
+IVF reading, counting and concatenation on synthetic files
+python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from alabamaEncode.core.util.ivf import (
+    IvfFormatError,
+    IvfReader,
+    IvfWriter,
+    concat_ivf,
+    count_ivf_frames,
+)
+
+
+class TestIvf(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(
+        self, name: str, frames: int, first_timestamp=0, width=640, timebase=(24, 1)
+    ) -> str:
+        """
+        :return: path of an ivf with `frames` frames, frame i's payload is i+1 repeats of its index byte
+        """
+        path = os.path.join(self.folder, name)
+        with IvfWriter(
+            path,
+            fourcc=b"AV01",
+            width=width,
+            height=360,
+            timebase_den=timebase[0],
+            timebase_num=timebase[1],
+        ) as writer:
+            for i in range(frames):
+                writer.write_frame(bytes([i % 256]) * (i + 1), first_timestamp + i)
+        return path
+
+    def test_count_frames(self):
+        self.assertEqual(count_ivf_frames(self.write("a.ivf", 48)), 48)
+        self.assertEqual(count_ivf_frames(self.write("empty.ivf", 0)), 0)
+
+    def test_header_and_frames(self):
+        with IvfReader(self.write("a.ivf", 24)) as ivf:
+            self.assertEqual((ivf.fourcc, ivf.width, ivf.height), (b"AV01", 640, 360))
+            self.assertEqual(ivf.header_frame_count, 24)
+            self.assertEqual(ivf.get_frame(3), b"\x03" * 4)
+            self.assertAlmostEqual(ivf.get_duration(), 1.0)
+            self.assertAlmostEqual(ivf.get_average_bitrate(), sum(range(1, 25)) * 8)
+
+    def test_truncated(self):
+        path = self.write("a.ivf", 10)
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 3)
+        with self.assertRaises(IvfFormatError):
+            count_ivf_frames(path)
+
+    def test_not_an_ivf(self):
+        path = os.path.join(self.folder, "a.ivf")
+        with open(path, "wb") as f:
+            f.write(b"\x1a\x45\xdf\xa3" + b"\0" * 60)
+        with self.assertRaises(IvfFormatError):
+            count_ivf_frames(path)
+
+    def test_concat(self):
+        # chunks come out of the encoder each starting at their own timestamp
+        inputs = [
+            self.write("0.ivf", 10),
+            self.write("1.ivf", 0),
+            self.write("2.ivf", 5, first_timestamp=1000),
+        ]
+        output = os.path.join(self.folder, "out.ivf")
+        self.assertEqual(concat_ivf(inputs, output), 15)
+
+        with IvfReader(output) as ivf:
+            self.assertEqual(ivf.header_frame_count, 15)
+            self.assertEqual(ivf.timestamps, list(range(15)))
+            self.assertEqual(ivf.get_frame(9), b"\x09" * 10)
+            self.assertEqual(ivf.get_frame(10), b"\x00")
+            self.assertEqual(ivf.get_frame(14), b"\x04" * 5)
+
+    def test_concat_refuses_mismatched_chunks(self):
+        output = os.path.join(self.folder, "out.ivf")
+        for other in [
+            self.write("wide.ivf", 5, width=1280),
+            self.write("ntsc.ivf", 5, timebase=(30000, 1001)),
+        ]:
+            with self.subTest(other=other):
+                with self.assertRaises(IvfFormatError):
+                    concat_ivf([self.write("0.ivf", 5), other], output)
+                self.assertFalse(os.path.exists(output))
+
+        with self.assertRaises(IvfFormatError):
+            concat_ivf([], output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Celery job specs, a ChunkEncoder survives the trip through json
+python -m unittest discover tests
+"""
+
+import json
+import unittest
+
+from alabamaEncode.core.chunk_encoder import ChunkEncoder
+from alabamaEncode.core.context import AlabamaContext
+from alabamaEncode.encoder.impl.Svtenc import EncoderSvt
+from alabamaEncode.encoder.rate_dist import EncoderRateDistribution
+from alabamaEncode.parallel_execution.job_spec import (
+    JOB_SPEC_VERSION,
+    build_job_spec,
+    dump_job_spec,
+    job_from_spec,
+)
+from alabamaEncode.pipeline.chunk.analyze_steps.manual_crf import CrfIndexesMap
+from alabamaEncode.pipeline.chunk.analyze_steps.per_scene_grain import GrainSynth
+from alabamaEncode.pipeline.chunk.final_encode_steps.plain import (
+    PlainFinalEncode,
+)
+from alabamaEncode.scene.chunk import ChunkObject
+
+
+def make_command() -> ChunkEncoder:
+    ctx = AlabamaContext()
+    ctx.temp_folder = "/tmp/coordinator/temp/"
+    ctx.vmaf = 93
+    ctx.crf_limits = (18, 40)
+    ctx.prototype_encoder = EncoderSvt()
+    ctx.prototype_encoder.speed = 6
+    ctx.prototype_encoder.crf = 31
+    ctx.prototype_encoder.rate_distribution = EncoderRateDistribution.VBR
+    ctx.chunk_analyze_chain = [GrainSynth(), CrfIndexesMap("20,25,30")]
+    ctx.chunk_encode_class = PlainFinalEncode()
+    chunk = ChunkObject(100, 200, "/videos/in.mkv", 24, chunk_index=3)
+    chunk.chunk_path = "/tmp/coordinator/temp/chunks/3.ivf"
+    command = ChunkEncoder(ctx, chunk)
+    command.threads = 4
+    return command
+
+
+class TestJobSpec(unittest.TestCase):
+    def test_round_trip(self):
+        command = make_command()
+        spec = build_job_spec(command, upload={"url": "http://x/results/3", "key": "k"})
+        self.assertEqual(spec["version"], JOB_SPEC_VERSION)
+
+        rebuilt = job_from_spec(dump_job_spec(spec))
+        self.assertTrue(rebuilt.run_on_celery)
+        self.assertEqual(rebuilt.threads, 4)
+        self.assertEqual(rebuilt.chunk.dict(), command.chunk.dict())
+        self.assertEqual(rebuilt.ctx.vmaf, 93)
+        self.assertEqual(rebuilt.ctx.temp_folder, "/tmp/coordinator/temp/")
+
+        encoder = rebuilt.ctx.prototype_encoder
+        self.assertIsInstance(encoder, EncoderSvt)
+        self.assertEqual((encoder.speed, encoder.crf), (6, 31))
+        self.assertIs(encoder.rate_distribution, EncoderRateDistribution.VBR)
+
+        self.assertEqual(
+            [type(step) for step in rebuilt.ctx.chunk_analyze_chain],
+            [GrainSynth, CrfIndexesMap],
+        )
+        self.assertEqual(
+            vars(rebuilt.ctx.chunk_analyze_chain[1]),
+            vars(command.ctx.chunk_analyze_chain[1]),
+        )
+        self.assertIsInstance(rebuilt.ctx.chunk_encode_class, PlainFinalEncode)
+
+    def test_spec_is_json_without_the_chunk_list(self):
+        command = make_command()
+        command.ctx.chunk_jobs = [command] * 1000
+        text = dump_job_spec(build_job_spec(command))
+        self.assertNotIn("chunk_jobs", json.loads(text)["ctx"])
+        self.assertLess(len(text), 16 * 1024)
+
+    def test_refuses_attributes_it_cant_send(self):
+        command = make_command()
+        command.ctx.prototype_encoder.some_handle = object()
+        with self.assertRaisesRegex(ValueError, "EncoderSvt.some_handle"):
+            build_job_spec(command)
+
+    def test_refuses_other_versions(self):
+        spec = build_job_spec(make_command())
+        spec["version"] = JOB_SPEC_VERSION - 1
+        with self.assertRaises(ValueError):
+            job_from_spec(spec)
+
+    def test_only_loads_own_classes(self):
+        spec = build_job_spec(make_command())
+        spec["final_step"]["class"] = "os:system"
+        with self.assertRaises(ValueError):
+            job_from_spec(spec)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+AlabamaKv backends, json to sqlite import and the write-behind cache
+python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from alabamaEncode.core.util.kv import (
+    AlabamaKv,
+    JsonKvBackend,
+    SqliteKvBackend,
+    WriteBehindKvBackend,
+)
+
+
+class TestKv(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.kvs = []
+
+    def tearDown(self):
+        for kv in self.kvs:
+            kv.close()
+        shutil.rmtree(self.folder)
+
+    def kv(self, subfolder="", **kwargs) -> AlabamaKv:
+        kv = AlabamaKv(os.path.join(self.folder, subfolder), **kwargs)
+        self.kvs.append(kv)
+        return kv
+
+    def test_backends(self):
+        for backend in ["sqlite", "json"]:
+            with self.subTest(backend=backend):
+                kv = self.kv(backend, backend=backend)
+                kv.set("crfs", 1, 30)
+                kv.set_global("output_res", "1920,1080")
+                kv.set("timing", 1, {"chunk": 1.5}, individual_mode=True)
+                self.assertEqual(kv.get("crfs", "1"), 30)
+                self.assertEqual(kv.get_global("output_res"), "1920,1080")
+                self.assertEqual(kv.get("timing", 1), {"chunk": 1.5})
+                self.assertTrue(kv.exists("crfs", 1))
+                self.assertIsNone(kv.get("crfs", 2))
+                self.assertFalse(kv.exists("nothing", 1))
+
+    def test_auto_picks_sqlite_unless_on_a_network_filesystem(self):
+        self.assertIsInstance(self.kv().backend, SqliteKvBackend)
+        with mock.patch(
+            "alabamaEncode.core.util.kv.get_network_filesystem", return_value="nfs4"
+        ):
+            self.assertIsInstance(self.kv().backend, JsonKvBackend)
+            with self.assertRaises(ValueError):
+                AlabamaKv(self.folder, backend="sqlite")
+
+    def test_imports_json_buckets_into_sqlite(self):
+        legacy = self.kv(backend="json")
+        legacy.set("target_vmaf", 0, 28)
+        legacy.set("target_vmaf", 1, 31)
+        legacy.set("chunk_timing", 0, {"chunk": 2.0}, individual_mode=True)
+
+        kv = self.kv(backend="sqlite")
+        self.assertEqual(kv.get_all("target_vmaf"), {"0": 28, "1": 31})
+        self.assertEqual(kv.get("chunk_timing", 0), {"chunk": 2.0})
+
+        # imported once, later json writes don't override the database
+        kv.set("target_vmaf", 1, 33)
+        legacy.set("target_vmaf", 1, 99)
+        self.assertEqual(self.kv(backend="sqlite").get("target_vmaf", 1), 33)
+
+    def test_set_many_get_many_scan_prefix(self):
+        for backend in ["sqlite", "json"]:
+            with self.subTest(backend=backend):
+                kv = self.kv(backend, backend=backend)
+                kv.set_many(
+                    "probes", {f"{c}_{crf}": crf for c in range(3) for crf in [20, 30]}
+                )
+                self.assertEqual(
+                    kv.get_many("probes", ["0_20", "2_30", "9_20"]),
+                    {"0_20": 20, "2_30": 30},
+                )
+                self.assertEqual(
+                    kv.scan_prefix("probes", "1_"), {"1_20": 20, "1_30": 30}
+                )
+
+    def test_batch(self):
+        kv = self.kv(backend="sqlite")
+        with kv.batch():
+            for i in range(100):
+                kv.set("crfs", i, i)
+            with kv.batch():
+                kv.set("crfs", "nested", True)
+        self.assertEqual(len(self.kv(backend="sqlite").get_all("crfs")), 101)
+
+        with self.assertRaises(KeyError):
+            with kv.batch():
+                kv.set("crfs", 0, -1)
+                raise KeyError()
+        self.assertEqual(kv.get("crfs", 0), 0)
+
+    def test_write_behind(self):
+        kv = self.kv(backend="sqlite", flush_interval=3600)
+        self.assertIsInstance(kv.backend, WriteBehindKvBackend)
+        other = self.kv(backend="sqlite")
+
+        value = {"crf": 30}
+        kv.set("crfs", 1, value)
+        # serialised when set, later changes to the object don't leak in
+        value["crf"] = 99
+        self.assertEqual(kv.get("crfs", 1), {"crf": 30})
+        self.assertEqual(kv.get_all("crfs"), {"1": {"crf": 30}})
+        self.assertIsNone(other.get("crfs", 1))
+
+        kv.flush()
+        self.assertEqual(other.get("crfs", 1), {"crf": 30})
+
+        kv.set("crfs", 2, 31)
+        kv.close()
+        self.kvs.remove(kv)
+        self.assertEqual(other.get_all("crfs"), {"1": {"crf": 30}, "2": 31})
+
+    def test_write_behind_flushes_on_its_own(self):
+        kv = self.kv(backend="json", flush_interval=0.05)
+        kv.set("crfs", 1, 30)
+        other = self.kv(backend="json")
+        for _ in range(100):
+            if other.get("crfs", 1) is not None:
+                break
+            kv.backend._stop.wait(0.05)
+        self.assertEqual(other.get("crfs", 1), 30)
+
+    def test_written(self):
+        kv = self.kv(record_writes=True)
+        kv.set("crfs", 1, 30)
+        kv.set("timing", 1, {"chunk": 1.0}, individual_mode=True)
+        kv.set_many("probes", {"1_20": 95.1})
+        kv.set("crfs", 1, 31)
+        self.assertEqual(
+            sorted(kv.written()),
+            [
+                ("crfs", "1", 31, False),
+                ("probes", "1_20", 95.1, False),
+                ("timing", "1", {"chunk": 1.0}, True),
+            ],
+        )
+        with self.assertRaises(RuntimeError):
+            self.kv().written()
+
+
+if __name__ == "__main__":
+    unittest.main()
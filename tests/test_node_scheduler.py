@@ -0,0 +1,142 @@
+"""
+NodeScheduler bookkeeping, driven with made-up times
+python -m unittest discover tests
+"""
+
+import unittest
+
+from alabamaEncode.parallel_execution.node_scheduler import NodeScheduler
+
+# the fast node is ten times the slow one, both by calibration and by what they turn out to do
+NODES = {"fast": {"fps": 40.0, "slots": 1}, "slow": {"fps": 4.0, "slots": 1}}
+
+
+def calibrated(costs: dict, speculate: bool = True) -> NodeScheduler:
+    """
+    :return: a scheduler that saw key 0 take 1s on the fast node and key 1 take 10s on the slow one,
+    both of cost 1
+    """
+    scheduler = NodeScheduler(costs, speculate=speculate)
+    scheduler.update_nodes(NODES)
+    scheduler.started(0, "fast", 0.0)
+    scheduler.finished(0, "fast", 1.0, True)
+    scheduler.started(1, "slow", 0.0)
+    scheduler.finished(1, "slow", 10.0, True)
+    return scheduler
+
+
+class TestNodeScheduler(unittest.TestCase):
+    def test_weights_by_calibration(self):
+        scheduler = NodeScheduler({0: 10.0, 1: 5.0, 2: 1.0})
+        scheduler.update_nodes(NODES)
+        self.assertGreater(scheduler.nodes["fast"].weight, 1)
+        self.assertLess(scheduler.nodes["slow"].weight, 1)
+
+        # before anything finished there's nothing to predict with, the costliest chunk goes to the fast node
+        # and the cheapest to the slow one
+        self.assertEqual(scheduler.assign(0.0), [(0, "fast"), (2, "slow")])
+        self.assertEqual(scheduler.pending, [1])
+        self.assertEqual(scheduler.assign(0.0), [])
+
+    def test_slots(self):
+        scheduler = NodeScheduler({i: 1.0 for i in range(5)})
+        scheduler.update_nodes({"big": {"fps": 10.0, "slots": 3}})
+        self.assertEqual(len(scheduler.assign(0.0)), 3)
+        self.assertEqual(scheduler.nodes["big"].free_slots(), 0)
+
+    def test_holds_the_last_chunk_back_from_a_slow_node(self):
+        scheduler = calibrated({0: 1.0, 1: 1.0, 2: 1.0, 3: 1.0})
+
+        # the fast node is free again in a second and then needs one more for key 3, the slow node would take ten
+        self.assertEqual(scheduler.assign(10.0), [(2, "fast")])
+        self.assertEqual(scheduler.pending, [3])
+
+        scheduler.finished(2, "fast", 11.0, True)
+        self.assertEqual(scheduler.assign(11.0), [(3, "fast")])
+
+    def test_slow_node_gets_work_while_there_is_plenty(self):
+        scheduler = calibrated({0: 1.0, 1: 1.0, 2: 20.0, 3: 1.0})
+        # the fast node is busy for 20s with key 2, the slow one gets through key 3 before that
+        self.assertEqual(scheduler.assign(10.0), [(2, "fast"), (3, "slow")])
+
+    def test_speculates_on_stragglers(self):
+        scheduler = calibrated({0: 1.0, 1: 1.0, 2: 20.0, 3: 1.0})
+        scheduler.assign(10.0)
+
+        # not while something is queued, nor before key 3 is overdue on the slow node (predicted 10s from 10s)
+        self.assertEqual(scheduler.speculate(15.0), [])
+        self.assertEqual(scheduler.finished(2, "fast", 30.0, True), [])
+        self.assertEqual(scheduler.speculate(20.0), [])
+
+        self.assertEqual(scheduler.speculate(30.0), [(3, "fast")])
+        # one copy is enough
+        self.assertEqual(scheduler.speculate(31.0), [])
+
+        # the copy wins, the slow node's copy is the loser to cancel
+        self.assertEqual(scheduler.finished(3, "fast", 31.0, True), ["slow"])
+        self.assertEqual(scheduler.speculation_wins, 1)
+        self.assertEqual(scheduler.done, {0, 1, 2, 3})
+        self.assertEqual(scheduler.nodes["slow"].running, {})
+        # the loser reporting in later changes nothing
+        self.assertEqual(scheduler.finished(3, "slow", 40.0, True), [])
+
+    def test_failed_copy_leaves_the_other_running(self):
+        scheduler = calibrated({0: 1.0, 1: 1.0, 2: 20.0, 3: 1.0})
+        scheduler.assign(10.0)
+        scheduler.finished(2, "fast", 30.0, True)
+        scheduler.speculate(30.0)
+
+        self.assertEqual(scheduler.finished(3, "fast", 31.0, False), [])
+        self.assertNotIn(3, scheduler.done)
+        self.assertEqual(scheduler.finished(3, "slow", 35.0, True), [])
+        self.assertIn(3, scheduler.done)
+        self.assertEqual(scheduler.speculation_wins, 0)
+
+    def test_no_speculation_when_disabled(self):
+        scheduler = calibrated({0: 1.0, 1: 1.0, 2: 20.0, 3: 1.0}, speculate=False)
+        scheduler.assign(10.0)
+        scheduler.finished(2, "fast", 30.0, True)
+        self.assertEqual(scheduler.speculate(100.0), [])
+
+    def test_requeues_jobs_of_nodes_that_went_away(self):
+        scheduler = NodeScheduler({0: 1.0, 1: 1.0})
+        scheduler.update_nodes(NODES)
+        scheduler.assign(0.0)
+        slow_key = next(iter(scheduler.nodes["slow"].running))
+
+        # one missed sample can be a slow reply
+        self.assertEqual(scheduler.update_nodes({"fast": NODES["fast"]}), [])
+        self.assertIn("slow", scheduler.nodes)
+
+        self.assertEqual(scheduler.update_nodes({"fast": NODES["fast"]}), [slow_key])
+        self.assertNotIn("slow", scheduler.nodes)
+        self.assertEqual(scheduler.pending, [slow_key])
+
+        # the node came through after all, the requeued job is done
+        scheduler.finished(slow_key, "slow", 5.0, True)
+        self.assertEqual(scheduler.pending, [])
+        self.assertIn(slow_key, scheduler.done)
+
+    def test_answering_again_resets_missed_samples(self):
+        scheduler = NodeScheduler({0: 1.0, 1: 1.0})
+        scheduler.update_nodes(NODES)
+        scheduler.assign(0.0)
+        scheduler.update_nodes({"fast": NODES["fast"]})
+        scheduler.update_nodes(NODES)
+        self.assertEqual(scheduler.update_nodes({"fast": NODES["fast"]}), [])
+        self.assertIn("slow", scheduler.nodes)
+
+    def test_jobs_with_a_copy_elsewhere_are_not_requeued(self):
+        scheduler = calibrated({0: 1.0, 1: 1.0, 2: 20.0, 3: 1.0})
+        scheduler.assign(10.0)
+        scheduler.finished(2, "fast", 30.0, True)
+        scheduler.speculate(30.0)
+
+        scheduler.update_nodes({"fast": NODES["fast"]})
+        self.assertEqual(scheduler.update_nodes({"fast": NODES["fast"]}), [])
+        self.assertEqual(scheduler.pending, [])
+        self.assertIn(3, scheduler.nodes["fast"].running)
+
+
+if __name__ == "__main__":
+    unittest.main()
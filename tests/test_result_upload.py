@@ -0,0 +1,140 @@
+"""
+Chunk uploads from celery workers to the coordinator's server, over loopback
+python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from alabamaEncode.core.context import AlabamaContext
+from alabamaEncode.parallel_execution.coordinator_server import (
+    KEY_HEADER,
+    CoordinatorServer,
+    sha256_file,
+)
+from alabamaEncode.parallel_execution.result_upload import (
+    ChunkAlreadyUploaded,
+    ResultReceiver,
+    upload_result,
+)
+from alabamaEncode.scene.chunk import ChunkObject
+
+
+class TestResultUpload(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.ctx = AlabamaContext()
+        self.ctx.temp_folder = os.path.join(self.folder, "temp", "")
+        os.makedirs(os.path.join(self.ctx.temp_folder, "chunks"))
+
+        self.chunk = ChunkObject(0, 48, "in.mkv", 24, chunk_index=7)
+        self.chunk.chunk_path = os.path.join(self.ctx.temp_folder, "chunks", "7.ivf")
+
+        self.server = CoordinatorServer(self.ctx)
+        self.server.host = "127.0.0.1"
+        self.receiver = ResultReceiver(self.ctx, self.server, [self.chunk])
+        self.server.start()
+        self.upload = self.receiver.job_upload(self.chunk)
+
+        self.encoded = os.path.join(self.folder, "worker_7.ivf")
+        self.payload = os.urandom(3 * 1024**2 + 123)
+        with open(self.encoded, "wb") as f:
+            f.write(self.payload)
+        self.part = self.receiver._part_path(7, sha256_file(self.encoded))
+
+    def tearDown(self):
+        self.server.stop()
+        if self.ctx.kv is not None:
+            self.ctx.kv.close()
+        shutil.rmtree(self.folder)
+
+    def received(self) -> bytes:
+        with open(self.chunk.chunk_path, "rb") as f:
+            return f.read()
+
+    def test_upload(self):
+        sent = upload_result(self.encoded, self.upload)
+        self.assertEqual(sent, len(self.payload))
+        self.assertEqual(self.received(), self.payload)
+        self.assertFalse(os.path.exists(self.part))
+        self.assertEqual(self.receiver.received_chunks, 1)
+
+    def test_resumes_from_head_offset(self):
+        # a previous attempt got a megabyte across before the connection dropped
+        with open(self.part, "wb") as f:
+            f.write(self.payload[: 1024**2])
+
+        sent = upload_result(self.encoded, self.upload)
+        self.assertEqual(sent, len(self.payload) - 1024**2)
+        self.assertEqual(self.received(), self.payload)
+        self.assertEqual(self.receiver.resumed, 1)
+
+    def test_checksum_mismatch_starts_over(self):
+        # what arrived earlier got corrupted on the way, the hash over the whole file won't match
+        with open(self.part, "wb") as f:
+            f.write(b"\0" * 1024**2)
+
+        upload_result(self.encoded, self.upload)
+        self.assertEqual(self.receiver.rejected, 1)
+        self.assertEqual(self.received(), self.payload)
+
+    def test_second_copy_is_turned_away(self):
+        upload_result(self.encoded, self.upload)
+        with self.assertRaises(ChunkAlreadyUploaded):
+            upload_result(self.encoded, self.upload)
+        self.assertEqual(self.receiver.received_chunks, 1)
+
+    def test_bad_size_headers(self):
+        headers = {
+            KEY_HEADER: self.upload["key"],
+            "X-Content-Sha256": sha256_file(self.encoded),
+        }
+        for total in [None, "lots", "-1"]:
+            with self.subTest(total=total):
+                r = requests.put(
+                    self.upload["url"],
+                    data=self.payload[:10],
+                    headers=(
+                        headers if total is None else {**headers, "X-Total-Size": total}
+                    ),
+                    timeout=10,
+                )
+                self.assertEqual(r.status_code, 400)
+        self.assertFalse(os.path.exists(self.part))
+
+    def test_wrong_key(self):
+        r = requests.head(
+            self.upload["url"],
+            headers={KEY_HEADER: "nope", "X-Content-Sha256": "0" * 64},
+            timeout=10,
+        )
+        self.assertEqual(r.status_code, 403)
+
+    def test_record_stores_the_workers_kv_entries(self):
+        stats = {"chunk_index": 7, "size": 1000, "length_frames": 48}
+        self.receiver.record(
+            self.chunk,
+            stats,
+            [
+                ["final_chunk_crf", "7", 31, False],
+                ["chunk_timing", "7", {"chunk": 12.5}, True],
+                ["grain_synth", self.chunk.chunk_path, 6, False],
+            ],
+        )
+        kv = self.ctx.get_kv()
+        self.assertEqual(kv.get("final_chunk_crf", 7), 31)
+        self.assertEqual(kv.get("chunk_timing", 7), {"chunk": 12.5})
+        self.assertEqual(kv.get("grain_synth", self.chunk.chunk_path), 6)
+
+    def test_refuses_multi_res(self):
+        self.ctx.multi_res_pipeline = True
+        with self.assertRaises(ValueError):
+            ResultReceiver(self.ctx, self.server, [self.chunk])
+
+
+if __name__ == "__main__":
+    unittest.main()
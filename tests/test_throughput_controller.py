@@ -0,0 +1,79 @@
+"""
+ThroughputController against the deterministic simulator, same jobs same result
+python -m unittest discover tests
+"""
+
+import unittest
+
+from alabamaEncode.parallel_execution.throughput_controller import (
+    ThroughputController,
+)
+from alabamaEncode.parallel_execution.throughput_sim import (
+    controller_limit,
+    simulate,
+    synthetic_jobs,
+)
+
+CORES = 32
+
+
+def changes(history) -> list:
+    """
+    :return: the times the limit changed at
+    """
+    return [t for (t, a), (_, b) in zip(history, history[1:]) if a != b]
+
+
+class TestThroughputController(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.jobs = synthetic_jobs(count=1000, seed=0)
+        # throughput peaks once the cores are full, the best fixed limit is around there
+        cls.best_limit, cls.best_makespan = min(
+            (
+                (fixed, simulate(cls.jobs, lambda *_: fixed, cores=CORES)[0])
+                for fixed in range(CORES // 2, CORES * 2 + 1)
+            ),
+            key=lambda x: x[1],
+        )
+
+    def run_controller(self, start: int):
+        controller = ThroughputController(
+            start_limit=start, max_limit=CORES * 2, now=0.0
+        )
+        return simulate(self.jobs, controller_limit(controller), cores=CORES)
+
+    def test_converges_to_best_fixed_limit(self):
+        for start in [2, CORES // 2, CORES * 2]:
+            with self.subTest(start=start):
+                makespan, history = self.run_controller(start)
+                second_half = [limit for t, limit in history if t > makespan / 2]
+                self.assertLessEqual(makespan, self.best_makespan * 1.04)
+                self.assertLessEqual(
+                    max(abs(limit - self.best_limit) for limit in second_half), 4
+                )
+                self.assertEqual(history[-1][1], self.best_limit)
+
+    def test_settles(self):
+        for start in [2, CORES // 2, CORES * 2]:
+            with self.subTest(start=start):
+                makespan, history = self.run_controller(start)
+                changed = changes(history)
+                self.assertLessEqual(len(changed), 32)
+                # only the occasional probe once settled
+                self.assertLessEqual(sum(1 for t in changed if t > makespan / 2), 8)
+
+    def test_deterministic(self):
+        self.assertEqual(self.run_controller(16), self.run_controller(16))
+
+    def test_total_frames_only(self):
+        # without per-job counts it judges on total throughput, noisier but it still has to get there
+        controller = ThroughputController(start_limit=2, max_limit=CORES * 2, now=0.0)
+        makespan, history = simulate(
+            self.jobs, controller_limit(controller, per_job=False), cores=CORES
+        )
+        self.assertLessEqual(makespan, self.best_makespan * 1.1)
+
+
+if __name__ == "__main__":
+    unittest.main()